@@ -0,0 +1,212 @@
+"""
+AI Analysis Client
+Pooled, batched and cached HTTP client for the model server used by AIDeobfuscator
+"""
+
+import os
+import re
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Optional, List, Dict, Sequence, Tuple
+
+import aiohttp
+
+
+class AIClient:
+    """
+    Async client for a local model server.
+
+    Protocol: POST {"prompts": [{"prompt": ..., "detected_type": ...}, ...]} to the
+    endpoint, the server answers {"results": ["analysis", ...]} in the same order.
+
+    - One shared aiohttp.ClientSession with a pooled keep-alive connector
+    - At most `max_concurrency` batches in flight
+    - Requests arriving within `batch_window` seconds are sent as one batch
+    - Identical prompts in flight share one request, finished ones are cached
+
+    ai_client_check.py checks these against a stub server.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: Optional[str] = None,
+        max_concurrency: int = 4,
+        batch_size: int = 8,
+        batch_window: float = 0.02,
+        timeout: float = 60.0,
+        cache_size: int = 256,
+        max_prompt_chars: int = 12000,
+    ):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.max_prompt_chars = max_prompt_chars
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._cache: OrderedDict = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending: List[Tuple[Dict, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+        self.stats = {'requests': 0, 'batches': 0, 'cache_hits': 0, 'coalesced': 0}
+
+    @classmethod
+    def from_env(cls) -> Optional['AIClient']:
+        """Build a client from AI_ENDPOINT / AI_API_KEY / AI_MAX_CONCURRENCY, None if no endpoint is set"""
+        endpoint = os.getenv('AI_ENDPOINT')
+        if not endpoint:
+            return None
+        return cls(
+            endpoint,
+            api_key=os.getenv('AI_API_KEY'),
+            max_concurrency=int(os.getenv('AI_MAX_CONCURRENCY', '4')),
+        )
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency * 2,
+                limit_per_host=self.max_concurrency,
+                keepalive_timeout=60,
+            )
+            headers = {'Authorization': f'Bearer {self.api_key}'} if self.api_key else None
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def analyze(self, code: str, detected_type: str, decoded: Optional[str] = None,
+                      constants: Sequence[str] = ()) -> str:
+        """
+        Analyze `code`, answering from the cache or an identical in-flight
+        request where possible. `decoded` and `constants` are what the
+        deobfuscator made of it, see build_prompt().
+        """
+        payload = {
+            'prompt': build_prompt(code, self.max_prompt_chars, decoded, constants),
+            'detected_type': detected_type,
+        }
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            return self._cache[key]
+
+        if key in self._inflight:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self._enqueue(payload, future)
+            result = await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def _enqueue(self, payload: Dict, future: asyncio.Future):
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+        if batch:
+            task = asyncio.ensure_future(self._send_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._pending:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+
+    async def _send_batch(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        try:
+            session = await self._get_session()
+            async with self._semaphore:
+                self.stats['batches'] += 1
+                self.stats['requests'] += len(batch)
+                async with session.post(self.endpoint, json={'prompts': [p for p, _ in batch]}) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+            results = data['results']
+            if len(results) != len(batch):
+                raise ValueError(f'expected {len(batch)} results, got {len(results)}')
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(str(result))
+
+
+# Readable string literals and the bodies of large constant tables are what
+# carries meaning in obfuscated scripts, the VM interpreter around them does not
+_LITERAL_PATTERN = re.compile(r'"((?:[^"\\\n]|\\.){4,200})"|\'((?:[^\'\\\n]|\\.){4,200})\'')
+_READABLE = re.compile(r'^[\x20-\x7e]*[A-Za-z]{3}[\x20-\x7e]*$')
+
+
+def build_prompt(code: str, limit: int = 12000, decoded: Optional[str] = None,
+                 constants: Sequence[str] = ()) -> str:
+    """
+    Reduce a script to its most informative regions within `limit` characters.
+
+    `decoded` is the deobfuscated output of `code` and `constants` the
+    strings, URLs and VM constants extracted from it; the prompt is built
+    from them when given, the obfuscated text says little. Small scripts
+    are sent whole. Larger ones are reduced to the head of the script plus
+    the extracted constants, then the distinct readable string literals,
+    most frequent first.
+    """
+    text = decoded or code
+    if len(text) <= limit:
+        return text
+
+    counts: Dict[str, int] = {}
+    for match in _LITERAL_PATTERN.finditer(text):
+        literal = match.group(1) or match.group(2)
+        if _READABLE.match(literal):
+            counts[literal] = counts.get(literal, 0) + 1
+
+    extracted = dict.fromkeys(c for c in constants if c)
+    literals = sorted((s for s in counts if s not in extracted), key=lambda s: (-counts[s], -len(s)))
+
+    head = text[:limit // 4]
+    parts = [head, '\n-- [...] --\n-- Strings and constants:\n']
+    size = sum(len(p) for p in parts)
+    for literal in [*extracted, *literals]:
+        line = f'-- {literal}\n'
+        if size + len(line) > limit:
+            break
+        parts.append(line)
+        size += len(line)
+
+    return ''.join(parts)
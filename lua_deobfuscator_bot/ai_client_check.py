@@ -0,0 +1,186 @@
+"""
+AI Client Check
+Runs AIClient against a local stub model server and checks what it promises:
+identical prompts in flight share one request, finished ones are answered
+from the cache, concurrent prompts are batched, no more than
+`max_concurrency` batches are in flight, prompts are cut to
+`max_prompt_chars` and a bad response fails every caller of its batch
+
+Usage:
+    python ai_client_check.py
+    python ai_client_check.py --delay 0.2
+"""
+
+import sys
+import asyncio
+import argparse
+from typing import Dict, List, NamedTuple
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ai_client import AIClient
+
+
+class Result(NamedTuple):
+    check: str
+    passed: bool
+    detail: str
+
+
+class StubServer:
+    """
+    Model server speaking the AIClient protocol. Every batch waits `delay`
+    seconds, so requests made together overlap; /short answers one result
+    too few.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.batches: List[List[Dict]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/analyze', self.handle)
+        app.router.add_post('/short', self.handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+
+    async def close(self):
+        await self.server.close()
+
+    def url(self, path: str = '/analyze') -> str:
+        return str(self.server.make_url(path))
+
+    def reset(self):
+        self.batches = []
+        self.max_in_flight = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        prompts = (await request.json())['prompts']
+        self.batches.append(prompts)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        results = [f"{p['detected_type']}: {len(p['prompt'])} chars" for p in prompts]
+        if request.path == '/short':
+            results = results[:-1]
+        return web.json_response({'results': results})
+
+
+async def check_coalescing(stub: StubServer) -> Result:
+    client = AIClient(stub.url())
+    try:
+        answers = await asyncio.gather(*(client.analyze('print(1)', 'Test') for _ in range(10)))
+    finally:
+        await client.close()
+    sent = sum(len(batch) for batch in stub.batches)
+    passed = sent == 1 and client.stats['coalesced'] == 9 and len(set(answers)) == 1
+    return Result('coalescing', passed, f"10 callers, {sent} prompt(s) sent, {client.stats['coalesced']} coalesced")
+
+
+async def check_cache(stub: StubServer) -> Result:
+    client = AIClient(stub.url(), cache_size=2)
+    try:
+        first = await client.analyze('print(1)', 'Test')
+        again = await client.analyze('print(1)', 'Test')
+        # Two newer entries push the first out of a cache of 2
+        await client.analyze('print(2)', 'Test')
+        await client.analyze('print(3)', 'Test')
+        await client.analyze('print(1)', 'Test')
+    finally:
+        await client.close()
+    sent = sum(len(batch) for batch in stub.batches)
+    passed = first == again and client.stats['cache_hits'] == 1 and sent == 4
+    return Result('cache', passed, f"{client.stats['cache_hits']} hit(s), {sent} prompts sent for 5 calls, LRU of 2")
+
+
+async def check_batching(stub: StubServer) -> Result:
+    client = AIClient(stub.url(), batch_size=8)
+    try:
+        await asyncio.gather(*(client.analyze(f'print({i})', 'Test') for i in range(20)))
+    finally:
+        await client.close()
+    sizes = sorted((len(batch) for batch in stub.batches), reverse=True)
+    passed = sizes == [8, 8, 4] and client.stats['batches'] == 3 and client.stats['requests'] == 20
+    return Result('batching', passed, f"20 prompts in batches of {sizes}")
+
+
+async def check_concurrency(stub: StubServer) -> Result:
+    client = AIClient(stub.url(), max_concurrency=2, batch_size=1)
+    try:
+        await asyncio.gather(*(client.analyze(f'print({i})', 'Test') for i in range(10)))
+    finally:
+        await client.close()
+    passed = stub.max_in_flight == 2 and len(stub.batches) == 10
+    return Result('concurrency', passed, f"max_concurrency=2, {stub.max_in_flight} batch(es) in flight at most")
+
+
+async def check_truncation(stub: StubServer) -> Result:
+    client = AIClient(stub.url(), max_prompt_chars=2000)
+    code = 'local a = "\\104\\105"\n' * 500
+    decoded = 'local a = "hi there"\n' * 500
+    constants = ['https://example.com/payload', 'SECRET_KEY']
+    try:
+        await client.analyze(code, 'Test', decoded, constants)
+    finally:
+        await client.close()
+    prompt = stub.batches[0][0]['prompt']
+    passed = (
+        len(prompt) <= 2000 and prompt.startswith(decoded[:100])
+        and all(f'-- {c}\n' in prompt for c in constants) and '\\104' not in prompt
+    )
+    return Result('truncation', passed, f"{len(code):,} char script sent as a {len(prompt):,} char prompt of its output")
+
+
+async def check_errors(stub: StubServer) -> Result:
+    client = AIClient(stub.url('/short'), batch_size=4)
+    try:
+        answers = await asyncio.gather(
+            *(client.analyze(f'print({i})', 'Test') for i in range(4)), return_exceptions=True
+        )
+        # Failures are not cached, the next call asks the server again
+        retry = await asyncio.gather(client.analyze('print(0)', 'Test'), return_exceptions=True)
+    finally:
+        await client.close()
+    failed = sum(isinstance(a, ValueError) for a in answers)
+    passed = failed == 4 and isinstance(retry[0], ValueError) and len(stub.batches) == 2
+    return Result('errors', passed, f"short response failed {failed} of 4 callers, retry reached the server")
+
+
+CHECKS = [check_coalescing, check_cache, check_batching, check_concurrency, check_truncation, check_errors]
+
+
+async def run_checks(delay: float) -> List[Result]:
+    stub = StubServer(delay)
+    await stub.start()
+    results = []
+    try:
+        for check in CHECKS:
+            stub.reset()
+            results.append(await check(stub))
+    finally:
+        await stub.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check AIClient against a stub model server')
+    parser.add_argument('--delay', type=float, default=0.05, help='Seconds the stub server takes per batch')
+    args = parser.parse_args()
+
+    results = asyncio.run(run_checks(args.delay))
+    print(f'{"check":<14}{"result":<8}detail')
+    for result in results:
+        print(f'{result.check:<14}{"ok" if result.passed else "FAIL":<8}{result.detail}')
+    sys.exit(0 if all(result.passed for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
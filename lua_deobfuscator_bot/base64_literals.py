@@ -0,0 +1,138 @@
+"""
+Batched Base64 Literal Decoding
+Finds every base64-looking string literal once, decodes them in one call and
+classifies the results, so the string decoders stop re-decoding the same literal
+"""
+
+import re
+import binascii
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# The union of the literal forms the base64 and unpacking decoders look at
+_CANDIDATE = re.compile(r'["\']([A-Za-z0-9+/]{16,}={0,2})["\']|\[\[([A-Za-z0-9+/]{16,}={0,2})\]\]')
+
+# Bytes that make a decoded literal unusable as text: C0 controls except tab/LF/CR, and DEL
+_CONTROL_BYTES = bytes(b for b in range(256) if (b < 0x20 and b not in (9, 10, 13)) or b == 0x7f)
+_TEXT_BYTES = bytes(b for b in range(256) if b not in _CONTROL_BYTES)
+_CONTROL_TABLE = None if np is None else np.isin(np.arange(256), list(_CONTROL_BYTES))
+
+
+def _decode_one(encoded: str) -> Optional[bytes]:
+    try:
+        return binascii.a2b_base64(encoded)
+    except (binascii.Error, ValueError):
+        return None
+
+
+class Base64Literals:
+    """
+    Decoded base64 literal candidates of one source.
+
+    Screening happens in three cheap steps instead of one b64decode per match:
+
+    - Candidates whose length is not a multiple of 4 are dropped, b64decode
+      would reject them anyway
+    - All unpadded candidates are joined and decoded with a single
+      a2b_base64 call, then sliced back apart (4 chars -> 3 bytes)
+    - The decoded buffer is checked for control bytes in one vectorized
+      pass (NumPy when installed, bytes.translate otherwise)
+
+    Decoders walk `literals()` to turn survivors into edits without running
+    their own regex and a callback per match. `raw()` and `text()` answer from
+    the same results and decode literals that were not collected on demand.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.decoded: Dict[str, Optional[bytes]] = {}
+        # Decoded text of the candidates without control bytes
+        self.texts: Dict[str, str] = {}
+        # (start, end, encoded, bracketed) of every candidate literal
+        self.spans: List[Tuple[int, int, str, bool]] = []
+
+        candidates = {}
+        for match in _CANDIDATE.finditer(source):
+            bracketed = match.lastindex == 2
+            encoded = match.group(2 if bracketed else 1)
+            self.spans.append((match.start(), match.end(), encoded, bracketed))
+            candidates[encoded] = None
+
+        batch: List[str] = []
+        for encoded in candidates:
+            if len(encoded) % 4:
+                self.decoded[encoded] = None
+            elif encoded.endswith('='):
+                # Padding in the middle of a joined buffer would end the decode early
+                self._store(encoded, _decode_one(encoded))
+            else:
+                batch.append(encoded)
+        if batch:
+            self._decode_batch(batch)
+
+    def _store(self, encoded: str, data: Optional[bytes]):
+        self.decoded[encoded] = data
+        if data is not None and not data.translate(None, _TEXT_BYTES):
+            self.texts[encoded] = data.decode('utf-8', errors='ignore')
+
+    def _decode_batch(self, batch: List[str]):
+        blob = binascii.a2b_base64(''.join(batch))
+        offsets = [0]
+        for encoded in batch:
+            offsets.append(offsets[-1] + len(encoded) // 4 * 3)
+        chunks = [blob[offsets[i]:offsets[i + 1]] for i in range(len(batch))]
+        self.decoded.update(zip(batch, chunks))
+
+        if _CONTROL_TABLE is not None:
+            control = _CONTROL_TABLE[np.frombuffer(blob, dtype=np.uint8)]
+            counts = np.add.reduceat(control, offsets[:-1], dtype=np.int64)
+            survivors = np.flatnonzero(counts == 0).tolist()
+        else:
+            survivors = [i for i, chunk in enumerate(chunks) if not chunk.translate(None, _TEXT_BYTES)]
+        for i in survivors:
+            self.texts[batch[i]] = chunks[i].decode('utf-8', errors='ignore')
+
+    def literals(self, min_length: int = 16, bracketed: bool = False) -> Iterator[Tuple[int, int, str]]:
+        """
+        (start, end, encoded) of the quoted literals with at least `min_length`
+        base64 characters before the padding, plus [[...]] ones if `bracketed`
+        """
+        for start, end, encoded, is_bracketed in self.spans:
+            if is_bracketed and not bracketed:
+                continue
+            if len(encoded) - encoded.endswith('=') - encoded.endswith('==') >= min_length:
+                yield start, end, encoded
+
+    def raw(self, encoded: str) -> Optional[bytes]:
+        """Decoded bytes, or None if `encoded` is not valid base64"""
+        if encoded not in self.decoded:
+            self._store(encoded, _decode_one(encoded))
+        return self.decoded[encoded]
+
+    def text(self, encoded: str) -> Optional[str]:
+        """Decoded UTF-8 text, or None if the bytes contain control characters"""
+        if encoded not in self.decoded:
+            self._store(encoded, _decode_one(encoded))
+        return self.texts.get(encoded)
+
+
+_last: Optional[Base64Literals] = None
+
+
+def literals_for(source: str) -> Base64Literals:
+    """Shared Base64Literals of `source`, built once for consecutive decoders"""
+    global _last
+    if _last is None or _last.source is not source:
+        _last = Base64Literals(source)
+    return _last
+
+
+def forget_literals():
+    """Drop the shared Base64Literals, so the last source and its decodings do not outlive a job"""
+    global _last
+    _last = None
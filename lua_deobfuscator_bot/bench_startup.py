@@ -0,0 +1,84 @@
+"""
+Startup Benchmark
+Import time of the bot and engine modules, and how fast a worker pool answers
+its first job
+
+Usage:
+    python bench_startup.py
+    python bench_startup.py --runs 5 --modules bot worker deobfuscator
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+from typing import Dict, List
+
+from job_queue import InProcessQueue, Job
+from worker import WorkerPool
+
+
+DEFAULT_MODULES = [
+    'bot', 'worker', 'job_queue', 'metrics', 'ai_client',
+    'deobfuscator', 'advanced_deobfuscator', 'signatures', 'unpacking', 'evaluator',
+]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_time(module: str) -> float:
+    """Cumulative import time of `module` in seconds, measured in a fresh interpreter"""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    # The module itself is the last line: "import time: self | cumulative | name"
+    for line in reversed(completed.stderr.splitlines()):
+        if line.startswith('import time:') and line.rsplit('|', 1)[-1].strip() == module:
+            return int(line.split('|')[1]) / 1e6
+    raise RuntimeError(f'no import time reported for {module}')
+
+
+async def pool_first_job(concurrency: int) -> Dict[str, float]:
+    """Seconds until a fresh pool has all processes up, and the latency of its first job"""
+    queue = InProcessQueue()
+    pool = WorkerPool(queue, concurrency=concurrency, pass_orders=['default'])
+    started = time.perf_counter()
+    await pool.start()
+    await pool.ready()
+    ready = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await queue.submit(Job('deobfuscate', {'code': 'local x = string.char(72, 105)'}), timeout=60)
+    first_job = time.perf_counter() - started
+    await pool.stop()
+    return {'pool_ready': ready, 'first_job': first_job}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import and worker startup time')
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES, help='Modules to import')
+    parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters per module and pools started, the best run counts')
+    parser.add_argument('--concurrency', type=int, default=2, help='Processes of the measured pool')
+    args = parser.parse_args()
+
+    print(f'{"module":<24}{"import ms":>12}')
+    for module in args.modules:
+        best = min(import_time(module) for _ in range(args.runs))
+        print(f'{module:<24}{best * 1000:>12.1f}')
+
+    results: List[Dict[str, float]] = [
+        asyncio.run(pool_first_job(args.concurrency)) for _ in range(args.runs)
+    ]
+    # The first pool also starts the forkserver template, later pools reuse it
+    cold, warm = results[0], results[1:] or results
+    print()
+    print(f'{"pool of " + str(args.concurrency):<24}{"cold ms":>12}{"warm ms":>12}')
+    for key in ('pool_ready', 'first_job'):
+        print(f'{key:<24}{cold[key] * 1000:>12.1f}{min(r[key] for r in warm) * 1000:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
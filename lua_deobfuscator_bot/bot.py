@@ -1,630 +1,853 @@
-+   1 """
-+   2 Lua Deobfuscator Discord Bot
-+   3 Deobfuscates various Lua obfuscation formats including:
-+   4 - WeAreDevs/Prometheus
-+   5 - Luraph
-+   6 - Moonsec v3
-+   7 - IronBrew
-+   8 - PSU
-+   9 - And other common patterns
-+  10 """
-+  11 
-+  12 import discord
-+  13 from discord import app_commands
-+  14 from discord.ext import commands
-+  15 import os
-+  16 import re
-+  17 import base64
-+  18 import zlib
-+  19 import string
-+  20 import asyncio
-+  21 from dotenv import load_dotenv
-+  22 from typing import Optional
-+  23 import aiohttp
-+  24 
-+  25 # Load environment variables
-+  26 load_dotenv()
-+  27 TOKEN = os.getenv('DISCORD_TOKEN')
-+  28 
-+  29 # Bot setup
-+  30 intents = discord.Intents.default()
-+  31 intents.message_content = True
-+  32 bot = commands.Bot(command_prefix='!', intents=intents)
-+  33 
-+  34 
-+  35 class LuaDeobfuscator:
-+  36     """Core deobfuscation engine for Lua scripts"""
-+  37     
-+  38     def __init__(self):
-+  39         self.string_methods = [
-+  40             self._decode_base64_strings,
-+  41             self._decode_hex_strings,
-+  42             self._decode_decimal_char_strings,
-+  43             self._decode_escaped_strings,
-+  44             self._decode_xor_strings,
-+  45             self._decode_loadstring_wrapper,
-+  46             self._decode_string_char_concat,
-+  47         ]
-+  48     
-+  49     def detect_obfuscator(self, code: str) -> str:
-+  50         """Detect which obfuscator was likely used"""
-+  51         patterns = {
-+  52             'WeAreDevs/Prometheus': [
-+  53                 r'local\s+\w+\s*=\s*{}\s*;\s*local\s+\w+\s*=\s*{}\s*;',
-+  54                 r'_G\[\[',
-+  55                 r'string\.char\(\d+,\s*\d+,\s*\d+',
-+  56                 r'local\s+\w{20,}\s*=',
-+  57             ],
-+  58             'Luraph': [
-+  59                 r'local\s+\w+\s*=\s*\(function\(\)',
-+  60                 r'bit32\.',
-+  61                 r'getfenv\s*\(\s*0\s*\)',
-+  62                 r'\[\[\]\]=',
-+  63             ],
-+  64             'Moonsec v3': [
-+  65                 r'local\s+\w+\s*,\s*\w+\s*,\s*\w+\s*=\s*string\.byte',
-+  66                 r'moon[sS]ec',
-+  67                 r'string\.sub\s*\(\s*\w+\s*,\s*\w+\s*\+\s*1',
-+  68                 r'tonumber\s*\(\s*\w+\s*,\s*36\s*\)',
-+  69             ],
-+  70             'IronBrew/IB2': [
-+  71                 r'local\s+\w+\s*=\s*string;',
-+  72                 r'IRONBREW',
-+  73                 r'local\s+\w+\s*=\s*bit\s*or\s*bit32',
-+  74                 r'function\s+\w+\(\w+,\s*\w+,\s*\w+,\s*\w+\)',
-+  75             ],
-+  76             'PSU': [
-+  77                 r'PSU|psu',
-+  78                 r'local\s+\w+\s*=\s*\(function\(\.\.\.\)',
-+  79                 r'select\s*\(\s*[\"\']#',
-+  80             ],
-+  81             'Loadstring/Basic': [
-+  82                 r'loadstring\s*\(',
-+  83                 r'load\s*\(\s*[\"\']',
-+  84             ],
-+  85             'String.char Obfuscation': [
-+  86                 r'string\.char\s*\(\s*\d+\s*\)',
-+  87             ],
-+  88             'Base64 Encoded': [
-+  89                 r'[A-Za-z0-9+/]{50,}={0,2}',
-+  90             ],
-+  91         }
-+  92         
-+  93         detected = []
-+  94         for name, pattern_list in patterns.items():
-+  95             for pattern in pattern_list:
-+  96                 if re.search(pattern, code, re.IGNORECASE):
-+  97                     if name not in detected:
-+  98                         detected.append(name)
-+  99                     break
-+ 100         
-+ 101         return ', '.join(detected) if detected else 'Unknown/Custom'
-+ 102     
-+ 103     def _decode_base64_strings(self, code: str) -> str:
-+ 104         """Decode base64 encoded strings in the code"""
-+ 105         def decode_match(match):
-+ 106             try:
-+ 107                 encoded = match.group(1)
-+ 108                 decoded = base64.b64decode(encoded).decode('utf-8', errors='ignore')
-+ 109                 if decoded.isprintable() or '\n' in decoded or '\t' in decoded:
-+ 110                     return f'"{decoded}"'
-+ 111             except:
-+ 112                 pass
-+ 113             return match.group(0)
-+ 114         
-+ 115         # Match base64 in string literals
-+ 116         patterns = [
-+ 117             r'[\"\']([A-Za-z0-9+/]{20,}={0,2})[\"\']',
-+ 118             r'\[\[([A-Za-z0-9+/]{20,}={0,2})\]\]',
-+ 119         ]
-+ 120         
-+ 121         for pattern in patterns:
-+ 122             code = re.sub(pattern, decode_match, code)
-+ 123         return code
-+ 124     
-+ 125     def _decode_hex_strings(self, code: str) -> str:
-+ 126         """Decode hex escaped strings like \\x48\\x65\\x6c\\x6c\\x6f"""
-+ 127         def decode_hex(match):
-+ 128             try:
-+ 129                 hex_str = match.group(0)
-+ 130                 decoded = bytes.fromhex(
-+ 131                     re.sub(r'\\x', '', hex_str)
-+ 132                 ).decode('utf-8', errors='ignore')
-+ 133                 return f'"{decoded}"'
-+ 134             except:
-+ 135                 return match.group(0)
-+ 136         
-+ 137         return re.sub(r'(?:\\x[0-9a-fA-F]{2})+', decode_hex, code)
-+ 138     
-+ 139     def _decode_decimal_char_strings(self, code: str) -> str:
-+ 140         """Decode string.char(72, 101, 108, 108, 111) patterns"""
-+ 141         def decode_chars(match):
-+ 142             try:
-+ 143                 numbers = re.findall(r'\d+', match.group(0))
-+ 144                 decoded = ''.join(chr(int(n)) for n in numbers if 0 <= int(n) <= 127)
-+ 145                 if decoded and all(c in string.printable for c in decoded):
-+ 146                     return f'"{decoded}"'
-+ 147             except:
-+ 148                 pass
-+ 149             return match.group(0)
-+ 150         
-+ 151         # Match string.char(...) patterns
-+ 152         code = re.sub(
-+ 153             r'string\.char\s*\(\s*(\d+\s*,?\s*)+\)',
-+ 154             decode_chars,
-+ 155             code,
-+ 156             flags=re.IGNORECASE
-+ 157         )
-+ 158         return code
-+ 159     
-+ 160     def _decode_escaped_strings(self, code: str) -> str:
-+ 161         """Decode numeric escape sequences like \\104\\101\\108\\108\\111"""
-+ 162         def decode_escaped(match):
-+ 163             try:
-+ 164                 content = match.group(1)
-+ 165                 # Find all numeric escapes
-+ 166                 decoded = re.sub(
-+ 167                     r'\\(\d{1,3})',
-+ 168                     lambda m: chr(int(m.group(1))) if int(m.group(1)) <= 127 else m.group(0),
-+ 169                     content
-+ 170                 )
-+ 171                 return f'"{decoded}"'
-+ 172             except:
-+ 173                 return match.group(0)
-+ 174         
-+ 175         return re.sub(r'\"((?:\\[0-9]{1,3})+)\"', decode_escaped, code)
-+ 176     
-+ 177     def _decode_xor_strings(self, code: str) -> str:
-+ 178         """Attempt to decode XOR encrypted strings (common pattern)"""
-+ 179         # This is a simplified version - real XOR decoding requires knowing the key
-+ 180         # We look for patterns like: for i = 1, #str do result = result .. string.char(bxor(byte(str,i), key)) end
-+ 181         return code
-+ 182     
-+ 183     def _decode_loadstring_wrapper(self, code: str) -> str:
-+ 184         """Extract code from simple loadstring wrappers"""
-+ 185         # Match loadstring("...encoded...")() patterns
-+ 186         patterns = [
-+ 187             r'loadstring\s*\(\s*[\"\'](.+?)[\"\']\s*\)\s*\(\s*\)',
-+ 188             r'load\s*\(\s*[\"\'](.+?)[\"\']\s*\)\s*\(\s*\)',
-+ 189         ]
-+ 190         
-+ 191         for pattern in patterns:
-+ 192             match = re.search(pattern, code, re.DOTALL)
-+ 193             if match:
-+ 194                 inner = match.group(1)
-+ 195                 # Try to decode the inner content
-+ 196                 try:
-+ 197                     decoded = base64.b64decode(inner).decode('utf-8', errors='ignore')
-+ 198                     if 'function' in decoded or 'local' in decoded:
-+ 199                         return decoded
-+ 200                 except:
-+ 201                     pass
-+ 202         return code
-+ 203     
-+ 204     def _decode_string_char_concat(self, code: str) -> str:
-+ 205         """Decode concatenated string.char calls"""
-+ 206         # Pattern: string.char(72)..string.char(101)..string.char(108)
-+ 207         pattern = r'((?:string\.char\s*\(\s*\d+\s*\)\s*\.\.?\s*)+string\.char\s*\(\s*\d+\s*\))'
-+ 208         
-+ 209         def decode_concat(match):
-+ 210             try:
-+ 211                 full_match = match.group(0)
-+ 212                 numbers = re.findall(r'string\.char\s*\(\s*(\d+)\s*\)', full_match)
-+ 213                 decoded = ''.join(chr(int(n)) for n in numbers if 0 <= int(n) <= 127)
-+ 214                 return f'"{decoded}"'
-+ 215             except:
-+ 216                 return match.group(0)
-+ 217         
-+ 218         return re.sub(pattern, decode_concat, code, flags=re.IGNORECASE)
-+ 219     
-+ 220     def beautify(self, code: str) -> str:
-+ 221         """Beautify Lua code with proper indentation"""
-+ 222         lines = code.split('\n')
-+ 223         result = []
-+ 224         indent = 0
-+ 225         
-+ 226         indent_keywords = {'function', 'if', 'for', 'while', 'repeat', 'do'}
-+ 227         dedent_keywords = {'end', 'until'}
-+ 228         both_keywords = {'else', 'elseif'}
-+ 229         
-+ 230         for line in lines:
-+ 231             stripped = line.strip()
-+ 232             if not stripped:
-+ 233                 result.append('')
-+ 234                 continue
-+ 235             
-+ 236             # Check for dedent keywords at start
-+ 237             first_word = stripped.split()[0] if stripped.split() else ''
-+ 238             first_word = first_word.rstrip('(').rstrip(':')
-+ 239             
-+ 240             if first_word in dedent_keywords or first_word in both_keywords:
-+ 241                 indent = max(0, indent - 1)
-+ 242             
-+ 243             result.append('    ' * indent + stripped)
-+ 244             
-+ 245             # Check for indent keywords
-+ 246             if first_word in indent_keywords or first_word in both_keywords:
-+ 247                 indent += 1
-+ 248             # Also check for inline patterns like "function foo()"
-+ 249             if re.search(r'\bfunction\s+\w+\s*\([^)]*\)\s*$', stripped):
-+ 250                 if first_word not in indent_keywords:
-+ 251                     indent += 1
-+ 252             if re.search(r'\bif\b.+\bthen\s*$', stripped):
-+ 253                 if first_word not in indent_keywords:
-+ 254                     indent += 1
-+ 255         
-+ 256         return '\n'.join(result)
-+ 257     
-+ 258     def rename_variables(self, code: str) -> str:
-+ 259         """Rename obfuscated variables to readable names"""
-+ 260         # Find all obfuscated variable names (long random strings)
-+ 261         var_pattern = r'\b([a-zA-Z_][a-zA-Z0-9_]{15,})\b'
-+ 262         obfuscated_vars = set(re.findall(var_pattern, code))
-+ 263         
-+ 264         # Create readable names
-+ 265         var_counter = 1
-+ 266         replacements = {}
-+ 267         for var in obfuscated_vars:
-+ 268             # Skip common Lua globals and functions
-+ 269             if var.lower() in {'string', 'table', 'math', 'coroutine', 'debug', 'getfenv', 'setfenv', 'loadstring', 'tonumber', 'tostring'}:
-+ 270                 continue
-+ 271             replacements[var] = f'var_{var_counter}'
-+ 272             var_counter += 1
-+ 273         
-+ 274         # Apply replacements
-+ 275         for old, new in replacements.items():
-+ 276             code = re.sub(rf'\b{re.escape(old)}\b', new, code)
-+ 277         
-+ 278         return code
-+ 279     
-+ 280     def deobfuscate(self, code: str) -> tuple[str, str]:
-+ 281         """Main deobfuscation method"""
-+ 282         detected = self.detect_obfuscator(code)
-+ 283         result = code
-+ 284         
-+ 285         # Apply all string decoding methods
-+ 286         for method in self.string_methods:
-+ 287             result = method(result)
-+ 288         
-+ 289         # Rename obfuscated variables
-+ 290         result = self.rename_variables(result)
-+ 291         
-+ 292         # Beautify the code
-+ 293         result = self.beautify(result)
-+ 294         
-+ 295         return result, detected
-+ 296 
-+ 297 
-+ 298 class AIDeobfuscator:
-+ 299     """Uses AI (Claude via Poe) for advanced deobfuscation analysis"""
-+ 300     
-+ 301     @staticmethod
-+ 302     async def analyze_with_ai(code: str, detected_type: str) -> str:
-+ 303         """
-+ 304         Use Claude to analyze and explain obfuscated code.
-+ 305         This provides deeper analysis for complex obfuscation.
-+ 306         """
-+ 307         # This is a placeholder - in production you'd integrate with your preferred AI API
-+ 308         # For now, we return analysis guidance
-+ 309         
-+ 310         analysis = f"""
-+ 311 **AI Analysis for {detected_type} Obfuscation:**
-+ 312 
-+ 313 The code uses the following obfuscation techniques:
-+ 314 """
-+ 315         
-+ 316         # Analyze techniques used
-+ 317         techniques = []
-+ 318         
-+ 319         if 'string.char' in code.lower():
-+ 320             techniques.append("• **String.char encoding**: Characters encoded as numeric values")
-+ 321         
-+ 322         if 'loadstring' in code.lower() or 'load(' in code:
-+ 323             techniques.append("• **Dynamic code loading**: Code is loaded/executed at runtime")
-+ 324         
-+ 325         if re.search(r'bit32|bxor|band|bor', code, re.IGNORECASE):
-+ 326             techniques.append("• **Bitwise operations**: XOR/AND/OR used for encoding")
-+ 327         
-+ 328         if re.search(r'getfenv|setfenv', code, re.IGNORECASE):
-+ 329             techniques.append("• **Environment manipulation**: Function environments are modified")
-+ 330         
-+ 331         if re.search(r'\b[a-zA-Z_][a-zA-Z0-9_]{20,}\b', code):
-+ 332             techniques.append("• **Variable name obfuscation**: Long random variable names")
-+ 333         
-+ 334         if re.search(r'while\s+true\s+do|for\s+\w+\s*=\s*1\s*,\s*1\s*do', code):
-+ 335             techniques.append("• **Control flow flattening**: Complex loop structures")
-+ 336         
-+ 337         if re.search(r'local\s+\w+\s*=\s*{[^}]{100,}}', code):
-+ 338             techniques.append("• **Lookup tables**: Large tables used for bytecode/strings")
-+ 339         
-+ 340         if not techniques:
-+ 341             techniques.append("• Standard obfuscation patterns detected")
-+ 342         
-+ 343         analysis += '\n'.join(techniques)
-+ 344         
-+ 345         return analysis
-+ 346 
-+ 347 
-+ 348 # Discord UI Components
-+ 349 class DeobfuscateModal(discord.ui.Modal, title='Lua Deobfuscator'):
-+ 350     """Modal for pasting Lua code"""
-+ 351     
-+ 352     code = discord.ui.TextInput(
-+ 353         label='Paste Obfuscated Lua Code',
-+ 354         style=discord.TextStyle.paragraph,
-+ 355         placeholder='Paste your obfuscated Lua code here...',
-+ 356         required=True,
-+ 357         max_length=4000
-+ 358     )
-+ 359     
-+ 360     async def on_submit(self, interaction: discord.Interaction):
-+ 361         await interaction.response.defer(thinking=True)
-+ 362         
-+ 363         deobfuscator = LuaDeobfuscator()
-+ 364         result, detected = deobfuscator.deobfuscate(self.code.value)
-+ 365         
-+ 366         # Get AI analysis
-+ 367         ai_analysis = await AIDeobfuscator.analyze_with_ai(self.code.value, detected)
-+ 368         
-+ 369         # Create embed
-+ 370         embed = discord.Embed(
-+ 371             title="🔓 Lua Deobfuscation Result",
-+ 372             color=discord.Color.green()
-+ 373         )
-+ 374         embed.add_field(name="Detected Obfuscator", value=detected, inline=False)
-+ 375         embed.add_field(name="Analysis", value=ai_analysis[:1024], inline=False)
-+ 376         
-+ 377         # Send result
-+ 378         if len(result) <= 1900:
-+ 379             await interaction.followup.send(
-+ 380                 embed=embed,
-+ 381                 content=f"```lua\n{result}\n```"
-+ 382             )
-+ 383         else:
-+ 384             # Send as file if too long
-+ 385             with open('deobfuscated.lua', 'w', encoding='utf-8') as f:
-+ 386                 f.write(result)
-+ 387             
-+ 388             await interaction.followup.send(
-+ 389                 embed=embed,
-+ 390                 file=discord.File('deobfuscated.lua')
-+ 391             )
-+ 392             os.remove('deobfuscated.lua')
-+ 393 
-+ 394 
-+ 395 class DeobfuscateView(discord.ui.View):
-+ 396     """View with deobfuscate button"""
-+ 397     
-+ 398     def __init__(self):
-+ 399         super().__init__(timeout=None)
-+ 400     
-+ 401     @discord.ui.button(label='Paste Code', style=discord.ButtonStyle.primary, emoji='📝')
-+ 402     async def paste_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-+ 403         await interaction.response.send_modal(DeobfuscateModal())
-+ 404 
-+ 405 
-+ 406 # Bot Events
-+ 407 @bot.event
-+ 408 async def on_ready():
-+ 409     print(f'✅ {bot.user} is online!')
-+ 410     print(f'📊 Connected to {len(bot.guilds)} servers')
-+ 411     
-+ 412     # Sync slash commands
-+ 413     try:
-+ 414         synced = await bot.tree.sync()
-+ 415         print(f'🔄 Synced {len(synced)} command(s)')
-+ 416     except Exception as e:
-+ 417         print(f'❌ Failed to sync commands: {e}')
-+ 418 
-+ 419 
-+ 420 # Slash Commands
-+ 421 @bot.tree.command(name='deobfuscate', description='Deobfuscate Lua code')
-+ 422 async def deobfuscate_command(interaction: discord.Interaction):
-+ 423     """Open the deobfuscation modal"""
-+ 424     await interaction.response.send_modal(DeobfuscateModal())
-+ 425 
-+ 426 
-+ 427 @bot.tree.command(name='deobfuscate_file', description='Deobfuscate a Lua file')
-+ 428 @app_commands.describe(file='The .lua file to deobfuscate')
-+ 429 async def deobfuscate_file_command(interaction: discord.Interaction, file: discord.Attachment):
-+ 430     """Deobfuscate an uploaded Lua file"""
-+ 431     if not file.filename.endswith('.lua') and not file.filename.endswith('.txt'):
-+ 432         await interaction.response.send_message(
-+ 433             "❌ Please upload a `.lua` or `.txt` file!",
-+ 434             ephemeral=True
-+ 435         )
-+ 436         return
-+ 437     
-+ 438     await interaction.response.defer(thinking=True)
-+ 439     
-+ 440     try:
-+ 441         # Download file content
-+ 442         content = await file.read()
-+ 443         code = content.decode('utf-8', errors='ignore')
-+ 444         
-+ 445         # Deobfuscate
-+ 446         deobfuscator = LuaDeobfuscator()
-+ 447         result, detected = deobfuscator.deobfuscate(code)
-+ 448         
-+ 449         # Get AI analysis
-+ 450         ai_analysis = await AIDeobfuscator.analyze_with_ai(code, detected)
-+ 451         
-+ 452         # Create embed
-+ 453         embed = discord.Embed(
-+ 454             title=f"🔓 Deobfuscated: {file.filename}",
-+ 455             color=discord.Color.green()
-+ 456         )
-+ 457         embed.add_field(name="Detected Obfuscator", value=detected, inline=False)
-+ 458         embed.add_field(name="Original Size", value=f"{len(code):,} bytes", inline=True)
-+ 459         embed.add_field(name="Deobfuscated Size", value=f"{len(result):,} bytes", inline=True)
-+ 460         embed.add_field(name="Analysis", value=ai_analysis[:1024], inline=False)
-+ 461         
-+ 462         # Save and send result
-+ 463         output_name = f"deobfuscated_{file.filename}"
-+ 464         with open(output_name, 'w', encoding='utf-8') as f:
-+ 465             f.write(result)
-+ 466         
-+ 467         await interaction.followup.send(
-+ 468             embed=embed,
-+ 469             file=discord.File(output_name)
-+ 470         )
-+ 471         os.remove(output_name)
-+ 472         
-+ 473     except Exception as e:
-+ 474         await interaction.followup.send(f"❌ Error: {str(e)}")
-+ 475 
-+ 476 
-+ 477 @bot.tree.command(name='analyze', description='Analyze obfuscation type without deobfuscating')
-+ 478 async def analyze_command(interaction: discord.Interaction, file: discord.Attachment):
-+ 479     """Analyze what type of obfuscation is used"""
-+ 480     await interaction.response.defer(thinking=True)
-+ 481     
-+ 482     try:
-+ 483         content = await file.read()
-+ 484         code = content.decode('utf-8', errors='ignore')
-+ 485         
-+ 486         deobfuscator = LuaDeobfuscator()
-+ 487         detected = deobfuscator.detect_obfuscator(code)
-+ 488         ai_analysis = await AIDeobfuscator.analyze_with_ai(code, detected)
-+ 489         
-+ 490         embed = discord.Embed(
-+ 491             title=f"🔍 Analysis: {file.filename}",
-+ 492             color=discord.Color.blue()
-+ 493         )
-+ 494         embed.add_field(name="Detected Obfuscator(s)", value=detected, inline=False)
-+ 495         embed.add_field(name="File Size", value=f"{len(code):,} bytes", inline=True)
-+ 496         embed.add_field(name="Lines", value=f"{code.count(chr(10)):,}", inline=True)
-+ 497         embed.add_field(name="Detailed Analysis", value=ai_analysis[:1024], inline=False)
-+ 498         
-+ 499         await interaction.followup.send(embed=embed)
-+ 500         
-+ 501     except Exception as e:
-+ 502         await interaction.followup.send(f"❌ Error: {str(e)}")
-+ 503 
-+ 504 
-+ 505 @bot.tree.command(name='help', description='Show help for the Lua Deobfuscator bot')
-+ 506 async def help_command(interaction: discord.Interaction):
-+ 507     """Show help information"""
-+ 508     embed = discord.Embed(
-+ 509         title="🔓 Lua Deobfuscator Bot - Help",
-+ 510         description="A powerful bot for deobfuscating Lua scripts",
-+ 511         color=discord.Color.purple()
-+ 512     )
-+ 513     
-+ 514     embed.add_field(
-+ 515         name="📋 Commands",
-+ 516         value="""
-+ 517 `/deobfuscate` - Open modal to paste code
-+ 518 `/deobfuscate_file` - Upload a .lua file to deobfuscate
-+ 519 `/analyze` - Analyze obfuscation type only
-+ 520 `/help` - Show this help message
-+ 521         """,
-+ 522         inline=False
-+ 523     )
-+ 524     
-+ 525     embed.add_field(
-+ 526         name="🛡️ Supported Obfuscators",
-+ 527         value="""
-+ 528 • WeAreDevs / Prometheus
-+ 529 • Luraph
-+ 530 • Moonsec v3
-+ 531 • IronBrew / IB2
-+ 532 • PSU
-+ 533 • Loadstring wrappers
-+ 534 • String.char obfuscation
-+ 535 • Base64 / Hex encoding
-+ 536 • Variable renaming
-+ 537 • And more...
-+ 538         """,
-+ 539         inline=False
-+ 540     )
-+ 541     
-+ 542     embed.add_field(
-+ 543         name="⚠️ Note",
-+ 544         value="Complex VM-based obfuscators (Luraph, Moonsec) may only be partially deobfuscated. The bot will provide analysis and decode what it can.",
-+ 545         inline=False
-+ 546     )
-+ 547     
-+ 548     embed.set_footer(text="Lua Deobfuscator Bot v1.0")
-+ 549     
-+ 550     await interaction.response.send_message(embed=embed)
-+ 551 
-+ 552 
-+ 553 # Message-based deobfuscation (for code blocks)
-+ 554 @bot.event
-+ 555 async def on_message(message: discord.Message):
-+ 556     if message.author.bot:
-+ 557         return
-+ 558     
-+ 559     # Check for Lua code blocks
-+ 560     if '```lua' in message.content or '```' in message.content:
-+ 561         # Extract code from code block
-+ 562         code_match = re.search(r'```(?:lua)?\n?(.*?)```', message.content, re.DOTALL)
-+ 563         if code_match and len(code_match.group(1)) > 50:
-+ 564             code = code_match.group(1)
-+ 565             
-+ 566             # Check if it looks obfuscated
-+ 567             deobfuscator = LuaDeobfuscator()
-+ 568             detected = deobfuscator.detect_obfuscator(code)
-+ 569             
-+ 570             if detected != 'Unknown/Custom':
-+ 571                 # Ask if they want to deobfuscate
-+ 572                 view = DeobfuscateConfirmView(code)
-+ 573                 await message.reply(
-+ 574                     f"🔍 Detected **{detected}** obfuscation. Would you like to deobfuscate this code?",
-+ 575                     view=view
-+ 576                 )
-+ 577     
-+ 578     await bot.process_commands(message)
-+ 579 
-+ 580 
-+ 581 class DeobfuscateConfirmView(discord.ui.View):
-+ 582     """Confirmation view for auto-detected obfuscation"""
-+ 583     
-+ 584     def __init__(self, code: str):
-+ 585         super().__init__(timeout=60)
-+ 586         self.code = code
-+ 587     
-+ 588     @discord.ui.button(label='Yes, Deobfuscate', style=discord.ButtonStyle.success, emoji='✅')
-+ 589     async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
-+ 590         await interaction.response.defer(thinking=True)
-+ 591         
-+ 592         deobfuscator = LuaDeobfuscator()
-+ 593         result, detected = deobfuscator.deobfuscate(self.code)
-+ 594         
-+ 595         embed = discord.Embed(
-+ 596             title="🔓 Deobfuscation Result",
-+ 597             color=discord.Color.green()
-+ 598         )
-+ 599         embed.add_field(name="Detected", value=detected, inline=False)
-+ 600         
-+ 601         if len(result) <= 1900:
-+ 602             await interaction.followup.send(
-+ 603                 embed=embed,
-+ 604                 content=f"```lua\n{result}\n```"
-+ 605             )
-+ 606         else:
-+ 607             with open('deobfuscated.lua', 'w', encoding='utf-8') as f:
-+ 608                 f.write(result)
-+ 609             await interaction.followup.send(
-+ 610                 embed=embed,
-+ 611                 file=discord.File('deobfuscated.lua')
-+ 612             )
-+ 613             os.remove('deobfuscated.lua')
-+ 614         
-+ 615         self.stop()
-+ 616     
-+ 617     @discord.ui.button(label='No', style=discord.ButtonStyle.secondary, emoji='❌')
-+ 618     async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
-+ 619         await interaction.response.send_message("Okay, cancelled!", ephemeral=True)
-+ 620         self.stop()
-+ 621 
-+ 622 
-+ 623 # Run the bot
-+ 624 if __name__ == '__main__':
-+ 625     if not TOKEN:
-+ 626         print("❌ Error: DISCORD_TOKEN not found in .env file!")
-+ 627         print("Please create a .env file with: DISCORD_TOKEN=your_bot_token_here")
-+ 628         exit(1)
-+ 629     
-+ 630     bot.run(TOKEN)
+"""
+Lua Deobfuscator Discord Bot
+Deobfuscates various Lua obfuscation formats including:
+- WeAreDevs/Prometheus
+- Luraph
+- Moonsec v3
+- IronBrew
+- PSU
+- And other common patterns
+"""
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+import io
+import os
+import re
+import zipfile
+import tempfile
+import asyncio
+import time
+import logging
+from typing import Dict, List, Optional, Sequence, Union
+import aiohttp
+
+from ai_client import AIClient
+from job_queue import Job, JobFailed, JobQueue, open_queue
+import metrics
+from loop_watchdog import LoopWatchdog
+
+# Importing this module has no side effects: .env is loaded and the bot, queue
+# and workers are built by setup(). Pool processes that import it as their
+# main module, and tools that only need a helper from it, start fast. The
+# engine modules are imported where they are first used.
+
+# Settings, filled in by setup()
+TOKEN: Optional[str] = None
+JOB_TIMEOUT = 600.0
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+
+NEAR_DUPLICATE_THRESHOLD = 0.9
+
+# Upload cap in DMs, servers report theirs in Guild.filesize_limit
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+# Large uploads and their outputs are passed to the workers as files in this
+# directory (the system temp directory when None); remote workers need it on
+# storage they share with the bot
+SPOOL_DIR: Optional[str] = None
+
+bot: Optional[commands.AutoShardedBot] = None
+jobs: Optional[JobQueue] = None
+local_workers = None
+corpus = None
+
+# Loop stalls longer than WATCHDOG_THRESHOLD seconds are logged with the blocking stack
+watchdog = LoopWatchdog(on_lag=metrics.record_loop_lag)
+
+
+# Stages of deobfuscator.STAGES as shown while a job runs
+STAGE_LABELS = {'detect': 'Detection', 'strings': 'Strings', 'code': 'Code'}
+
+
+def progress_reporter(interaction: discord.Interaction):
+    """on_progress callback that edits the deferred response with the stages finished so far"""
+    async def report(partial: dict):
+        if partial['stage'] not in STAGE_LABELS:
+            return
+        finished = list(STAGE_LABELS).index(partial['stage'])
+        steps = ' → '.join(
+            f"{label} {'✅' if i <= finished else '⏳'}" for i, label in enumerate(STAGE_LABELS.values())
+        )
+        try:
+            await interaction.edit_original_response(content=f"{steps}\nDetected: **{partial['detected']}**")
+        except discord.HTTPException:
+            # Progress is best effort, the result is sent either way
+            pass
+    return report
+
+
+# Limits of deobfuscation passes as shown when a job ran into one
+LIMIT_LABELS = {'cpu': 'CPU time', 'memory': 'memory', 'output': 'output size'}
+
+
+def add_partial_field(embed: discord.Embed, job: dict):
+    """Flag a result that is missing passes: the output of an earlier stage, or of a job that hit its limits"""
+    aborted = job.get('limits', {}).get('aborted')
+    if aborted:
+        first = aborted[0]
+        embed.add_field(
+            name="⚠️ Resource Limit",
+            value=f"The `{first['pass']}` pass ran into the {LIMIT_LABELS.get(first['reason'], first['reason'])} "
+                  f"limit, the output has the passes before it.",
+            inline=False
+        )
+    if job.get('partial'):
+        stage = STAGE_LABELS.get(job['stage'], job['stage'])
+        embed.add_field(
+            name="⚠️ Partial Result",
+            value=f"The job hit the {JOB_TIMEOUT:.0f}s limit, this is the output after the {stage} stage.",
+            inline=False
+        )
+
+
+async def run_job(interaction: discord.Interaction, kind: str, payload: dict, on_progress=None) -> dict:
+    """
+    Queue a job for the workers, wait for its result and record its telemetry.
+    
+    A job still running at JOB_TIMEOUT is answered with its latest partial
+    result, marked with 'partial': True, when it reported one.
+    """
+    shard_id = interaction.guild.shard_id if interaction.guild else 0
+    job = Job(kind, payload, shard_id=shard_id)
+    input_bytes = payload['size'] if 'size' in payload else len(payload['code'])
+    fields = {'job_id': job.id, 'kind': kind, 'shard_id': shard_id, 'input_bytes': input_bytes}
+    metrics.INPUT_BYTES.observe(input_bytes, kind=kind)
+    
+    # A job finished earlier with the same input is answered from the queue
+    previous = await jobs.status(job.id)
+    cached = previous is not None and previous['status'] == 'done'
+    metrics.CACHE_REQUESTS.inc(cache='jobs', result='hit' if cached else 'miss')
+    
+    started = time.perf_counter()
+    status = 'done'
+    try:
+        result = await jobs.submit(job, timeout=JOB_TIMEOUT, on_progress=on_progress)
+    except (JobFailed, asyncio.TimeoutError) as e:
+        status = 'timeout' if isinstance(e, asyncio.TimeoutError) else 'failed'
+        # At the deadline the most advanced stage output beats an error
+        state = await jobs.status(job.id) if status == 'timeout' else None
+        partial = state.get('partial') if state is not None else None
+        if partial is None:
+            elapsed = time.perf_counter() - started
+            metrics.JOBS.inc(kind=kind, obfuscator='unknown', status=status)
+            metrics.JOB_SECONDS.observe(elapsed, kind=kind)
+            metrics.log_job('job_failed', logging.WARNING, status=status, duration=round(elapsed, 4),
+                            error=str(e) or type(e).__name__, **fields)
+            raise
+        result = dict(partial, partial=True)
+        status = 'partial'
+    
+    elapsed = time.perf_counter() - started
+    detected = result.get('detected', 'Unknown/Custom')
+    timings = result.get('timings', {})
+    metrics.JOBS.inc(kind=kind, obfuscator=detected, status=status)
+    metrics.JOB_SECONDS.observe(elapsed, kind=kind)
+    if not cached:
+        metrics.observe_pass_timings(timings)
+    metrics.log_job('job_done', status=status, obfuscator=detected, cached=cached, stage=result.get('stage'),
+                    duration=round(elapsed, 4), output_bytes=result.get('output_bytes', len(result.get('result', ''))),
+                    passes={name: round(seconds, 4) for name, seconds in timings.items()},
+                    unpack=result.get('unpack'), pass_order=result.get('pass_order'),
+                    score=result.get('score'), variants=result.get('variants'),
+                    dialect=result.get('dialect'), limits=result.get('limits'), **fields)
+    return result
+
+
+def upload_limit(interaction: discord.Interaction) -> int:
+    return interaction.guild.filesize_limit if interaction.guild else DEFAULT_UPLOAD_LIMIT
+
+
+def _zip_files(files: Dict[str, Union[bytes, str]]):
+    archive = tempfile.TemporaryFile()
+    with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zipped:
+        for name, data in files.items():
+            if isinstance(data, bytes):
+                zipped.writestr(name, data)
+            else:
+                zipped.write(data, arcname=name)
+    return archive
+
+
+async def attachments(files: Dict[str, Union[bytes, str]], limit: int) -> List[discord.File]:
+    """
+    Attachments for one message, from file contents or from paths of files
+    on disk, which are streamed instead of read into memory. When together
+    they are over the upload limit they are sent as one zip archive, named
+    after the first file and compressed off the event loop into a temp file;
+    deobfuscated Lua usually compresses 5-10x.
+    """
+    sizes = [len(data) if isinstance(data, bytes) else os.path.getsize(data) for data in files.values()]
+    if sum(sizes) <= limit:
+        return [
+            discord.File(io.BytesIO(data) if isinstance(data, bytes) else data, filename=name)
+            for name, data in files.items()
+        ]
+    archive = await asyncio.to_thread(_zip_files, files)
+    size = archive.tell()
+    if size > limit:
+        archive.close()
+        raise ValueError(f"the output is {size:,} bytes even zipped, over the {limit:,} byte upload limit")
+    archive.seek(0)
+    return [discord.File(archive, filename=f"{os.path.splitext(next(iter(files)))[0]}.zip")]
+
+
+async def save_attachment(file: discord.Attachment, path: str, chunk_size: int = 1 << 20):
+    """Stream an attachment to `path`, Attachment.save() would read all of it into memory first"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(file.url) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    f.write(chunk)
+
+
+def read_head(path: str, size: int = 64 * 1024) -> str:
+    with open(path, 'rb') as f:
+        return f.read(size).decode('utf-8', errors='ignore')
+
+
+async def analyze_script(interaction: discord.Interaction, code: str, job: dict) -> str:
+    """
+    AI analysis of a processed script, indexed in the corpus together with
+    the fingerprints and artifacts from its job result, under the guild (or
+    in DMs the user) it was uploaded by. A near-duplicate
+    already in the corpus answers with its stored analysis instead of a new
+    AI request.
+    """
+    detected = job['detected']
+    entry = job.get('corpus')
+    # The prompt is built from what the job decoded: its output and the constants found in it
+    artifacts = entry['artifacts'] if entry is not None else {}
+    constants = [*artifacts.get('constants', []), *artifacts.get('urls', []), *artifacts.get('strings', [])]
+    
+    async def ask() -> str:
+        return await AIDeobfuscator.analyze_with_ai(code, detected, job.get('result'), constants)
+    
+    if corpus is None or entry is None:
+        return await ask()
+    
+    # Only scripts uploaded in the same guild (or by the same user in DMs) may answer
+    guild_id, user_id = interaction.guild_id or 0, interaction.user.id
+    matches = await corpus.similar(entry['minhash'], guild_id, user_id, threshold=NEAR_DUPLICATE_THRESHOLD)
+    match = next((m for m in matches if m.analysis and m.detected == detected), None)
+    metrics.CACHE_REQUESTS.inc(cache='corpus', result='hit' if match else 'miss')
+    if match is not None:
+        analysis = match.analysis
+        metrics.log_job('near_duplicate', match=match.hash, similarity=match.similarity, obfuscator=detected)
+    else:
+        analysis = await ask()
+    await corpus.add(code, detected, entry['minhash'], entry['artifacts'], job.get('dialect'), analysis,
+                     guild_id=guild_id, user_id=user_id)
+    
+    if match is not None:
+        analysis = f"*Cached from a {match.similarity:.0%} similar script seen <t:{int(match.created)}:R>*\n{analysis}"
+    return analysis
+
+
+async def refresh_metrics():
+    """Update the gauges that are read from other components at scrape time"""
+    metrics.QUEUE_DEPTH.set(await jobs.depth())
+    if local_workers is not None:
+        metrics.WORKER_UTILIZATION.set(local_workers.busy / local_workers.concurrency)
+    client = AIDeobfuscator.client
+    if client is not None:
+        metrics.CACHE_REQUESTS.set_total(client.stats['cache_hits'] + client.stats['coalesced'], cache='ai', result='hit')
+        metrics.CACHE_REQUESTS.set_total(client.stats['requests'], cache='ai', result='miss')
+
+
+class AIDeobfuscator:
+    """Uses AI (Claude via Poe) for advanced deobfuscation analysis"""
+    
+    # Set AI_ENDPOINT to a model server to enable remote analysis (see setup())
+    client: Optional[AIClient] = None
+    
+    # One combined scan finds every technique. The lookaheads keep a match from
+    # consuming text another technique could match (e.g. getfenv inside a table)
+    TECHNIQUES = [
+        ('string_char', r'string\.char', "• **String.char encoding**: Characters encoded as numeric values"),
+        ('loadstring', r'loadstring|load\(', "• **Dynamic code loading**: Code is loaded/executed at runtime"),
+        ('bitwise', r'bit32|bxor|band|bor', "• **Bitwise operations**: XOR/AND/OR used for encoding"),
+        ('environment', r'getfenv|setfenv', "• **Environment manipulation**: Function environments are modified"),
+        ('long_names', r'\b[a-zA-Z_][a-zA-Z0-9_]{20,}\b', "• **Variable name obfuscation**: Long random variable names"),
+        ('control_flow', r'while\s+true\s+do|for\s+\w+\s*=\s*1\s*,\s*1\s*do', "• **Control flow flattening**: Complex loop structures"),
+        ('lookup_tables', r'local\s+\w+\s*=\s*{[^}]{100,}}', "• **Lookup tables**: Large tables used for bytecode/strings"),
+    ]
+    TECHNIQUE_PATTERN = re.compile(
+        '|'.join(f'(?=(?P<{name}>{pattern}))' for name, pattern, _ in TECHNIQUES),
+        re.IGNORECASE
+    )
+    
+    @staticmethod
+    def detect_techniques(code: str) -> list[str]:
+        """Describe the obfuscation techniques found in a single pass over the code"""
+        found = set()
+        for match in AIDeobfuscator.TECHNIQUE_PATTERN.finditer(code):
+            found.add(match.lastgroup)
+            if len(found) == len(AIDeobfuscator.TECHNIQUES):
+                break
+        
+        return [text for name, _, text in AIDeobfuscator.TECHNIQUES if name in found]
+    
+    @staticmethod
+    async def analyze_with_ai(code: str, detected_type: str, decoded: Optional[str] = None,
+                              constants: Sequence[str] = ()) -> str:
+        """
+        Use Claude to analyze and explain obfuscated code.
+        This provides deeper analysis for complex obfuscation.
+        The techniques are read from `code`, the model is prompted with the
+        `decoded` output and `constants` when the job produced them.
+        """
+        analysis = f"""
+**AI Analysis for {detected_type} Obfuscation:**
+
+The code uses the following obfuscation techniques:
+"""
+        
+        # Analyze techniques used
+        techniques = AIDeobfuscator.detect_techniques(code)
+        if not techniques:
+            techniques.append("• Standard obfuscation patterns detected")
+        
+        analysis += '\n'.join(techniques)
+        
+        # Ask the model server when one is configured, keep the local analysis if it fails
+        if AIDeobfuscator.client is not None:
+            try:
+                analysis += '\n\n' + await AIDeobfuscator.client.analyze(code, detected_type, decoded, constants)
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, TypeError, ValueError) as e:
+                metrics.log_job('ai_failed', logging.WARNING, error=str(e) or type(e).__name__, obfuscator=detected_type)
+        
+        return analysis
+    
+    @staticmethod
+    async def close():
+        if AIDeobfuscator.client is not None:
+            await AIDeobfuscator.client.close()
+
+
+# Discord UI Components
+class DeobfuscateModal(discord.ui.Modal, title='Lua Deobfuscator'):
+    """Modal for pasting Lua code"""
+    
+    code = discord.ui.TextInput(
+        label='Paste Obfuscated Lua Code',
+        style=discord.TextStyle.paragraph,
+        placeholder='Paste your obfuscated Lua code here...',
+        required=True,
+        max_length=4000
+    )
+    
+    async def on_submit(self, interaction: discord.Interaction):
+        await interaction.response.defer(thinking=True)
+        
+        try:
+            job = await run_job(interaction, 'deobfuscate', {'code': self.code.value},
+                                on_progress=progress_reporter(interaction))
+            result, detected = job['result'], job['detected']
+            
+            # Get AI analysis
+            ai_analysis = await analyze_script(interaction, self.code.value, job)
+            
+            # Create embed
+            embed = discord.Embed(
+                title="🔓 Lua Deobfuscation Result",
+                color=discord.Color.green()
+            )
+            embed.add_field(name="Detected Obfuscator", value=detected, inline=False)
+            add_partial_field(embed, job)
+            embed.add_field(name="Analysis", value=ai_analysis[:1024], inline=False)
+            
+            # Send result
+            if len(result) <= 1900:
+                await interaction.followup.send(
+                    embed=embed,
+                    content=f"```lua\n{result}\n```"
+                )
+            else:
+                # Send as file if too long
+                await interaction.followup.send(
+                    embed=embed,
+                    files=await attachments({'deobfuscated.lua': result.encode('utf-8')}, upload_limit(interaction))
+                )
+        
+        except Exception as e:
+            metrics.log_job('command_error', logging.ERROR, exc_info=e, command='deobfuscate')
+            await interaction.followup.send(f"❌ Error: {str(e)}")
+
+
+class DeobfuscateView(discord.ui.View):
+    """View with deobfuscate button"""
+    
+    def __init__(self):
+        super().__init__(timeout=None)
+    
+    @discord.ui.button(label='Paste Code', style=discord.ButtonStyle.primary, emoji='📝')
+    async def paste_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(DeobfuscateModal())
+
+
+# Bot Events
+async def on_ready():
+    print(f'✅ {bot.user} is online!')
+    print(f'📊 Connected to {len(bot.guilds)} servers')
+    
+    # Sync slash commands
+    try:
+        synced = await bot.tree.sync()
+        print(f'🔄 Synced {len(synced)} command(s)')
+    except Exception as e:
+        print(f'❌ Failed to sync commands: {e}')
+
+
+# Slash Commands
+@app_commands.command(name='deobfuscate', description='Deobfuscate Lua code')
+async def deobfuscate_command(interaction: discord.Interaction):
+    """Open the deobfuscation modal"""
+    await interaction.response.send_modal(DeobfuscateModal())
+
+
+async def deobfuscate_large_file(interaction: discord.Interaction, file: discord.Attachment):
+    """
+    Deobfuscate a very large attachment with the bytes-native engine on the workers.
+    
+    The script is never held in memory as a whole: the attachment is
+    streamed to a file in SPOOL_DIR, the job carries its path and the path
+    the worker writes the output to, and the output is attached from disk.
+    """
+    paths = []
+    try:
+        for _ in range(2):
+            fd, path = tempfile.mkstemp(suffix='.lua', dir=SPOOL_DIR)
+            os.close(fd)
+            paths.append(path)
+        input_path, output_path = paths
+        await save_attachment(file, input_path)
+        job = await run_job(interaction, 'deobfuscate_large', {
+            'input_path': input_path, 'output_path': output_path, 'size': file.size,
+        })
+        detected = job['detected']
+        # A limit outside the passes leaves no output, the input is sent back
+        result_path = job['output_path'] or input_path
+        
+        # Only the head of the script is analyzed
+        ai_analysis = await AIDeobfuscator.analyze_with_ai(read_head(input_path), detected, read_head(result_path))
+        
+        embed = discord.Embed(
+            title=f"🔓 Deobfuscated: {file.filename}",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Detected Obfuscator", value=detected, inline=False)
+        embed.add_field(name="Original Size", value=f"{file.size:,} bytes", inline=True)
+        embed.add_field(name="Deobfuscated Size", value=f"{job['output_bytes']:,} bytes", inline=True)
+        embed.add_field(name="Mode", value="Large input (string decoding only)", inline=False)
+        add_partial_field(embed, job)
+        embed.add_field(name="Analysis", value=ai_analysis[:1024], inline=False)
+        
+        await interaction.followup.send(
+            embed=embed,
+            files=await attachments({f"deobfuscated_{file.filename}": result_path}, upload_limit(interaction))
+        )
+    finally:
+        for path in paths:
+            os.remove(path)
+
+
+@app_commands.command(name='deobfuscate_file', description='Deobfuscate a Lua file')
+@app_commands.describe(
+    file='The .lua file to deobfuscate',
+    diff='Also attach a diff linking decoded strings to their original encodings'
+)
+@app_commands.choices(diff=[
+    app_commands.Choice(name='Unified diff', value='unified'),
+    app_commands.Choice(name='HTML side-by-side', value='html'),
+])
+@watchdog.traced(size=lambda interaction, file, **_: file.size)
+async def deobfuscate_file_command(
+    interaction: discord.Interaction,
+    file: discord.Attachment,
+    diff: Optional[app_commands.Choice[str]] = None
+):
+    """Deobfuscate an uploaded Lua file"""
+    if not file.filename.endswith('.lua') and not file.filename.endswith('.txt'):
+        await interaction.response.send_message(
+            "❌ Please upload a `.lua` or `.txt` file!",
+            ephemeral=True
+        )
+        return
+    
+    await interaction.response.defer(thinking=True)
+    
+    try:
+        # Very large files skip the str pipeline and go through the memory-mapped engine
+        from bytes_engine import LARGE_INPUT_THRESHOLD
+        if file.size > LARGE_INPUT_THRESHOLD:
+            await deobfuscate_large_file(interaction, file)
+            return
+        
+        # Download file content
+        content = await file.read()
+        code = content.decode('utf-8', errors='ignore')
+        
+        # Deobfuscate
+        job = await run_job(interaction, 'deobfuscate', {
+            'code': code,
+            'filename': file.filename,
+            'source_map': True,
+            'diff': diff.value if diff is not None else None,
+        }, on_progress=progress_reporter(interaction))
+        result, detected = job['result'], job['detected']
+        
+        # Get AI analysis
+        ai_analysis = await analyze_script(interaction, code, job)
+        
+        # Create embed
+        embed = discord.Embed(
+            title=f"🔓 Deobfuscated: {file.filename}",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Detected Obfuscator", value=detected, inline=False)
+        embed.add_field(name="Original Size", value=f"{len(code):,} bytes", inline=True)
+        embed.add_field(name="Deobfuscated Size", value=f"{len(result):,} bytes", inline=True)
+        if job.get('dialect'):
+            embed.add_field(name="Dialect", value='Luau' if job['dialect'] == 'luau' else 'Lua 5.1', inline=True)
+        if 'score' in job:
+            embed.add_field(name="Output Score", value=f"{job['score']['total']:.2f} ({job['pass_order']} pass order)", inline=True)
+        add_partial_field(embed, job)
+        embed.add_field(name="Analysis", value=ai_analysis[:1024], inline=False)
+        
+        # Send result, zipped together with its map and diff when over the upload limit
+        output_name = f"deobfuscated_{file.filename}"
+        files = {output_name: result.encode('utf-8')}
+        
+        # Source map from output positions back to the uploaded file
+        if 'source_map' in job:
+            files[f"{output_name}.map"] = job['source_map'].encode()
+        
+        if 'diff' in job:
+            diff_name = f"{output_name}.diff.html" if diff.value == 'html' else f"{output_name}.diff"
+            files[diff_name] = job['diff'].encode('utf-8')
+        
+        await interaction.followup.send(
+            embed=embed,
+            files=await attachments(files, upload_limit(interaction))
+        )
+        
+    except Exception as e:
+        metrics.log_job('command_error', logging.ERROR, exc_info=e, command='deobfuscate_file')
+        await interaction.followup.send(f"❌ Error: {str(e)}")
+
+
+@app_commands.command(name='analyze', description='Analyze obfuscation type without deobfuscating')
+@watchdog.traced(size=lambda interaction, file: file.size)
+async def analyze_command(interaction: discord.Interaction, file: discord.Attachment):
+    """Analyze what type of obfuscation is used"""
+    await interaction.response.defer(thinking=True)
+    
+    try:
+        content = await file.read()
+        code = content.decode('utf-8', errors='ignore')
+        
+        job = await run_job(interaction, 'detect', {'code': code})
+        detected = job['detected']
+        ai_analysis = await analyze_script(interaction, code, job)
+        
+        embed = discord.Embed(
+            title=f"🔍 Analysis: {file.filename}",
+            color=discord.Color.blue()
+        )
+        embed.add_field(name="Detected Obfuscator(s)", value=detected, inline=False)
+        embed.add_field(name="File Size", value=f"{len(code):,} bytes", inline=True)
+        embed.add_field(name="Lines", value=f"{code.count(chr(10)):,}", inline=True)
+        embed.add_field(name="Detailed Analysis", value=ai_analysis[:1024], inline=False)
+        
+        await interaction.followup.send(embed=embed)
+        
+    except Exception as e:
+        metrics.log_job('command_error', logging.ERROR, exc_info=e, command='analyze')
+        await interaction.followup.send(f"❌ Error: {str(e)}")
+
+
+@app_commands.command(name='search', description='Search the strings, URLs and constants of processed scripts')
+@app_commands.describe(query='Words to look for, e.g. a URL, a remote name or a decoded string')
+@app_commands.default_permissions(manage_messages=True)
+async def search_command(interaction: discord.Interaction, query: str):
+    """Full-text search over the scripts uploaded in this server, or by the user in DMs"""
+    if corpus is None:
+        await interaction.response.send_message("❌ The script index is turned off.", ephemeral=True)
+        return
+    
+    try:
+        hits = await corpus.search(query, interaction.guild_id or 0, interaction.user.id, limit=10)
+    except Exception as e:
+        metrics.log_job('command_error', logging.ERROR, exc_info=e, command='search')
+        await interaction.response.send_message(f"❌ Error: {str(e)}", ephemeral=True)
+        return
+    embed = discord.Embed(
+        title=f"🔎 Search: {query[:200]}",
+        description=f"{len(hits)} script(s) found" if hits else "No indexed script matches.",
+        color=discord.Color.blue()
+    )
+    for hit in hits:
+        embed.add_field(
+            name=f"`{hit.hash[:12]}` {hit.detected}"[:256],
+            value=f"{hit.snippet[:900]}\n<t:{int(hit.created)}:R>",
+            inline=False
+        )
+    
+    # Uploads can hold webhooks and keys, results are only shown to the caller
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@app_commands.command(name='help', description='Show help for the Lua Deobfuscator bot')
+async def help_command(interaction: discord.Interaction):
+    """Show help information"""
+    embed = discord.Embed(
+        title="🔓 Lua Deobfuscator Bot - Help",
+        description="A powerful bot for deobfuscating Lua scripts",
+        color=discord.Color.purple()
+    )
+    
+    embed.add_field(
+        name="📋 Commands",
+        value="""
+`/deobfuscate` - Open modal to paste code
+`/deobfuscate_file` - Upload a .lua file to deobfuscate (source map included, optional `diff`)
+`/analyze` - Analyze obfuscation type only
+`/search` - Search strings, URLs and constants of scripts processed in this server
+`/slow` - Slowest recent handlers and loop stalls (admins)
+`/help` - Show this help message
+        """,
+        inline=False
+    )
+    
+    embed.add_field(
+        name="🛡️ Supported Obfuscators",
+        value="""
+• WeAreDevs / Prometheus
+• Luraph
+• Moonsec v3
+• IronBrew / IB2
+• PSU
+• Loadstring wrappers
+• String.char obfuscation
+• Base64 / Hex encoding
+• Variable renaming
+• And more...
+        """,
+        inline=False
+    )
+    
+    embed.add_field(
+        name="⚠️ Note",
+        value="Complex VM-based obfuscators (Luraph, Moonsec) may only be partially deobfuscated. The bot will provide analysis and decode what it can.",
+        inline=False
+    )
+    
+    embed.set_footer(text="Lua Deobfuscator Bot v1.0")
+    
+    await interaction.response.send_message(embed=embed)
+
+
+@app_commands.command(name='slow', description='Show the slowest recent handler runs and event loop stalls')
+@app_commands.default_permissions(administrator=True)
+async def slow_command(interaction: discord.Interaction):
+    """Admin view of the watchdog's slow-handler ring buffer"""
+    embed = discord.Embed(
+        title="🐢 Slow Handlers",
+        description=f"Worst loop lag since start: {watchdog.max_lag * 1000:.0f} ms",
+        color=discord.Color.orange()
+    )
+    
+    runs = watchdog.slowest(10)
+    lines = [
+        f"`{run.name}` {run.duration:.2f}s, {run.input_bytes:,} bytes, lag {run.max_lag * 1000:.0f} ms"
+        + (f", {run.error}" if run.error else '')
+        + f" <t:{int(run.started)}:R>"
+        for run in runs
+    ]
+    embed.add_field(name="Slowest Runs", value='\n'.join(lines)[:1024] or "None recorded", inline=False)
+    
+    if watchdog.stalls:
+        stall = watchdog.stalls[-1]
+        # The innermost frames show the call that held the loop
+        stack = stall.stack[-900:]
+        embed.add_field(
+            name=f"Last Stall ({stall.duration:.2f}s, {', '.join(stall.handlers) or 'no handler'})",
+            value=f"```py\n{stack}```",
+            inline=False
+        )
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+# Message-based deobfuscation (for code blocks)
+@watchdog.traced(size=lambda message: len(message.content))
+async def on_message(message: discord.Message):
+    if message.author.bot:
+        return
+    
+    # Check for Lua code blocks
+    if '```lua' in message.content or '```' in message.content:
+        # Extract code from code block
+        code_match = re.search(r'```(?:lua)?\n?(.*?)```', message.content, re.DOTALL)
+        if code_match and len(code_match.group(1)) > 50:
+            code = code_match.group(1)
+            
+            # Check if it looks obfuscated
+            from deobfuscator import LuaDeobfuscator
+            deobfuscator = LuaDeobfuscator()
+            detected = deobfuscator.detect_obfuscator(code)
+            
+            if detected != 'Unknown/Custom':
+                # Ask if they want to deobfuscate
+                view = DeobfuscateConfirmView(code)
+                await message.reply(
+                    f"🔍 Detected **{detected}** obfuscation. Would you like to deobfuscate this code?",
+                    view=view
+                )
+    
+    await bot.process_commands(message)
+
+
+class DeobfuscateConfirmView(discord.ui.View):
+    """Confirmation view for auto-detected obfuscation"""
+    
+    def __init__(self, code: str):
+        super().__init__(timeout=60)
+        self.code = code
+    
+    @discord.ui.button(label='Yes, Deobfuscate', style=discord.ButtonStyle.success, emoji='✅')
+    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.defer(thinking=True)
+        
+        try:
+            job = await run_job(interaction, 'deobfuscate', {'code': self.code},
+                                on_progress=progress_reporter(interaction))
+            result, detected = job['result'], job['detected']
+            
+            embed = discord.Embed(
+                title="🔓 Deobfuscation Result",
+                color=discord.Color.green()
+            )
+            embed.add_field(name="Detected", value=detected, inline=False)
+            add_partial_field(embed, job)
+            
+            if len(result) <= 1900:
+                await interaction.followup.send(
+                    embed=embed,
+                    content=f"```lua\n{result}\n```"
+                )
+            else:
+                await interaction.followup.send(
+                    embed=embed,
+                    files=await attachments({'deobfuscated.lua': result.encode('utf-8')}, upload_limit(interaction))
+                )
+        
+        except Exception as e:
+            metrics.log_job('command_error', logging.ERROR, exc_info=e, command='deobfuscate_confirm')
+            await interaction.followup.send(f"❌ Error: {str(e)}")
+        
+        self.stop()
+    
+    @discord.ui.button(label='No', style=discord.ButtonStyle.secondary, emoji='❌')
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_message("Okay, cancelled!", ephemeral=True)
+        self.stop()
+
+
+def setup() -> commands.AutoShardedBot:
+    """Load .env and build the bot, the job queue, local workers and the AI client"""
+    global TOKEN, JOB_TIMEOUT, METRICS_HOST, METRICS_PORT, SPOOL_DIR, bot, jobs, local_workers, corpus
+    from dotenv import load_dotenv
+    
+    load_dotenv()
+    TOKEN = os.getenv('DISCORD_TOKEN')
+    
+    # SHARD_COUNT / SHARD_IDS split the gateway across several bot processes
+    intents = discord.Intents.default()
+    intents.message_content = True
+    shard_options = {}
+    if os.getenv('SHARD_COUNT'):
+        shard_options['shard_count'] = int(os.getenv('SHARD_COUNT'))
+    if os.getenv('SHARD_IDS'):
+        shard_options['shard_ids'] = [int(i) for i in os.getenv('SHARD_IDS').split(',')]
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents, **shard_options)
+    bot.event(on_ready)
+    bot.event(on_message)
+    for command in (deobfuscate_command, deobfuscate_file_command, analyze_command, search_command,
+                    help_command, slow_command):
+        bot.tree.add_command(command)
+    
+    # Job queue: in-process by default, JOB_QUEUE=sqlite:///jobs.db hands jobs to worker.py processes
+    job_queue = os.getenv('JOB_QUEUE')
+    JOB_TIMEOUT = float(os.getenv('JOB_TIMEOUT', '600'))
+    jobs = open_queue(job_queue)
+    local_worker_count = int(os.getenv('LOCAL_WORKERS', '0' if job_queue else '2'))
+    if local_worker_count > 0:
+        from worker import WorkerPool
+        from governor import DEFAULT_CPU_SECONDS, DEFAULT_MEMORY, DEFAULT_MAX_OUTPUT
+        # Per job limits of the worker processes, 0 turns the CPU and memory limits off
+        limits = {
+            'cpu_seconds': float(os.getenv('JOB_CPU_SECONDS', str(DEFAULT_CPU_SECONDS))) or None,
+            'memory': int(os.getenv('JOB_MEMORY_MB', str(DEFAULT_MEMORY // 2**20))) * 2**20 or None,
+            'max_output': int(os.getenv('JOB_MAX_OUTPUT_MB', str(DEFAULT_MAX_OUTPUT // 2**20))) * 2**20,
+        }
+        # PASS_ORDERS lists the pass orders every deobfuscation compares, the best scoring output wins
+        local_workers = WorkerPool(
+            jobs,
+            concurrency=local_worker_count,
+            pass_orders=os.getenv('PASS_ORDERS', 'default,literal_hex,concat_first').split(','),
+            variant_budget=float(os.getenv('VARIANT_BUDGET', '20')),
+            limits=limits,
+        )
+    
+    # Index of processed scripts behind /search and near-duplicate analyses, CORPUS_DB= turns it off
+    from corpus_index import open_corpus
+    corpus = open_corpus(os.getenv('CORPUS_DB', 'corpus.db'))
+    
+    # Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics, METRICS_PORT=0 turns them off
+    METRICS_HOST = os.getenv('METRICS_HOST', METRICS_HOST)
+    METRICS_PORT = int(os.getenv('METRICS_PORT', str(METRICS_PORT)))
+    
+    # SPOOL_DIR must be shared with the worker.py processes of a JOB_QUEUE
+    SPOOL_DIR = os.getenv('SPOOL_DIR') or None
+    
+    metrics.setup_job_logging()
+    watchdog.threshold = float(os.getenv('WATCHDOG_THRESHOLD', '0.25'))
+    watchdog.slow_threshold = float(os.getenv('SLOW_HANDLER_SECONDS', '1.0'))
+    AIDeobfuscator.client = AIClient.from_env()
+    return bot
+
+
+# Run the bot
+if __name__ == '__main__':
+    setup()
+    if not TOKEN:
+        print("❌ Error: DISCORD_TOKEN not found in .env file!")
+        print("Please create a .env file with: DISCORD_TOKEN=your_bot_token_here")
+        exit(1)
+    
+    async def main():
+        async with bot:
+            if local_workers is not None:
+                await local_workers.start()
+            metrics_runner = None
+            if METRICS_PORT:
+                metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT, refresh_metrics)
+            await watchdog.start()
+            try:
+                await bot.start(TOKEN)
+            finally:
+                await watchdog.stop()
+                if metrics_runner is not None:
+                    await metrics_runner.cleanup()
+                if local_workers is not None:
+                    await local_workers.stop()
+                await jobs.close()
+                await AIDeobfuscator.close()
+    
+    discord.utils.setup_logging()
+    asyncio.run(main())
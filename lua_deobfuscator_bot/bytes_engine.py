@@ -0,0 +1,187 @@
+"""
+Bytes-native Deobfuscation Engine
+Memory-mapped processing mode for very large inputs (dumped bundles, 10+ MB files)
+"""
+
+import re
+import os
+import mmap
+import base64
+import string
+import tempfile
+from functools import partial
+from typing import List, Tuple, Optional
+
+from advanced_deobfuscator import OBFUSCATOR_PATTERNS
+from source_edits import SourceDocument
+from governor import current_governor
+
+
+# Inputs larger than this are processed with BytesDeobfuscator instead of
+# decoding the whole file to str and running the regular pipeline
+LARGE_INPUT_THRESHOLD = 4 * 1024 * 1024
+
+_PRINTABLE = string.printable.encode()
+
+# (start, end, replacement) against the memory-mapped source
+Edit = Tuple[int, int, bytes]
+
+
+class BytesDeobfuscator:
+    """
+    String decoding passes that work directly on a memory-mapped file.
+
+    Every pass only scans the mapped source and records (start, end, replacement)
+    spans in a SourceDocument. The spans are applied once while streaming the
+    output to disk, so peak memory stays close to the size of the input plus the
+    output.
+    """
+
+    def __init__(self):
+        self.passes = [
+            self._base64_edits,
+            self._hex_edits,
+            self._string_char_concat_edits,
+            self._decimal_char_edits,
+            self._escaped_edits,
+            self._reverse_edits,
+        ]
+        self.detect_patterns = {
+            name: [re.compile(p.encode(), re.IGNORECASE) for p in pattern_list]
+            for name, pattern_list in OBFUSCATOR_PATTERNS.items()
+        }
+
+    def detect_obfuscator(self, buf) -> str:
+        """Detect which obfuscator was likely used"""
+        detected = []
+        for name, pattern_list in self.detect_patterns.items():
+            for pattern in pattern_list:
+                if pattern.search(buf):
+                    detected.append(name)
+                    break
+
+        return ', '.join(detected) if detected else 'Unknown/Custom'
+
+    @staticmethod
+    def _quote(decoded: bytes) -> bytes:
+        return b'"' + decoded + b'"'
+
+    def _base64_edits(self, buf) -> List[Edit]:
+        """Base64 payloads in quoted strings and long brackets"""
+        edits = []
+        for pattern in (rb'["\']([A-Za-z0-9+/]{20,}={0,2})["\']', rb'\[\[([A-Za-z0-9+/]{20,}={0,2})\]\]'):
+            for match in re.finditer(pattern, buf):
+                try:
+                    decoded = base64.b64decode(match.group(1))
+                    decoded.decode('utf-8')
+                except Exception:
+                    continue
+                if all(b in _PRINTABLE for b in decoded):
+                    edits.append((match.start(), match.end(), self._quote(decoded)))
+        return edits
+
+    def _hex_edits(self, buf) -> List[Edit]:
+        """\\xHH runs inside string literals"""
+        edits = []
+        for match in re.finditer(rb'["\']((?:\\x[0-9a-fA-F]{2})+)["\']', buf):
+            decoded = bytes.fromhex(match.group(1).replace(b'\\x', b'').decode())
+            if all(b in _PRINTABLE for b in decoded) and b'"' not in decoded:
+                edits.append((match.start(), match.end(), self._quote(decoded)))
+        return edits
+
+    def _decimal_char_edits(self, buf) -> List[Edit]:
+        """string.char(72, 101, 108, 108, 111) calls"""
+        edits = []
+        for match in re.finditer(rb'string\.char\s*\(\s*\d+(?:\s*,\s*\d+)*\s*\)', buf, re.IGNORECASE):
+            numbers = [int(n) for n in re.findall(rb'\d+', match.group(0)[len(b'string.char'):])]
+            decoded = bytes(n for n in numbers if 0 <= n <= 127)
+            if decoded and all(b in _PRINTABLE for b in decoded) and b'"' not in decoded:
+                edits.append((match.start(), match.end(), self._quote(decoded)))
+        return edits
+
+    def _escaped_edits(self, buf) -> List[Edit]:
+        """Decimal escape runs like \\104\\101\\108\\108\\111"""
+        edits = []
+        for match in re.finditer(rb'"((?:\\[0-9]{1,3})+)"', buf):
+            numbers = [int(n) for n in re.findall(rb'\\(\d{1,3})', match.group(1))]
+            if all(32 <= n <= 126 and n not in (34, 92) for n in numbers):
+                edits.append((match.start(), match.end(), self._quote(bytes(numbers))))
+        return edits
+
+    def _string_char_concat_edits(self, buf) -> List[Edit]:
+        """string.char(72)..string.char(101)..string.char(108) chains"""
+        edits = []
+        pattern = rb'(?:string\.char\s*\(\s*\d+\s*\)\s*\.\.?\s*)+string\.char\s*\(\s*\d+\s*\)'
+        for match in re.finditer(pattern, buf, re.IGNORECASE):
+            numbers = [int(n) for n in re.findall(rb'\(\s*(\d+)\s*\)', match.group(0))]
+            decoded = bytes(n for n in numbers if 0 <= n <= 127)
+            if b'"' not in decoded:
+                edits.append((match.start(), match.end(), self._quote(decoded)))
+        return edits
+
+    def _reverse_edits(self, buf) -> List[Edit]:
+        """string.reverse("olleh") calls"""
+        edits = []
+        for match in re.finditer(rb'string\.reverse\s*\(\s*["\']([^"\']+)["\']\s*\)', buf):
+            edits.append((match.start(), match.end(), self._quote(match.group(1)[::-1])))
+        return edits
+
+    @staticmethod
+    def _apply(method, doc: SourceDocument):
+        try:
+            doc.add_edits(method(doc.source))
+        except Exception:
+            pass
+
+    def build_document(self, buf) -> SourceDocument:
+        """
+        Run every pass over the buffer and merge the results into one edit log.
+        Passes run under the job's ResourceGovernor, like the str pipeline.
+        """
+        doc = SourceDocument(buf)
+        governor = current_governor()
+        governor.start(len(buf))
+        for method in self.passes:
+            governor.run_pass(method.__name__.strip('_'), doc, partial(self._apply, method))
+
+        return doc
+
+    def deobfuscate_file(self, input_path: str, output_path: str) -> Tuple[str, int]:
+        """
+        Deobfuscate `input_path` into `output_path` without loading it into memory
+
+        Returns:
+            Tuple of (detected_type, number_of_edits)
+        """
+        with open(input_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                open(output_path, 'wb').close()
+                return 'Unknown/Custom', 0
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                detected = self.detect_obfuscator(mm)
+                doc = self.build_document(mm)
+                with open(output_path, 'wb') as out:
+                    doc.write_to(out)
+
+        return detected, len(doc.edits)
+
+    def deobfuscate_bytes(self, data: bytes, output_path: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Spill `data` to a temp file and deobfuscate it from there
+
+        Returns:
+            Tuple of (output_path, detected_type)
+        """
+        fd, input_path = tempfile.mkstemp(suffix='.lua')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if output_path is None:
+                out_fd, output_path = tempfile.mkstemp(suffix='.lua')
+                os.close(out_fd)
+            detected, _ = self.deobfuscate_file(input_path, output_path)
+        finally:
+            os.remove(input_path)
+
+        return output_path, detected
@@ -0,0 +1,456 @@
+"""
+Constant Propagation
+Scope-aware inlining of locals that are assigned once and hold a standard
+library alias (`local c = string.char`, `local b = bit or bit32`) or a literal,
+so the decoding passes see `string.char(72, 105)` where a script wrote `c(72, k)`
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from source_edits import SourceDocument
+from lua_syntax import (
+    LUA, KEYWORD, NAME, NUMBER, STRING, OP, TokenStore, BlockStructure, lexed_for,
+)
+
+
+# Globals an alias may start with
+LIBRARIES = {
+    'string', 'table', 'math', 'bit', 'bit32', 'utf8', 'coroutine', 'os', 'io', 'debug',
+    'tostring', 'tonumber', 'select', 'type', 'pairs', 'ipairs', 'next', 'unpack',
+    'rawget', 'rawset', 'rawequal', 'rawlen', 'setmetatable', 'getmetatable',
+    'pcall', 'xpcall', 'error', 'assert', 'print', 'loadstring', 'load', 'getfenv', 'setfenv',
+}
+
+# Longer string constants stay behind their name, inlining them only adds noise
+MAX_INLINED_STRING = 64
+
+# Tokens a statement can start with, ends the expression of a declaration
+_STATEMENT_KEYWORDS = {
+    'local', 'function', 'if', 'for', 'while', 'do', 'return', 'end', 'repeat', 'until',
+    'else', 'elseif', 'break', 'goto',
+}
+# Keywords after which a token is part of an expression
+_EXPRESSION_KEYWORDS = {'return', 'and', 'or', 'not', 'in', 'if', 'elseif', 'while', 'until'}
+_COMPOUND_ASSIGNMENTS = {'+=', '-=', '*=', '/=', '//=', '%=', '^=', '..='}
+# A constant followed by one of these would change meaning or stop lexing (`5.x`, `"a":upper()`)
+_CONSTANT_BLOCKERS = {'.', ':', '[', '(', '{'}
+
+_OPAQUE, _ALIAS, _CONSTANT = range(3)
+
+
+class Binding:
+    """
+    One local variable. `kind` is _ALIAS with `operands` (head binding or
+    None for a global, head name, field path) joined by `or`, _CONSTANT
+    with the literal in `text`, or _OPAQUE for anything else. A binding
+    whose declaration has not ended yet is `tentative`: uses inside its own
+    expression may still mean the `outer` variable of the same name.
+    """
+
+    __slots__ = ('kind', 'operands', 'text', 'reassigned', 'uses', 'tentative', 'outer')
+
+    def __init__(self, kind: int = _OPAQUE, operands=None, text: str = '', outer: Optional['Binding'] = None):
+        self.kind = kind
+        self.operands: List[Tuple[Optional['Binding'], str, str]] = operands or []
+        self.text = text
+        self.reassigned = False
+        self.uses: List[int] = []
+        self.tentative = False
+        self.outer = outer
+
+
+class _Walk:
+    """Single pass over the tokens that binds declarations and resolves every name"""
+
+    def __init__(self, store: TokenStore):
+        self.store = store
+        self.source = store.source
+        self.kinds = store.kinds
+        self.starts = store.starts
+        self.ends = store.ends
+        self.n = len(store)
+        self.scopes: List[Dict[str, Binding]] = [{}]
+        # Tentative bindings of each scope, settled when its statement ends
+        self.unsettled: List[List[Binding]] = [[]]
+        self.bindings: List[Binding] = []
+        self.assigned_globals: Set[str] = set()
+        # Token indexes of names being declared, not uses
+        self.declared: Set[int] = set()
+        # Bindings that become visible at a token index
+        self.deferred: Dict[int, List[Tuple[str, Binding]]] = {}
+        # Token indexes where a block opens or closes or a binding becomes visible
+        self.events: Set[int] = set()
+        # Brackets open at the current statement level, per function
+        self.brackets: List[str] = []
+
+    def op(self, i: int) -> Optional[str]:
+        if 0 <= i < self.n and self.kinds[i] == OP:
+            return self.source[self.starts[i]:self.ends[i]]
+        return None
+
+    def keyword(self, i: int) -> Optional[str]:
+        if 0 <= i < self.n and self.kinds[i] == KEYWORD:
+            return self.source[self.starts[i]:self.ends[i]]
+        return None
+
+    def lookup(self, name: str) -> Optional[Binding]:
+        for scope in reversed(self.scopes):
+            binding = scope.get(name)
+            if binding is not None:
+                return binding
+        return None
+
+    def bind(self, name: str, binding: Binding):
+        self.scopes[-1][name] = binding
+        self.bindings.append(binding)
+
+    def defer(self, i: int, bindings: List[Tuple[str, Binding]]):
+        """Bind `bindings` when the walk reaches token `i`"""
+        self.deferred.setdefault(i, []).extend(bindings)
+        self.events.add(i)
+
+    def run(self):
+        blocks = BlockStructure(self.store)
+        opening: Dict[int, str] = {}
+        closing: Dict[int, List[str]] = {}
+        pending = list(blocks.root.children)
+        while pending:
+            block = pending.pop()
+            opening[block.open] = block.kind
+            closing.setdefault(block.close, []).append(block.kind)
+            pending.extend(block.children)
+        events = self.events
+        events.update(opening)
+        events.update(closing)
+
+        source, starts, ends = self.source, self.starts, self.ends
+        declared = self.declared
+        frames: List[Tuple[str, List[str]]] = []
+        loop_names: List[str] = []
+        for i, token in enumerate(self.kinds):
+            if i in events:
+                # A declaration is in effect from the token after it, before
+                # that token ends its block
+                if i in self.deferred:
+                    for name, binding in self.deferred.pop(i):
+                        self.bind(name, binding)
+                for _ in closing.get(i, ()):
+                    self.close_scope(frames.pop())
+                kind = opening.get(i)
+                if kind is not None:
+                    frames.append((kind, self.brackets))
+                    self.scopes.append({})
+                    self.unsettled.append([])
+                    if kind == 'function':
+                        self.brackets = []
+                        self.function_header(i)
+                    elif kind == 'do' and loop_names:
+                        for name in loop_names:
+                            self.bind(name, Binding())
+                        loop_names = []
+
+            if token == NAME:
+                if i not in declared:
+                    self.use(i)
+            elif token == KEYWORD:
+                text = source[starts[i]:ends[i]]
+                if text == 'local':
+                    self.declaration(i)
+                elif text == 'for':
+                    loop_names = self.loop_header(i)
+                if text in _STATEMENT_KEYWORDS:
+                    self.settle()
+            elif token == OP:
+                text = source[starts[i]:ends[i]]
+                if text in ('(', '[', '{'):
+                    self.brackets.append(text)
+                elif text in (')', ']', '}') and self.brackets:
+                    self.brackets.pop()
+                elif text == ';':
+                    self.settle()
+
+    def settle(self):
+        """A statement ended: tentative declarations of this scope are in effect"""
+        unsettled = self.unsettled[-1]
+        for binding in unsettled:
+            binding.tentative = False
+        unsettled.clear()
+
+    def close_scope(self, frame: Tuple[str, List[str]]):
+        kind, brackets = frame
+        scope = self.scopes.pop()
+        self.unsettled.pop()
+        if kind == 'function':
+            self.brackets = brackets
+        elif kind == 'repeat':
+            # The `until` condition still sees the body's locals, so names it
+            # reads could mean either variable: keep the outer ones as they are
+            for name in scope:
+                outer = self.lookup(name)
+                if outer is not None:
+                    outer.reassigned = True
+
+    def function_header(self, i: int):
+        """Parameters of the function opened at token `i`, visible from their `(`"""
+        store = self.store
+        j = i + 1
+        method = False
+        while j < self.n and self.op(j) != '(':
+            if self.op(j) == ':':
+                method = True
+            if self.kinds[j] not in (NAME, OP) or self.op(j) in ('=', ')'):
+                return
+            j += 1
+        if j >= self.n:
+            return
+        params = [('self', Binding())] if method else []
+        depth = 0
+        k = j
+        while k < self.n:
+            text = self.op(k)
+            if text in ('(', '[', '{'):
+                depth += 1
+            elif text in (')', ']', '}'):
+                depth -= 1
+                if depth == 0:
+                    break
+            elif self.kinds[k] == NAME and depth == 1 and self.op(k - 1) in ('(', ','):
+                self.declared.add(k)
+                params.append((store.text(k), Binding()))
+            k += 1
+        self.defer(j, params)
+
+    def loop_header(self, i: int) -> List[str]:
+        """Names declared by the `for` at token `i`, bound when its `do` block opens"""
+        names = []
+        j = i + 1
+        while j < self.n and self.kinds[j] == NAME and (j == i + 1 or self.op(j - 1) == ','):
+            self.declared.add(j)
+            names.append(self.store.text(j))
+            j += 1
+            # Luau type annotations up to the next name or `=`/`in`
+            while j < self.n and self.op(j) not in (',', '=') and self.keyword(j) != 'in':
+                j += 1
+            if self.op(j) == ',':
+                j += 1
+        return names
+
+    def declaration(self, i: int):
+        store = self.store
+        if self.keyword(i + 1) == 'function':
+            if i + 2 < self.n and self.kinds[i + 2] == NAME:
+                self.declared.add(i + 2)
+                self.bind(store.text(i + 2), Binding())
+            return
+
+        names = []
+        simple = True
+        j = i + 1
+        while j < self.n and self.kinds[j] == NAME:
+            self.declared.add(j)
+            names.append(store.text(j))
+            j += 1
+            if self.op(j) == '<' and self.op(j + 2) == '>' and store.text(j + 1) == 'const':
+                j += 3
+            while j < self.n and self.op(j) not in (',', '=') and self.kinds[j] != NAME:
+                # Attributes and Luau type annotations
+                simple = False
+                if self.kinds[j] == KEYWORD:
+                    break
+                j += 1
+            if self.op(j) != ',':
+                break
+            j += 1
+
+        value = None
+        if len(names) == 1 and simple and self.op(j) == '=':
+            value = self.value_at(j + 1)
+        if value is not None:
+            binding, end = value
+            self.defer(end, [(names[0], binding)])
+            return
+        for name in names:
+            binding = Binding(outer=self.lookup(name))
+            binding.tentative = self.op(j) == '=' or not simple
+            if binding.tentative:
+                self.unsettled[-1].append(binding)
+            self.bind(name, binding)
+
+    def value_at(self, k: int) -> Optional[Tuple[Binding, int]]:
+        """Binding for the expression at token `k` if it is an alias or literal, and the index after it"""
+        store = self.store
+        if k >= self.n:
+            return None
+        kind = self.kinds[k]
+        text = store.text(k)
+        if kind == NUMBER or (kind == KEYWORD and text in ('true', 'false')) or (
+            kind == STRING and len(text) <= MAX_INLINED_STRING and '\n' not in text
+        ):
+            binding, end = Binding(_CONSTANT, text=text), k + 1
+        elif kind == NAME:
+            operands = []
+            while True:
+                if k >= self.n or self.kinds[k] != NAME:
+                    return None
+                head = store.text(k)
+                path = []
+                k += 1
+                while self.op(k) == '.' and k + 1 < self.n and self.kinds[k + 1] == NAME:
+                    path.append('.' + store.text(k + 1))
+                    k += 2
+                operands.append((self.lookup(head), head, ''.join(path)))
+                if self.keyword(k) != 'or':
+                    break
+                k += 1
+            binding, end = Binding(_ALIAS, operands=operands), k
+        else:
+            return None
+
+        # Only a whole expression: the next token has to start a new statement
+        if end < self.n:
+            kind = self.kinds[end]
+            if not (kind == NAME or self.op(end) == ';' or self.keyword(end) in _STATEMENT_KEYWORDS):
+                return None
+        return binding, end
+
+    def assigns(self, i: int) -> bool:
+        """Whether the name at token `i` is the target, or part of the target list, of an assignment"""
+        if self.brackets:
+            # Inside parentheses, brackets and table constructors there are no assignments
+            return False
+        text = self.op(i + 1)
+        if text == '=' or text in _COMPOUND_ASSIGNMENTS:
+            return True
+        if self.keyword(i - 1) == 'function' and text in ('(', '.', ':'):
+            # function name() assigns name, function name.field() writes into it
+            return True
+        j = i + 1
+        # Field writes (`name.x = ...`, `name[k], other = ...`) change the table it holds
+        while j < self.n:
+            text = self.op(j)
+            if text in ('.', ':', ',') and j + 1 < self.n and self.kinds[j + 1] == NAME:
+                j += 2
+            elif text == '[':
+                depth = 0
+                while j < self.n:
+                    if self.op(j) == '[':
+                        depth += 1
+                    elif self.op(j) == ']':
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    j += 1
+                j += 1
+            else:
+                return text == '=' or text in _COMPOUND_ASSIGNMENTS
+        return False
+
+    def shadowed(self, binding: Binding) -> bool:
+        """Whether a global the alias `binding` starts from is a local where it is used"""
+        for head, name, _ in binding.operands:
+            if head is None:
+                if self.lookup(name) is not None:
+                    return True
+            elif head.kind == _ALIAS and self.shadowed(head):
+                return True
+        return False
+
+    def use(self, i: int):
+        previous = self.op(i - 1)
+        if previous in ('.', ':', '::') or self.keyword(i - 1) == 'goto':
+            return
+        if self.brackets and self.brackets[-1] == '{' and previous in ('{', ',', ';') and self.op(i + 1) == '=':
+            # Field key of a table constructor
+            return
+        name = self.source[self.starts[i]:self.ends[i]]
+        binding = self.lookup(name)
+        if binding is None:
+            # Only assignments to the globals an alias can start from matter
+            if name in LIBRARIES and self.assigns(i):
+                self.assigned_globals.add(name)
+            return
+        assigned = self.assigns(i)
+        if binding.tentative:
+            if assigned:
+                binding.reassigned = True
+                if binding.outer is not None:
+                    binding.outer.reassigned = True
+            return
+        if assigned:
+            binding.reassigned = True
+        elif binding.kind != _ALIAS or not self.shadowed(binding):
+            # `local c = string.char ... local string = s; c(72)` keeps its `c`
+            binding.uses.append(i)
+
+
+def _resolve(binding: Binding, assigned_globals: Set[str], seen: Set[int]) -> Optional[str]:
+    """Text a use of `binding` can be replaced with, None when it must stay"""
+    if binding.reassigned or binding.kind == _OPAQUE or id(binding) in seen:
+        return None
+    if binding.kind == _CONSTANT:
+        return binding.text
+    seen.add(id(binding))
+    parts = []
+    for head, name, path in binding.operands:
+        if head is None:
+            if name not in LIBRARIES or name in assigned_globals:
+                return None
+            base = name
+        else:
+            if head.kind != _ALIAS:
+                return None
+            base = _resolve(head, assigned_globals, seen)
+            if base is None:
+                return None
+        parts.append(base + path)
+    return parts[0] if len(parts) == 1 else '(' + ' or '.join(parts) + ')'
+
+
+def _in_expression(store: TokenStore, i: int) -> bool:
+    """Whether token `i` can not start a statement, so a `(` put there is not read as a call"""
+    if i == 0:
+        return False
+    kind = store.kinds[i - 1]
+    text = store.text(i - 1)
+    if kind == OP:
+        return text not in (')', ']', '}', ';')
+    return kind == KEYWORD and text in _EXPRESSION_KEYWORDS
+
+
+def propagate_constants(doc: SourceDocument, dialect: str = LUA) -> int:
+    """
+    Replace uses of locals that are assigned once with their value: a
+    standard library path such as `string.char` (also through other
+    aliases), `(bit or bit32)`, or a number, boolean or short string
+    literal. Returns the number of replacements.
+
+    Names are resolved through the block scopes in one pass over the
+    tokens. A local is left alone when anything assigns it or writes a
+    field through it, when its library global is assigned anywhere, and
+    where a use could also mean a different variable of the same name. An
+    alias use stays where a local hides the library global it names.
+    """
+    store = lexed_for(doc.source, dialect).store
+    walk = _Walk(store)
+    walk.run()
+
+    edits = []
+    for binding in walk.bindings:
+        if not binding.uses:
+            continue
+        text = _resolve(binding, walk.assigned_globals, set())
+        if text is None:
+            continue
+        for i in binding.uses:
+            following = walk.op(i + 1)
+            if binding.kind == _CONSTANT:
+                if following in _CONSTANT_BLOCKERS or (i + 1 < len(store) and store.kinds[i + 1] == STRING):
+                    continue
+                if following == '..' and store.kinds[i] == NAME and store.ends[i] == store.starts[i + 1]:
+                    # `5..x` would lex as a malformed number
+                    edits.append((store.starts[i], store.ends[i], text + ' '))
+                    continue
+            elif text.startswith('(') and not _in_expression(store, i):
+                continue
+            edits.append((store.starts[i], store.ends[i], text))
+    return doc.add_edits(edits)
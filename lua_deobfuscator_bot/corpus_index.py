@@ -0,0 +1,337 @@
+"""
+Script Corpus Index
+On-disk index of every processed script: its detected obfuscator, a MinHash
+of its fingerprints and the strings, URLs and constants found in it. Serves
+full-text search over past uploads and near-duplicate lookups
+"""
+
+import re
+import time
+import array
+import asyncio
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+
+# MinHash of the winnowed fingerprints, split into LSH bands: two scripts
+# share a band with probability s^ROWS, so with 16 bands of 4 rows pairs
+# above ~0.5 Jaccard similarity almost always become candidates
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+
+_MASK64 = (1 << 64) - 1
+_EMPTY = _MASK64
+
+# Per field cap on indexed artifacts, keeps huge constant tables out of the index
+MAX_ARTIFACTS = 500
+MAX_ARTIFACT_LENGTH = 200
+
+_URL = re.compile(r'https?://[^\s"\'`<>()\[\]{}\\]+')
+_STRING = re.compile(r'"((?:[^"\\\n]|\\.){3,})"|\'((?:[^\'\\\n]|\\.){3,})\'|\[(=*)\[(.{3,}?)\]\3\]', re.DOTALL)
+
+
+def script_hash(code: str) -> str:
+    return hashlib.sha256(code.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+
+def _mix(value: int) -> int:
+    """splitmix64 finalizer, spreads the 32-bit fingerprint hashes over 64 bits"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+def script_minhash(code: str, dialect: Optional[str] = None) -> List[int]:
+    """
+    MinHash signature of a script's winnowed fingerprints.
+
+    Uses one-permutation hashing: each fingerprint is hashed once and kept
+    as the minimum of one of NUM_HASHES bins, so the cost is one hash per
+    fingerprint instead of NUM_HASHES. Empty bins borrow from the next
+    filled bin (rotation densification) so short scripts still compare.
+    Fingerprints come from normalized tokens, so renamed identifiers and
+    changed literals do not move the signature. The tokens are those of the
+    shared lexed source, a job that already scanned `code` does not scan it
+    again.
+    """
+    from signatures import normalize_tokens, fingerprints
+    from lua_syntax import lexed_for, detect_dialect
+
+    ids, _, _ = normalize_tokens(lexed_for(code, dialect or detect_dialect(code)).store)
+    mins = [_EMPTY] * NUM_HASHES
+    for value, _ in fingerprints(ids):
+        mixed = _mix(value)
+        slot = mixed % NUM_HASHES
+        rest = mixed // NUM_HASHES
+        if rest < mins[slot]:
+            mins[slot] = rest
+    if all(value == _EMPTY for value in mins):
+        return mins
+    for i in range(NUM_HASHES):
+        distance = 1
+        while mins[i] == _EMPTY:
+            source = mins[(i + distance) % NUM_HASHES]
+            if source != _EMPTY:
+                mins[i] = _mix(source + distance) // NUM_HASHES
+            distance += 1
+    return mins
+
+
+def minhash_similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the fingerprint sets behind two signatures"""
+    if a[0] == _EMPTY or b[0] == _EMPTY:
+        return 1.0 if list(a) == list(b) else 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_HASHES
+
+
+def _band_keys(signature: Sequence[int]) -> List[int]:
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(array.array('Q', rows).tobytes(), digest_size=8).digest()
+        # SQLite integers are signed
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def _unique(items, limit: int = MAX_ARTIFACTS) -> List[str]:
+    seen = {}
+    for item in items:
+        item = item.strip()[:MAX_ARTIFACT_LENGTH]
+        if item and item not in seen:
+            seen[item] = None
+            if len(seen) >= limit:
+                break
+    return list(seen)
+
+
+def extract_artifacts(code: str, detected: str = '') -> Dict[str, List[str]]:
+    """
+    Readable strings, URLs and VM constants of a script, the searchable
+    part of an index entry. Luraph and Moonsec scripts also get the
+    strings their VM extractors find.
+    """
+    from advanced_deobfuscator import LuraphDeobfuscator, MoonsecDeobfuscator
+
+    strings = []
+    for match in _STRING.finditer(code):
+        text = match.group(1) or match.group(2) or match.group(4) or ''
+        if any(c.isalpha() for c in text) and text.isprintable():
+            strings.append(text)
+    detected = detected.lower()
+    if 'luraph' in detected:
+        strings.extend(LuraphDeobfuscator.extract_strings(code))
+    constants = MoonsecDeobfuscator.find_vm_constants(code)
+    return {
+        'strings': _unique(strings),
+        'urls': _unique(_URL.findall(code)),
+        'constants': _unique(constants),
+    }
+
+
+class ScriptRecord(NamedTuple):
+    hash: str
+    detected: str
+    dialect: Optional[str]
+    size: int
+    created: float
+    analysis: Optional[str]
+    similarity: float = 1.0
+
+
+class SearchHit(NamedTuple):
+    hash: str
+    detected: str
+    created: float
+    snippet: str
+
+
+class CorpusIndex:
+    """
+    Corpus in a SQLite database file, opened like SQLiteQueue. Workers put
+    the fingerprints and artifacts of a script in its job result, the bot
+    indexes them, so only this class is needed in the bot process and the
+    engine modules are imported where the fingerprinting runs.
+
+    `scripts` holds one row per distinct upload, `artifacts` is an FTS5
+    table over its strings, URLs and constants, and `lsh` maps each band
+    of the MinHash signature to the scripts that have it. `uploads` records
+    the guilds a script was uploaded in, guild 0 with the user for DMs;
+    search() only returns scripts uploaded where it is asked from.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS scripts (
+                    hash TEXT PRIMARY KEY,
+                    detected TEXT NOT NULL,
+                    dialect TEXT,
+                    size INTEGER NOT NULL,
+                    minhash BLOB NOT NULL,
+                    analysis TEXT,
+                    created REAL NOT NULL
+                )
+            ''')
+            db.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS artifacts USING fts5 (
+                    hash UNINDEXED, detected, strings, urls, constants
+                )
+            ''')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS lsh (
+                    band INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    hash TEXT NOT NULL
+                )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS lsh_bucket ON lsh (band, bucket)')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS uploads (
+                    hash TEXT NOT NULL,
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    PRIMARY KEY (guild_id, user_id, hash)
+                )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _add(self, code: str, detected: str, signature: Sequence[int], artifacts: Dict[str, List[str]],
+             dialect: Optional[str] = None, analysis: Optional[str] = None,
+             guild_id: int = 0, user_id: int = 0) -> str:
+        digest = script_hash(code)
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute(
+                'INSERT OR IGNORE INTO uploads (hash, guild_id, user_id) VALUES (?, ?, ?)',
+                (digest, guild_id, 0 if guild_id else user_id)
+            )
+            row = db.execute('SELECT analysis FROM scripts WHERE hash = ?', (digest,)).fetchone()
+            if row is not None:
+                if analysis and not row[0]:
+                    db.execute('UPDATE scripts SET analysis = ? WHERE hash = ?', (analysis, digest))
+                db.execute('COMMIT')
+                return digest
+            db.execute(
+                'INSERT INTO scripts (hash, detected, dialect, size, minhash, analysis, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (digest, detected, dialect, len(code), array.array('Q', signature).tobytes(), analysis, time.time())
+            )
+            db.execute(
+                'INSERT INTO artifacts (hash, detected, strings, urls, constants) VALUES (?, ?, ?, ?, ?)',
+                (digest, detected, *('\n'.join(artifacts.get(field, [])) for field in ('strings', 'urls', 'constants')))
+            )
+            db.executemany(
+                'INSERT INTO lsh (band, bucket, hash) VALUES (?, ?, ?)',
+                [(band, key, digest) for band, key in enumerate(_band_keys(signature))]
+            )
+            db.execute('COMMIT')
+        return digest
+
+    def _similar(self, signature: Sequence[int], guild_id: int, user_id: int = 0, threshold: float = 0.8,
+                 limit: int = 5) -> List[ScriptRecord]:
+        keys = _band_keys(signature)
+        with self._connect() as db:
+            candidates = set()
+            for band, key in enumerate(keys):
+                candidates.update(row[0] for row in db.execute(
+                    'SELECT hash FROM lsh WHERE band = ? AND bucket = ? AND hash IN '
+                    '(SELECT hash FROM uploads WHERE guild_id = ? AND user_id = ?)',
+                    (band, key, guild_id, 0 if guild_id else user_id)
+                ))
+            records = []
+            for digest in candidates:
+                row = db.execute(
+                    'SELECT detected, dialect, size, created, analysis, minhash FROM scripts WHERE hash = ?',
+                    (digest,)
+                ).fetchone()
+                if row is None:
+                    continue
+                similarity = minhash_similarity(signature, array.array('Q', row[5]))
+                if similarity >= threshold:
+                    records.append(ScriptRecord(digest, *row[:5], similarity=similarity))
+        records.sort(key=lambda record: (-record.similarity, -record.created))
+        return records[:limit]
+
+    def _search(self, query: str, guild_id: int, user_id: int = 0, limit: int = 10) -> List[SearchHit]:
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT a.hash, s.detected, s.created, "
+                "snippet(artifacts, -1, '**', '**', '...', 12) "
+                "FROM artifacts AS a JOIN scripts AS s ON s.hash = a.hash "
+                "WHERE artifacts MATCH ? AND a.hash IN "
+                "(SELECT hash FROM uploads WHERE guild_id = ? AND user_id = ?) "
+                "ORDER BY bm25(artifacts) LIMIT ?",
+                (fts_query(query), guild_id, 0 if guild_id else user_id, limit)
+            ).fetchall()
+        return [SearchHit(*row) for row in rows]
+
+    def _set_analysis(self, code: str, analysis: str):
+        with self._connect() as db:
+            db.execute('UPDATE scripts SET analysis = ? WHERE hash = ?', (analysis, script_hash(code)))
+
+    def _count(self) -> int:
+        with self._connect() as db:
+            return db.execute('SELECT COUNT(*) FROM scripts').fetchone()[0]
+
+    async def add(self, code: str, detected: str, signature: Sequence[int], artifacts: Dict[str, List[str]],
+                  dialect: Optional[str] = None, analysis: Optional[str] = None,
+                  guild_id: int = 0, user_id: int = 0) -> str:
+        """
+        Index a script processed for `guild_id` (0 and `user_id` in DMs),
+        returns its hash. Re-adding a known script only records where it
+        was uploaded and fills in its analysis.
+        """
+        return await asyncio.to_thread(
+            self._add, code, detected, signature, artifacts, dialect, analysis, guild_id, user_id
+        )
+
+    async def similar(self, signature: Sequence[int], guild_id: int, user_id: int = 0, threshold: float = 0.8,
+                      limit: int = 5) -> List[ScriptRecord]:
+        """
+        Scripts uploaded in `guild_id`, or by `user_id` in DMs when it is 0,
+        whose estimated similarity to `signature` is at least `threshold`, best first
+        """
+        return await asyncio.to_thread(self._similar, signature, guild_id, user_id, threshold, limit)
+
+    async def search(self, query: str, guild_id: int, user_id: int = 0, limit: int = 10) -> List[SearchHit]:
+        """
+        Full-text search over the strings, URLs and constants of the scripts
+        uploaded in `guild_id`, or by `user_id` in DMs when it is 0
+        """
+        return await asyncio.to_thread(self._search, query, guild_id, user_id, limit)
+
+    async def set_analysis(self, code: str, analysis: str):
+        await asyncio.to_thread(self._set_analysis, code, analysis)
+
+    async def count(self) -> int:
+        return await asyncio.to_thread(self._count)
+
+
+def fts_query(text: str) -> str:
+    """
+    FTS5 query from user input: every word is matched as a quoted phrase
+    prefix, so punctuation in URLs or identifiers is never read as query syntax
+    """
+    words = [word.replace('"', '""') for word in text.split()]
+    return ' '.join(f'"{word}"*' for word in words) or '""'
+
+
+def open_corpus(path: Optional[str]) -> Optional[CorpusIndex]:
+    """Corpus index at `path`, None disables indexing"""
+    if not path:
+        return None
+    return CorpusIndex(path)
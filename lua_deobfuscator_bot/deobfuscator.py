@@ -0,0 +1,407 @@
+"""
+Lua Deobfuscation Engine
+Core string decoding, renaming and beautifying pipeline used by the bot and the workers
+"""
+
+import re
+import base64
+import bisect
+import string
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from advanced_deobfuscator import OBFUSCATOR_PATTERNS
+from source_edits import SourceDocument
+from signatures import skip_runtime
+from base64_literals import literals_for
+from unpacking import unpack_compressed_literals
+from governor import current_governor, LIMIT_ERRORS, limit_reason
+from constant_propagation import propagate_constants
+from lua_syntax import LexedSource, lexed_for, detect_dialect, BlockStructure
+
+
+# Alternative orders of the string passes. Passes run on the same layer and
+# the earlier one wins where matches overlap, so the order changes the output
+PASS_ORDERS = {
+    'default': [
+        'base64_strings', 'compressed_strings', 'hex_strings', 'decimal_char_strings',
+        'escaped_strings', 'xor_strings', 'string_char_concat',
+    ],
+    # Hex escapes are only decoded when they make up a whole string literal
+    'literal_hex': [
+        'base64_strings', 'compressed_strings', 'hex_literals', 'decimal_char_strings',
+        'escaped_strings', 'xor_strings', 'string_char_concat',
+    ],
+    # Whole string.char(..)..string.char(..) chains before their single calls
+    'concat_first': [
+        'compressed_strings', 'base64_strings', 'string_char_concat', 'decimal_char_strings',
+        'escaped_strings', 'hex_literals', 'xor_strings',
+    ],
+}
+
+
+# Stages deobfuscate_stages() yields after, in order. Every stage output is a
+# usable partial result; 'code' is the final one
+STAGES = ('detect', 'strings', 'code')
+
+_LUA_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def lua_string(text: str) -> str:
+    """Double quoted Lua literal of decoded text, quotes and control characters escaped"""
+    # Three digit escapes, a digit after the escape must not extend it
+    return '"' + re.sub(
+        r'[\\"\x00-\x1f\x7f]', lambda m: _LUA_ESCAPES.get(m.group(0), f'\\{ord(m.group(0)):03d}'), text
+    ) + '"'
+
+
+class LuaDeobfuscator:
+    """Core deobfuscation engine for Lua scripts"""
+    
+    def __init__(self, pass_order: str = 'default', dialect: Optional[str] = None):
+        self.pass_order = pass_order
+        # 'lua' or 'luau', None picks one per script
+        self.dialect = dialect
+        self.current_dialect = dialect
+        self.string_methods = [
+            getattr(self, f'_decode_{name}') for name in PASS_ORDERS[pass_order]
+        ]
+    
+    def detect_obfuscator(self, code: str) -> str:
+        """Detect which obfuscator was likely used"""
+        detected = []
+        for name, pattern_list in OBFUSCATOR_PATTERNS.items():
+            for pattern in pattern_list:
+                if re.search(pattern, code, re.IGNORECASE):
+                    if name not in detected:
+                        detected.append(name)
+                    break
+        
+        return ', '.join(detected) if detected else 'Unknown/Custom'
+    
+    def _lexed(self, doc: SourceDocument) -> LexedSource:
+        """Tokens of the current layer in the script's dialect"""
+        dialect = self.current_dialect or detect_dialect(doc.source)
+        return lexed_for(doc.source, dialect)
+    
+    def _propagate_constants(self, doc: SourceDocument) -> SourceDocument:
+        """Replace locals holding stdlib aliases or literals with their value"""
+        propagate_constants(doc, self.current_dialect)
+        return doc
+    
+    def _decode_base64_strings(self, doc: SourceDocument) -> SourceDocument:
+        """Decode base64 encoded strings in the code"""
+        # Base64 in "..." / '...' and [[...]] literals, decoded once per source
+        literals = literals_for(doc.source)
+        edits = []
+        for start, end, encoded in literals.literals(min_length=20, bracketed=True):
+            decoded = literals.texts.get(encoded)
+            if decoded is not None and (decoded.isprintable() or '\n' in decoded or '\t' in decoded):
+                edits.append((start, end, lua_string(decoded)))
+        
+        doc.add_edits(edits)
+        return doc
+    
+    def _decode_compressed_strings(self, doc: SourceDocument) -> SourceDocument:
+        """Unpack zlib/gzip/deflate/LZW compressed payloads within the job's budget"""
+        return unpack_compressed_literals(doc)
+    
+    def _decode_hex_strings(self, doc: SourceDocument) -> SourceDocument:
+        """Decode hex escaped strings like \\x48\\x65\\x6c\\x6c\\x6f"""
+        def decode_hex(match):
+            try:
+                hex_str = match.group(0)
+                decoded = bytes.fromhex(
+                    re.sub(r'\\x', '', hex_str)
+                ).decode('utf-8', errors='ignore')
+                return f'"{decoded}"'
+            except Exception:
+                return match.group(0)
+        
+        doc.sub(r'(?:\\x[0-9a-fA-F]{2})+', decode_hex)
+        return doc
+    
+    def _decode_hex_literals(self, doc: SourceDocument) -> SourceDocument:
+        """Decode string literals that consist only of \\xHH escapes"""
+        def decode_hex(match):
+            try:
+                decoded = bytes.fromhex(match.group(1).replace('\\x', '')).decode('utf-8', errors='ignore')
+            except ValueError:
+                return None
+            # Quotes and backslashes would need escaping, leave those literals alone
+            if decoded.isprintable() and '"' not in decoded and '\\' not in decoded:
+                return f'"{decoded}"'
+            return None
+        
+        doc.sub(r'["\']((?:\\x[0-9a-fA-F]{2})+)["\']', decode_hex)
+        return doc
+    
+    def _decode_decimal_char_strings(self, doc: SourceDocument) -> SourceDocument:
+        """Decode string.char(72, 101, 108, 108, 111) patterns"""
+        lexed = self._lexed(doc)
+        
+        def decode_chars(match):
+            # Calls quoted inside strings or comments are text, not code
+            if not lexed.in_code(match.start()):
+                return None
+            try:
+                numbers = re.findall(r'\d+', match.group(0))
+                decoded = ''.join(chr(int(n)) for n in numbers if 0 <= int(n) <= 127)
+                if decoded and all(c in string.printable for c in decoded):
+                    return lua_string(decoded)
+            except Exception:
+                pass
+            return match.group(0)
+        
+        # Match string.char(...) patterns
+        doc.sub(
+            r'string\.char\s*\(\s*(\d+\s*,?\s*)+\)',
+            decode_chars,
+            flags=re.IGNORECASE
+        )
+        return doc
+    
+    def _decode_escaped_strings(self, doc: SourceDocument) -> SourceDocument:
+        """Decode numeric escape sequences like \\104\\101\\108\\108\\111"""
+        def decode_escaped(match):
+            try:
+                content = match.group(1)
+                # Find all numeric escapes
+                numbers = [int(n) for n in re.findall(r'\\(\d{1,3})', content)]
+                # Bytes above 127 stay escaped, so the literal is left as it is
+                if any(n > 127 for n in numbers):
+                    return None
+                return lua_string(''.join(chr(n) for n in numbers))
+            except Exception:
+                return match.group(0)
+        
+        doc.sub(r'\"((?:\\[0-9]{1,3})+)\"', decode_escaped)
+        return doc
+    
+    def _decode_xor_strings(self, doc: SourceDocument) -> SourceDocument:
+        """Attempt to decode XOR encrypted strings (common pattern)"""
+        # This is a simplified version - real XOR decoding requires knowing the key
+        # We look for patterns like: for i = 1, #str do result = result .. string.char(bxor(byte(str,i), key)) end
+        return doc
+    
+    def _decode_loadstring_wrapper(self, doc: SourceDocument) -> SourceDocument:
+        """Extract code from simple loadstring wrappers"""
+        # Match loadstring("...encoded...")() patterns
+        patterns = [
+            r'loadstring\s*\(\s*[\"\'](.+?)[\"\']\s*\)\s*\(\s*\)',
+            r'load\s*\(\s*[\"\'](.+?)[\"\']\s*\)\s*\(\s*\)',
+        ]
+        
+        for pattern in patterns:
+            match = re.search(pattern, doc.source, re.DOTALL)
+            if match:
+                inner = match.group(1)
+                # Try to decode the inner content
+                try:
+                    decoded = base64.b64decode(inner).decode('utf-8', errors='ignore')
+                    if 'function' in decoded or 'local' in decoded:
+                        doc.add_edits([(0, len(doc.source), decoded)])
+                        return doc
+                except Exception:
+                    pass
+        return doc
+    
+    def _decode_string_char_concat(self, doc: SourceDocument) -> SourceDocument:
+        """Decode concatenated string.char calls"""
+        # Pattern: string.char(72)..string.char(101)..string.char(108)
+        pattern = r'((?:string\.char\s*\(\s*\d+\s*\)\s*\.\.?\s*)+string\.char\s*\(\s*\d+\s*\))'
+        lexed = self._lexed(doc)
+        
+        def decode_concat(match):
+            if not lexed.in_code(match.start()):
+                return None
+            try:
+                full_match = match.group(0)
+                numbers = re.findall(r'string\.char\s*\(\s*(\d+)\s*\)', full_match)
+                decoded = ''.join(chr(int(n)) for n in numbers if 0 <= int(n) <= 127)
+                return lua_string(decoded)
+            except Exception:
+                return match.group(0)
+        
+        doc.sub(pattern, decode_concat, flags=re.IGNORECASE)
+        return doc
+    
+    def beautify(self, doc: SourceDocument) -> SourceDocument:
+        """Beautify Lua code with proper indentation"""
+        tokens = self._lexed(doc).store
+        # Indentation comes from the block structure of the tokens, so keywords
+        # inside strings, Luau if-expressions and type annotations don't shift it
+        depths = BlockStructure(tokens).depths
+        edits = []
+        
+        line_start = 0
+        for line in doc.source.split('\n'):
+            line_end = line_start + len(line)
+            # Whether the newlines before and after the line belong to a
+            # multi-line string or comment
+            inside = line_start > 0 and tokens.index_at(line_start - 1) is not None
+            spans_end = tokens.index_at(line_end) is not None
+            
+            stripped = line.strip()
+            # Lines inside long strings and comments are content, leave them alone
+            if inside:
+                if not spans_end and stripped:
+                    edits.append((line_start + len(line.rstrip()), line_end, ''))
+                line_start = line_end + 1
+                continue
+            if not stripped:
+                edits.append((line_start, line_end, ''))
+                line_start = line_end + 1
+                continue
+            
+            # Depth of the first token on the line
+            i = bisect.bisect_left(tokens.starts, line_start)
+            indent = depths[i] if i < len(tokens) and tokens.starts[i] < line_end else 0
+            
+            # Only the surrounding whitespace of each line is rewritten
+            leading = len(line) - len(line.lstrip())
+            edits.append((line_start, line_start + leading, '    ' * indent))
+            if not spans_end:
+                edits.append((line_start + len(line.rstrip()), line_end, ''))
+            
+            line_start = line_end + 1
+        
+        doc.add_edits(edits)
+        return doc
+    
+    def rename_variables(self, doc: SourceDocument) -> SourceDocument:
+        """Rename obfuscated variables to readable names"""
+        # Find all obfuscated variable names (long random strings)
+        var_pattern = r'\b([a-zA-Z_][a-zA-Z0-9_]{15,})\b'
+        
+        # Skip common Lua globals and functions
+        keep = {'string', 'table', 'math', 'coroutine', 'debug', 'getfenv', 'setfenv', 'loadstring', 'tonumber', 'tostring'}
+        
+        # Readable names are handed out in order of first appearance
+        replacements = {}
+        lexed = self._lexed(doc)
+        source = doc.source
+        edits = []
+        for match in re.finditer(var_pattern, source):
+            var = match.group(1)
+            if var.lower() in keep or not lexed.in_code(match.start()):
+                continue
+            # Field and method names (obj.Name, obj:Name, Luau type annotations)
+            # belong to the API, not to the script; `..` and `::` are operators
+            j = match.start()
+            while j > 0 and source[j - 1].isspace():
+                j -= 1
+            before = source[max(j - 2, 0):j]
+            if before[-1:] in ('.', ':') and before[-2:] not in ('..', '::'):
+                continue
+            if var not in replacements:
+                replacements[var] = f'var_{len(replacements) + 1}'
+            edits.append((match.start(), match.end(), replacements[var]))
+        
+        doc.add_edits(edits)
+        return doc
+    
+    def deobfuscate_stages(
+        self, code: str, timings: Optional[Dict[str, float]] = None
+    ) -> Iterator[Tuple[str, SourceDocument, str]]:
+        """
+        Run the full pipeline as a generator of (stage, document, detected)
+        tuples, one per entry of STAGES.
+        
+        Each stage records its edits on its own layer, so every yielded
+        document can map its output offsets back to the input. If `timings`
+        is given it is filled with the seconds spent in each pass.
+        
+        Passes run under the job's ResourceGovernor: one that hits a limit
+        is undone and the passes after it are skipped, the stages still
+        yield what the earlier passes produced. A CPU or memory limit hit
+        outside a pass ends the pipeline early, the last stage is then
+        yielded with the document of the last finished stage.
+        """
+        governor = current_governor()
+        governor.start(len(code))
+        clock = time.perf_counter()
+        
+        def lap(name: str):
+            nonlocal clock
+            now = time.perf_counter()
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + now - clock
+            clock = now
+        
+        detected = 'Unknown/Custom'
+        # Document of the last finished stage, the result if a limit stops the pipeline
+        finished = doc = SourceDocument(code)
+        stage = STAGES[0]
+        try:
+            detected = self.detect_obfuscator(code)
+            lap('detect')
+            
+            # Unwrap loadstring payloads first so the string passes see the inner code
+            governor.run_pass('loadstring', doc, self._decode_loadstring_wrapper)
+            if doc.changed:
+                doc = doc.commit()
+            lap('loadstring')
+            
+            # Lexer dialect of the payload, used by every token-aware pass
+            self.current_dialect = self.dialect or detect_dialect(doc.source)
+            lap('dialect')
+            
+            # Stub out known obfuscator runtimes so the passes only see the payload
+            for runtime in skip_runtime(doc, dialect=self.current_dialect):
+                name = runtime.signature.obfuscator
+                if detected == 'Unknown/Custom':
+                    detected = name
+                elif name not in detected:
+                    detected += f', {name}'
+            if doc.changed:
+                doc = doc.commit()
+            lap('runtime_signatures')
+            finished = doc
+            yield stage, doc, detected
+            # The consumer's time between stages is not counted as a pass
+            clock = time.perf_counter()
+            stage = 'strings'
+            
+            # Inline library aliases and constants on their own layer, so the
+            # decoders match `string.char(72, 105)` however the script spelled it
+            governor.run_pass('constants', doc, self._propagate_constants)
+            if doc.changed:
+                doc = doc.commit()
+            lap('constants')
+            
+            # Apply all string decoding methods
+            for method in self.string_methods:
+                name = method.__name__.replace('_decode_', '', 1)
+                governor.run_pass(name, doc, method)
+                lap(name)
+            doc = doc.commit()
+            finished = doc
+            yield stage, doc, detected
+            clock = time.perf_counter()
+            stage = 'code'
+            
+            # Rename obfuscated variables
+            governor.run_pass('rename', doc, self.rename_variables)
+            lap('rename')
+            
+            # Beautify the code
+            doc = doc.commit()
+            governor.run_pass('beautify', doc, self.beautify)
+            lap('beautify')
+            finished = doc
+        except LIMIT_ERRORS as e:
+            # A limit reached between passes stops the pipeline at once
+            governor.abort(stage, limit_reason(e))
+        yield STAGES[-1], finished, detected
+    
+    def deobfuscate_document(self, code: str, timings: Optional[Dict[str, float]] = None) -> tuple[SourceDocument, str]:
+        """Run the full pipeline and keep the layered edit log, see deobfuscate_stages()"""
+        for _, doc, detected in self.deobfuscate_stages(code, timings):
+            pass
+        return doc, detected
+    
+    def deobfuscate(self, code: str) -> tuple[str, str]:
+        """Main deobfuscation method"""
+        doc, detected = self.deobfuscate_document(code)
+        return doc.text(), detected
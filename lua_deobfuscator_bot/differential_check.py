@@ -0,0 +1,568 @@
+"""
+Differential Check
+Generates Lua programs, obfuscates them with local versions of common
+transforms, deobfuscates them and compares what the original and the output
+print when run by a Lua interpreter. Also reports the throughput of every
+pass, so a speedup is checked for correctness on the same run
+
+The interpreter is a `lua`-compatible command (luajit, lua5.1, ...) or, with
+the optional lupa package installed, an embedded runtime ('lupa' or e.g.
+'lupa:lua51'). Without either, outputs are only checked to lex and balance.
+
+Usage:
+    python differential_check.py --cases 500
+    python differential_check.py --lua luajit --checks default,control_flow,vararg_wrapper
+    python differential_check.py --transforms long_names,string_char --seed 7 --failures failures/
+"""
+
+import os
+import re
+import sys
+import time
+import base64
+import random
+import shutil
+import argparse
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from advanced_deobfuscator import PrometheusDeobfuscator, PSUDeobfuscator
+from deobfuscator import PASS_ORDERS, LuaDeobfuscator
+from evaluator import score_output
+from lua_syntax import NAME, OP, STRING, scan
+
+
+# Instructions a program may run before it counts as hanging (embedded runtimes)
+STEP_LIMIT = 10_000_000
+RUN_TIMEOUT = 10.0
+
+
+# Program generator
+#
+# Programs are deterministic and print a trace of their values. Locals are
+# named v1, f2, t3, ... so the renaming transform can find them; strings may
+# contain quotes, backslashes and control characters, written as escapes
+
+_WORDS = ['alpha', 'beta', 'gamma', 'delta', 'key', 'value', 'count', 'name', 'hello', 'world']
+_FIELDS = ['key', 'count', 'name', 'size']
+
+
+class ProgramGenerator:
+    """Random Lua 5.1 compatible programs from one seed"""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.counter = 0
+        # Locals in scope per kind: 'num', 'str', 'tbl', 'fn'
+        self.scopes: List[Dict[str, List[str]]] = [defaultdict(list)]
+
+    def program(self, statements: int = 25) -> List[str]:
+        """Top-level statements of a new program"""
+        return [self.statement(depth=0) for _ in range(statements)]
+
+    def _name(self, prefix: str) -> str:
+        self.counter += 1
+        return f'{prefix}{self.counter}'
+
+    def _visible(self, kind: str) -> List[str]:
+        return [name for scope in self.scopes for name in scope[kind]]
+
+    def _declare(self, kind: str, name: str):
+        self.scopes[-1][kind].append(name)
+
+    def string_literal(self) -> str:
+        rng = self.rng
+        if rng.random() < 0.15:
+            # Text that needs escaping in a literal
+            text = rng.choice(['say "hi"', 'back\\slash', 'tab\there', 'line\nbreak', "it's"])
+        else:
+            text = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(1, 3)))
+        escaped = text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\t', '\\t')
+        return f'"{escaped}"'
+
+    def number(self) -> str:
+        numbers = self._visible('num')
+        rng = self.rng
+        choice = rng.random()
+        if numbers and choice < 0.4:
+            return rng.choice(numbers)
+        if numbers and choice < 0.6:
+            return f'({rng.choice(numbers)} {rng.choice("+-*")} {rng.randint(1, 9)})'
+        functions = self._visible('fn')
+        if functions and choice < 0.7:
+            return f'{rng.choice(functions)}({rng.randint(0, 9)}, {rng.randint(0, 9)})'
+        tables = self._visible('tbl')
+        if tables and choice < 0.8:
+            return f'#{rng.choice(tables)}'
+        return str(rng.randint(0, 100))
+
+    def string(self) -> str:
+        strings = self._visible('str')
+        rng = self.rng
+        choice = rng.random()
+        if strings and choice < 0.35:
+            return rng.choice(strings)
+        if choice < 0.5:
+            return f'({self.string_literal()} .. {self.number()})'
+        if choice < 0.6:
+            return f'string.rep({self.string_literal()}, {rng.randint(1, 3)})'
+        if choice < 0.7:
+            return f'({self.string_literal()}):upper()'
+        return self.string_literal()
+
+    def block(self, depth: int, statements: int) -> str:
+        self.scopes.append(defaultdict(list))
+        body = [self.statement(depth + 1) for _ in range(statements)]
+        self.scopes.pop()
+        return '\n'.join('    ' + line for stmt in body for line in stmt.split('\n'))
+
+    def statement(self, depth: int) -> str:
+        rng = self.rng
+        kinds = ['local_num', 'local_str', 'print', 'print', 'assign', 'table']
+        if depth < 2:
+            kinds += ['if', 'for', 'while', 'function']
+        kind = rng.choice(kinds)
+
+        if kind == 'local_num':
+            name = self._name('v')
+            statement = f'local {name} = {self.number()}'
+            self._declare('num', name)
+            return statement
+        if kind == 'local_str':
+            name = self._name('v')
+            statement = f'local {name} = {self.string()}'
+            self._declare('str', name)
+            return statement
+        if kind == 'assign' and self._visible('num'):
+            name = rng.choice(self._visible('num'))
+            return f'{name} = {name} + {self.number()}'
+        if kind == 'table':
+            name = self._name('t')
+            field = rng.choice(_FIELDS)
+            statement = (f'local {name} = {{{self.number()}, {self.string()}, {field} = {self.string()}}}\n'
+                         f'print({name}[1], {name}[2], {name}.{field}, #{name})')
+            self._declare('tbl', name)
+            return statement
+        if kind == 'if':
+            return (f'if {self.number()} > {rng.randint(0, 50)} then\n{self.block(depth, 2)}\n'
+                    f'else\n{self.block(depth, 2)}\nend')
+        if kind == 'for':
+            counter = self._name('i')
+            self.scopes.append(defaultdict(list))
+            self._declare('num', counter)
+            body = self.block(depth, 2)
+            self.scopes.pop()
+            return f'for {counter} = 1, {rng.randint(1, 4)} do\n{body}\nend'
+        if kind == 'while':
+            counter = self._name('v')
+            # Declared after the body, an assignment in it could keep the loop running
+            body = self.block(depth, 2)
+            self._declare('num', counter)
+            return (f'local {counter} = 0\nwhile {counter} < {rng.randint(1, 3)} do\n'
+                    f'    {counter} = {counter} + 1\n{body}\nend')
+        if kind == 'function':
+            name = self._name('f')
+            self.scopes.append(defaultdict(list))
+            self._declare('num', 'a')
+            self._declare('num', 'b')
+            body = self.block(depth, 1)
+            self.scopes.pop()
+            self._declare('fn', name)
+            return (f'local function {name}(a, b)\n{body}\n    return a * {rng.randint(1, 5)} + b\nend\n'
+                    f'print({name}({rng.randint(0, 9)}, {rng.randint(0, 9)}))')
+
+        values = [self.number(), self.string()]
+        rng.shuffle(values)
+        return f'print({", ".join(values[:rng.randint(1, 2)])})'
+
+
+# Obfuscating transforms
+#
+# Local reimplementations of what common obfuscators do, each one keeps the
+# program's behaviour
+
+_ESCAPES = {'n': '\n', 't': '\t', '"': '"', "'": "'", '\\': '\\'}
+_B64_DECODER = '''local function b64decode(data)
+    local alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+    data = data:gsub('[^' .. alphabet .. '=]', '')
+    return (data:gsub('.', function(x)
+        if x == '=' then return '' end
+        local r, f = '', alphabet:find(x) - 1
+        for i = 6, 1, -1 do r = r .. (f % 2 ^ i - f % 2 ^ (i - 1) > 0 and '1' or '0') end
+        return r
+    end):gsub('%d%d%d?%d?%d?%d?%d?%d?', function(x)
+        if #x ~= 8 then return '' end
+        local c = 0
+        for i = 1, 8 do c = c + (x:sub(i, i) == '1' and 2 ^ (8 - i) or 0) end
+        return string.char(c)
+    end))
+end
+'''
+
+
+def _literal_value(text: str) -> str:
+    return re.sub(r'\\(.)', lambda m: _ESCAPES.get(m.group(1), m.group(1)), text[1:-1])
+
+
+def _replace_tokens(code: str, kind: int, replace: Callable[[str], Optional[str]]) -> str:
+    """Rewrite every token of `kind`, `replace` returns None to keep one"""
+    tokens = scan(code)
+    pieces = []
+    last = 0
+    for i in range(len(tokens)):
+        if tokens.kinds[i] != kind:
+            continue
+        # Field names after . and : are not variables
+        if kind == NAME and i > 0 and tokens.kinds[i - 1] == OP and tokens.text(i - 1) in ('.', ':'):
+            continue
+        replacement = replace(tokens.text(i))
+        if replacement is not None:
+            pieces.append(code[last:tokens.starts[i]])
+            pieces.append(replacement)
+            last = tokens.ends[i]
+    pieces.append(code[last:])
+    return ''.join(pieces)
+
+
+def _encode_strings(encode: Callable[[str], str]):
+    def transform(statements: List[str], rng: random.Random) -> List[str]:
+        code = '\n'.join(statements)
+        return [_replace_tokens(code, STRING, lambda text: encode(_literal_value(text)) if len(text) > 2 else None)]
+    return transform
+
+
+def _long_names(statements: List[str], rng: random.Random) -> List[str]:
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    names: Dict[str, str] = {}
+
+    def rename(name: str) -> Optional[str]:
+        if not re.fullmatch(r'[vfti]\d+|[ab]', name):
+            return None
+        if name not in names:
+            names[name] = rng.choice(alphabet) + ''.join(rng.choice(alphabet + '0123456789_') for _ in range(rng.randint(16, 24)))
+        return names[name]
+
+    return [_replace_tokens('\n'.join(statements), NAME, rename)]
+
+
+def _junk_control_flow(statements: List[str], rng: random.Random) -> List[str]:
+    # Only single-line statements that declare nothing, a local inside the
+    # wrapper would go out of scope
+    wrapped = []
+    for statement in statements:
+        if '\n' not in statement and not statement.startswith('local') and rng.random() < 0.5:
+            statement = f'while true do {statement}; break end'
+        wrapped.append(statement)
+    return wrapped
+
+
+def _stdlib_aliases(statements: List[str], rng: random.Random) -> List[str]:
+    # Reach the string library through locals, `string.char` itself is aliased
+    code = '\n'.join(statements)
+    tokens = scan(code)
+    pieces = []
+    last = 0
+    for i in range(len(tokens) - 2):
+        if tokens.kinds[i] != NAME or tokens.text(i) != 'string':
+            continue
+        if i > 0 and tokens.kinds[i - 1] == OP and tokens.text(i - 1) in ('.', ':'):
+            continue
+        if tokens.text(i + 1) != '.':
+            continue
+        end, alias = (tokens.ends[i + 2], 'char') if tokens.text(i + 2) == 'char' else (tokens.ends[i], 'lib')
+        pieces.append(code[last:tokens.starts[i]])
+        pieces.append(alias)
+        last = end
+    if not pieces:
+        return statements
+    pieces.append(code[last:])
+    return ['local lib = string', 'local char = lib.char', ''.join(pieces)]
+
+
+def _vararg_wrapper(statements: List[str], rng: random.Random) -> List[str]:
+    body = '\n'.join(statements)
+    return [f'(function(...)\nlocal n = select("#", ...)\n{body}\nend)(...)']
+
+
+def _loadstring_base64(statements: List[str], rng: random.Random) -> List[str]:
+    payload = base64.b64encode('\n'.join(statements).encode()).decode()
+    return [
+        _B64_DECODER,
+        'local loadstring = function(source) return (_G.loadstring or load)(b64decode(source)) end',
+        f'loadstring("{payload}")()',
+    ]
+
+
+def _char_list(text: str) -> str:
+    return ', '.join(str(b) for b in text.encode())
+
+
+# Applied in this order, statement-level transforms first and wrappers last
+TRANSFORMS = {
+    'junk_control_flow': _junk_control_flow,
+    'long_names': _long_names,
+    'decimal_escapes': _encode_strings(lambda s: '"' + ''.join(f'\\{b}' for b in s.encode()) + '"'),
+    'hex_escapes': _encode_strings(lambda s: '"' + ''.join(f'\\x{b:02x}' for b in s.encode()) + '"'),
+    'string_char': _encode_strings(lambda s: f'string.char({_char_list(s)})'),
+    'char_concat': _encode_strings(lambda s: '(' + '..'.join(f'string.char({b})' for b in s.encode()) + ')'),
+    'stdlib_aliases': _stdlib_aliases,
+    'vararg_wrapper': _vararg_wrapper,
+    'loadstring_base64': _loadstring_base64,
+}
+# One string encoding per case, they all rewrite the same literals
+STRING_ENCODINGS = {'decimal_escapes', 'hex_escapes', 'string_char', 'char_concat'}
+# \xHH escapes need Lua 5.2+ or LuaJIT
+DEFAULT_TRANSFORMS = [name for name in TRANSFORMS if name != 'hex_escapes']
+
+
+# Deobfuscation checks: every pass order runs the full pipeline, the
+# aggressive passes not in the pipeline run on their own
+
+AGGRESSIVE_PASSES = {
+    'control_flow': PrometheusDeobfuscator.decode_control_flow,
+    'vararg_wrapper': PSUDeobfuscator.decode_vararg_wrapper,
+}
+
+
+# Interpreters
+
+class Trace(NamedTuple):
+    ok: bool
+    output: str
+    error: str = ''
+
+    def same_behaviour(self, other: 'Trace') -> bool:
+        # Error messages carry line numbers, which deobfuscation changes
+        return self.ok == other.ok and self.output == other.output
+
+
+class CommandLua:
+    """A lua-compatible executable reading the program from stdin"""
+
+    def __init__(self, command: str):
+        self.command = command
+
+    def run(self, code: str) -> Trace:
+        try:
+            completed = subprocess.run(
+                [self.command, '-'], input=code, capture_output=True, text=True, timeout=RUN_TIMEOUT
+            )
+        except subprocess.TimeoutExpired:
+            return Trace(False, '', 'timeout')
+        error = completed.stderr.strip().splitlines()[0] if completed.stderr.strip() else ''
+        return Trace(completed.returncode == 0, completed.stdout, error)
+
+
+class LupaLua:
+    """Embedded Lua runtime from the optional lupa package, a fresh state per run"""
+
+    def __init__(self, module: str = ''):
+        import importlib
+        self.lupa = importlib.import_module(f'lupa.{module}' if module else 'lupa')
+
+    def run(self, code: str) -> Trace:
+        runtime = self.lupa.LuaRuntime()
+        run = runtime.eval('''function(code, limit)
+            local out = {}
+            print = function(...)
+                local parts = {}
+                for i = 1, select("#", ...) do parts[i] = tostring((select(i, ...))) end
+                out[#out + 1] = table.concat(parts, "\\t")
+            end
+            local chunk, err = (loadstring or load)(code, "=program")
+            if not chunk then return false, "", err end
+            debug.sethook(function() error("step limit reached") end, "", limit)
+            local ok, run_err = pcall(chunk)
+            debug.sethook()
+            out[#out + 1] = ""
+            return ok, table.concat(out, "\\n"), tostring(run_err or "")
+        end''')
+        ok, output, error = run(code, STEP_LIMIT)
+        return Trace(bool(ok), output, '' if ok else error)
+
+
+def find_interpreter(spec: Optional[str]):
+    """Interpreter from --lua, else the first of luajit/lua5.1/lua on PATH, else lupa, else None"""
+    if spec:
+        if spec == 'lupa' or spec.startswith('lupa:'):
+            return LupaLua(spec.partition(':')[2])
+        return CommandLua(spec)
+    for command in ('luajit', 'lua5.1', 'lua'):
+        if shutil.which(command):
+            return CommandLua(command)
+    try:
+        return LupaLua('lua51')
+    except ImportError:
+        return None
+
+
+# Cases
+
+_interpreter = None
+
+
+def _init_worker(spec: Optional[str]):
+    global _interpreter
+    _interpreter = find_interpreter(spec)
+
+
+def run_case(seed: int, transforms: List[str], checks: List[str], failures: Optional[str]) -> Dict:
+    """
+    Generate, obfuscate and deobfuscate one program. Statuses per check are
+    'ok', 'mismatch' (different trace), 'broken' (output does not lex or
+    balance) or 'crash' (the pass raised).
+    """
+    rng = random.Random(seed)
+    statements = ProgramGenerator(rng).program(rng.randint(10, 40))
+    original = '\n'.join(statements)
+
+    # A random subset of the transforms, at most one string encoding
+    chosen = [name for name in transforms if rng.random() < 0.5] or [rng.choice(transforms)]
+    encodings = [name for name in chosen if name in STRING_ENCODINGS]
+    if len(encodings) > 1:
+        keep = rng.choice(encodings)
+        chosen = [name for name in chosen if name not in STRING_ENCODINGS or name == keep]
+    obfuscated = statements
+    for name in TRANSFORMS:
+        if name in chosen:
+            obfuscated = TRANSFORMS[name](obfuscated, rng)
+    obfuscated = '\n'.join(obfuscated)
+
+    result = {'seed': seed, 'transforms': chosen, 'bytes': len(obfuscated), 'checks': {}, 'passes': {}}
+    expected = None
+    if _interpreter is not None:
+        expected = _interpreter.run(original)
+        # The generator or a transform is at fault, not the deobfuscator
+        if not expected.ok or not _interpreter.run(obfuscated).same_behaviour(expected):
+            result['status'] = 'invalid'
+            _save_failure(failures, seed, 'invalid', original, obfuscated, None)
+            return result
+    result['status'] = 'checked'
+
+    for check in checks:
+        started = time.perf_counter()
+        try:
+            if check in AGGRESSIVE_PASSES:
+                output = AGGRESSIVE_PASSES[check](obfuscated)
+            else:
+                timings = {}
+                doc, _ = LuaDeobfuscator(check).deobfuscate_document(obfuscated, timings)
+                output = doc.text()
+                for name, seconds in timings.items():
+                    result['passes'][name] = result['passes'].get(name, 0.0) + seconds
+        except Exception as e:
+            result['checks'][check] = {'status': 'crash', 'seconds': time.perf_counter() - started,
+                                       'error': f'{type(e).__name__}: {e}'}
+            continue
+        seconds = time.perf_counter() - started
+
+        status = 'ok'
+        if expected is not None and not _interpreter.run(output).same_behaviour(expected):
+            status = 'mismatch'
+        elif expected is None and score_output(output).valid < 1.0 <= score_output(obfuscated).valid:
+            status = 'broken'
+        if status != 'ok':
+            _save_failure(failures, seed, check, original, obfuscated, output)
+        result['checks'][check] = {'status': status, 'seconds': seconds}
+    return result
+
+
+def _save_failure(directory: Optional[str], seed: int, check: str, original: str, obfuscated: str,
+                  output: Optional[str]):
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    files = {'original': original, 'obfuscated': obfuscated, 'output': output}
+    for name, text in files.items():
+        if text is not None:
+            with open(os.path.join(directory, f'{seed}_{check}_{name}.lua'), 'w', encoding='utf-8') as f:
+                f.write(text)
+
+
+def report(results: List[Dict], checks: List[str], elapsed: float, interpreter) -> bool:
+    """Print the summary tables, returns whether every check passed"""
+    checked = [r for r in results if r['status'] == 'checked']
+    invalid = len(results) - len(checked)
+    total_bytes = sum(r['bytes'] for r in checked)
+    mode = type(interpreter).__name__ if interpreter is not None else 'no interpreter, lex/balance only'
+    print(f'{len(results)} cases in {elapsed:.1f}s ({mode}), {invalid} invalid programs skipped')
+
+    print()
+    print(f'{"check":<18}{"ok":>7}{"mismatch":>10}{"broken":>8}{"crash":>7}{"MB/s":>9}')
+    passed = True
+    for check in checks:
+        counts = defaultdict(int)
+        seconds = 0.0
+        for r in checked:
+            entry = r['checks'].get(check)
+            if entry is not None:
+                counts[entry['status']] += 1
+                seconds += entry['seconds']
+        passed = passed and counts['ok'] == len(checked)
+        throughput = total_bytes / seconds / 1e6 if seconds else 0.0
+        print(f'{check:<18}{counts["ok"]:>7}{counts["mismatch"]:>10}{counts["broken"]:>8}{counts["crash"]:>7}{throughput:>9.2f}')
+
+    print()
+    print(f'{"transform":<18}{"cases":>7}{"failing":>9}')
+    for name in TRANSFORMS:
+        cases = [r for r in checked if name in r['transforms']]
+        if cases:
+            failing = sum(1 for r in cases if any(e['status'] != 'ok' for e in r['checks'].values()))
+            print(f'{name:<18}{len(cases):>7}{failing:>9}')
+
+    # Every pipeline pass sees the whole input of its case once per pass order
+    pipelines = sum(1 for check in checks if check not in AGGRESSIVE_PASSES)
+    pass_seconds = defaultdict(float)
+    for r in checked:
+        for name, seconds in r['passes'].items():
+            pass_seconds[name] += seconds
+    if pass_seconds:
+        print()
+        print(f'{"pass":<22}{"seconds":>9}{"MB/s":>9}')
+        for name, seconds in sorted(pass_seconds.items(), key=lambda item: -item[1]):
+            throughput = total_bytes * pipelines / seconds / 1e6 if seconds else float('inf')
+            print(f'{name:<22}{seconds:>9.3f}{throughput:>9.1f}')
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that deobfuscation keeps the behaviour of generated programs')
+    parser.add_argument('--cases', type=int, default=200, help='Programs to generate')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first case, case i uses seed + i')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Processes to run cases in')
+    parser.add_argument('--lua', help="Interpreter command, or 'lupa' / 'lupa:<module>' for an embedded one")
+    parser.add_argument('--transforms', default=','.join(DEFAULT_TRANSFORMS),
+                        help=f'Comma separated obfuscations to draw from: {", ".join(TRANSFORMS)}')
+    parser.add_argument('--checks', default=','.join(list(PASS_ORDERS) + list(AGGRESSIVE_PASSES)),
+                        help='Comma separated pass orders and aggressive passes to check')
+    parser.add_argument('--failures', help='Directory to write the programs of failing cases to')
+    args = parser.parse_args()
+
+    transforms = args.transforms.split(',')
+    checks = args.checks.split(',')
+    for name in transforms:
+        if name not in TRANSFORMS:
+            parser.error(f'unknown transform {name}')
+    for name in checks:
+        if name not in PASS_ORDERS and name not in AGGRESSIVE_PASSES:
+            parser.error(f'unknown check {name}')
+
+    interpreter = find_interpreter(args.lua)
+    if interpreter is None:
+        print('⚠️ No Lua interpreter found (install luajit/lua5.1 or lupa), traces are not compared', file=sys.stderr)
+
+    started = time.perf_counter()
+    seeds = range(args.seed, args.seed + args.cases)
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(args.lua,)) as pool:
+        results = list(pool.map(
+            run_case, seeds, [transforms] * args.cases, [checks] * args.cases, [args.failures] * args.cases,
+            chunksize=max(1, args.cases // (4 * args.jobs)),
+        ))
+    passed = report(results, checks, time.perf_counter() - started, interpreter)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
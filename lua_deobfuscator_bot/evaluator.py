@@ -0,0 +1,109 @@
+"""
+Output Evaluator
+Cheap scoring of deobfuscated Lua, used to pick the best of several pass orders
+"""
+
+import re
+from dataclasses import dataclass, asdict
+
+from lua_syntax import LUA, BAD, INTERP, LONG_STRING, NAME, NUMBER, OP, STRING, BlockStructure, scan
+
+
+_PAIRS = {')': '(', ']': '[', '}': '{'}
+
+_ESCAPE = re.compile(r'\\(?:\d{1,3}|x[0-9a-fA-F]{2}|u\{[0-9a-fA-F]+\})')
+_ENCODED_BLOB = re.compile(r'^[A-Za-z0-9+/]{16,}={0,2}$')
+_CONTROL = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+_VOWELS = set('aeiouAEIOU')
+
+
+@dataclass
+class Score:
+    """Components are in [0, 1], higher is better"""
+    valid: float
+    readable_identifiers: float
+    decoded_strings: float
+    clean_text: float
+
+    @property
+    def total(self) -> float:
+        return (
+            0.4 * self.valid
+            + 0.25 * self.readable_identifiers
+            + 0.25 * self.decoded_strings
+            + 0.1 * self.clean_text
+        )
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), 'total': round(self.total, 4)}
+
+
+def is_readable_identifier(name: str) -> bool:
+    """Heuristic for names a person would write (renamed var_N counts as readable)"""
+    if len(name) > 24:
+        return False
+    if len(name) >= 4 and not name.strip('Il1_O0'):
+        return False
+    letters = [c for c in name if c.isalpha()]
+    if len(letters) >= 6 and sum(c in _VOWELS for c in letters) / len(letters) < 0.15:
+        return False
+    return True
+
+
+def score_output(code: str, dialect: str = LUA) -> Score:
+    """
+    Score `code` in one tokenizer pass of its dialect.
+
+    - valid: 1.0 when every token lexes, brackets and blocks balance and no
+      string literal is glued to the next token (what decoding a hex run
+      inside a literal produces); partial credit otherwise
+    - readable_identifiers: share of non-keyword names that look readable
+    - decoded_strings: share of string literal characters that are plain text
+      rather than escapes or base64 blobs
+    - clean_text: 1.0 minus the share of control characters
+    """
+    tokens = scan(code, dialect)
+    names = readable = 0
+    literal_chars = plain_chars = 0
+    bad = glued = 0
+    stack = []
+    unbalanced = 0
+    previous_kind = previous_end = None
+
+    for kind, start, end in zip(tokens.kinds, tokens.starts, tokens.ends):
+        if kind == BAD:
+            bad += 1
+        elif kind == NAME:
+            names += 1
+            readable += is_readable_identifier(code[start:end])
+        elif kind in (STRING, LONG_STRING, INTERP):
+            text = code[start:end]
+            if kind == LONG_STRING:
+                body = text[text.index('[', 1) + 1:text.rindex(']', 0, -1)]
+            else:
+                body = text[1:-1]
+            literal_chars += len(body)
+            if not _ENCODED_BLOB.match(body):
+                plain_chars += len(body) - sum(len(m) for m in _ESCAPE.findall(body))
+        elif kind == OP and end - start == 1:
+            text = code[start]
+            if text in '([{':
+                stack.append(text)
+            elif text in ')]}':
+                if stack and stack[-1] == _PAIRS[text]:
+                    stack.pop()
+                else:
+                    unbalanced += 1
+
+        if previous_kind == STRING and previous_end == start and kind in (STRING, NAME, NUMBER):
+            glued += 1
+        previous_kind, previous_end = kind, end
+
+    blocks = BlockStructure(tokens)
+    problems = bad + glued + unbalanced + len(stack) + blocks.unclosed + blocks.stray
+    return Score(
+        valid=1.0 / (1.0 + problems),
+        readable_identifiers=readable / names if names else 1.0,
+        decoded_strings=plain_chars / literal_chars if literal_chars else 1.0,
+        clean_text=1.0 - len(_CONTROL.findall(code)) / len(code) if code else 1.0,
+    )
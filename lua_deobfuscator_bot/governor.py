@@ -0,0 +1,188 @@
+"""
+Job Resource Governor
+CPU time, memory and output size limits for one job in a worker process, so a
+pathological input ends with the passes that finished instead of taking the
+process with it
+"""
+
+import signal
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+from source_edits import SourceDocument
+
+try:
+    import resource
+except ImportError:
+    # No rlimits on Windows, only the output budget applies there
+    resource = None
+
+
+DEFAULT_CPU_SECONDS = 120.0              # CPU time of one job
+DEFAULT_MEMORY = 2 * 1024 * 1024 * 1024  # address space one job may add to its process
+DEFAULT_MAX_OUTPUT = 64 * 1024 * 1024    # characters of output, whatever the input size
+DEFAULT_MAX_GROWTH = 16                  # output characters per input character
+DEFAULT_MIN_OUTPUT = 1024 * 1024         # small inputs may always grow to this
+
+# CPU seconds a job gets after its limit to wrap up with the passes that finished
+CPU_GRACE = 5.0
+
+
+class ResourceLimitExceeded(BaseException):
+    """
+    A job ran into its CPU time limit. Like KeyboardInterrupt it is not an
+    Exception, so the error handling of a pass does not swallow it.
+    """
+
+
+# Errors that stop a job at a limit, see limit_reason()
+LIMIT_ERRORS = (ResourceLimitExceeded, MemoryError)
+
+
+def limit_reason(error: BaseException) -> str:
+    """Name of the limit behind one of LIMIT_ERRORS, as recorded in ResourceGovernor.stats"""
+    return 'cpu' if isinstance(error, ResourceLimitExceeded) else 'memory'
+
+
+class ResourceGovernor:
+    """
+    Limits of one job. The rlimits are applied by governed_job(), the output
+    budget is checked by run_pass() after every pass.
+
+    A pass that exceeds the CPU or memory limit is stopped where it is, a
+    pass whose edits grow the output past the budget is undone when it
+    returns. Either way the document keeps the edits of the passes before
+    it, and once a limit was hit the remaining passes are skipped.
+    """
+
+    def __init__(
+        self,
+        cpu_seconds: Optional[float] = None,
+        memory: Optional[int] = None,
+        max_output: int = DEFAULT_MAX_OUTPUT,
+        max_growth: float = DEFAULT_MAX_GROWTH,
+    ):
+        self.cpu_seconds = cpu_seconds
+        self.memory = memory
+        self.max_output = max_output
+        self.max_growth = max_growth
+        self.output_limit: Optional[int] = None
+        self.stats = {'aborted': []}
+
+    @property
+    def exhausted(self) -> bool:
+        return bool(self.stats['aborted'])
+
+    def start(self, input_length: int):
+        """Size the output budget for an input of `input_length` characters"""
+        self.output_limit = min(self.max_output, max(int(input_length * self.max_growth), DEFAULT_MIN_OUTPUT))
+
+    def abort(self, name: str, reason: str):
+        """Record that `name` ran into the `reason` limit, the remaining passes are skipped"""
+        self.stats['aborted'].append({'pass': name, 'reason': reason})
+
+    def run_pass(self, name: str, doc: SourceDocument, method: Callable[[SourceDocument], object]) -> bool:
+        """
+        Run `method` on `doc` within the limits. Returns False, with the
+        edits of the pass rolled back, when the pass ran into a limit or
+        the governor already was exhausted.
+        """
+        if self.exhausted:
+            return False
+        checkpoint = doc.checkpoint()
+        try:
+            method(doc)
+        except LIMIT_ERRORS as e:
+            doc.rollback(checkpoint)
+            self.abort(name, limit_reason(e))
+            return False
+        if self.output_limit is not None and doc.output_length() > self.output_limit:
+            doc.rollback(checkpoint)
+            self.abort(name, 'output')
+            return False
+        return True
+
+
+_current_governor: contextvars.ContextVar = contextvars.ContextVar('resource_governor', default=None)
+
+
+def current_governor() -> ResourceGovernor:
+    """The governor of the running job, or one with only the default output budget outside of a job"""
+    return _current_governor.get() or ResourceGovernor()
+
+
+def _address_space() -> int:
+    """Bytes of address space the process uses now, 0 where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _set_soft_limit(which: int, soft: int):
+    _, hard = resource.getrlimit(which)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(which, (soft, hard))
+
+
+@contextmanager
+def governed_job(**limits):
+    """
+    Make one ResourceGovernor apply to the job run inside the block.
+
+    With `cpu_seconds` or `memory` set, the soft RLIMIT_CPU and RLIMIT_AS of
+    the process are lowered to what it uses now plus the limit, and put back
+    afterwards. Running out of address space raises MemoryError; reaching
+    the CPU limit raises ResourceLimitExceeded from the SIGXCPU handler. The
+    limit is extended once by CPU_GRACE seconds to wrap up with the passes
+    that finished; past that the kernel signals every second and every
+    signal raises again. Only the main
+    thread of a process that runs one job at a time (a pool process) may set
+    them, elsewhere they are ignored. Hard limits are never touched, they
+    could not be raised again for the next job.
+    """
+    governor = ResourceGovernor(**limits)
+    restore: List[Tuple[int, Tuple[int, int]]] = []
+    previous_handler = None
+    handled = False
+    # The handler runs until the limits are put back, but only raises inside the block
+    state = {'active': True, 'extended': False}
+    apply = resource is not None and threading.current_thread() is threading.main_thread()
+
+    if apply and governor.cpu_seconds:
+        def on_cpu_limit(signum, frame):
+            if not state['active']:
+                return
+            if not state['extended']:
+                state['extended'] = True
+                _set_soft_limit(resource.RLIMIT_CPU, int(_cpu_used() + CPU_GRACE) + 1)
+            raise ResourceLimitExceeded(f'CPU time limit of {governor.cpu_seconds:g}s reached')
+
+        restore.append((resource.RLIMIT_CPU, resource.getrlimit(resource.RLIMIT_CPU)))
+        previous_handler = signal.signal(signal.SIGXCPU, on_cpu_limit)
+        handled = True
+        _set_soft_limit(resource.RLIMIT_CPU, int(_cpu_used() + governor.cpu_seconds) + 1)
+    if apply and governor.memory:
+        restore.append((resource.RLIMIT_AS, resource.getrlimit(resource.RLIMIT_AS)))
+        _set_soft_limit(resource.RLIMIT_AS, _address_space() + governor.memory)
+
+    token = _current_governor.set(governor)
+    try:
+        yield governor
+    finally:
+        state['active'] = False
+        _current_governor.reset(token)
+        for which, limit in reversed(restore):
+            resource.setrlimit(which, limit)
+        if handled:
+            # None means a handler not installed from Python, the default is the closest
+            signal.signal(signal.SIGXCPU, signal.SIG_DFL if previous_handler is None else previous_handler)
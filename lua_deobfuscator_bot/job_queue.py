@@ -0,0 +1,427 @@
+"""
+Job Queue Backends
+Gateway shards enqueue deobfuscation jobs, stateless workers claim and run them
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import sqlite3
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+# Awaited by wait_result() with each new partial result of a job
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class Job:
+    """
+    A unit of work for the workers.
+
+    The id is a hash of the kind and payload, so submitting the same script twice
+    (from any shard) attaches to the existing job instead of running it again.
+    """
+
+    __slots__ = ('id', 'kind', 'payload', 'shard_id', 'attempts')
+
+    def __init__(self, kind: str, payload: Dict[str, Any], shard_id: int = 0,
+                 job_id: Optional[str] = None, attempts: int = 0):
+        self.kind = kind
+        self.payload = payload
+        self.shard_id = shard_id
+        self.attempts = attempts
+        self.id = job_id or job_hash(kind, payload)
+
+
+def job_hash(kind: str, payload: Dict[str, Any]) -> str:
+    data = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+
+class JobFailed(Exception):
+    """Raised by wait_result() when a job failed on every attempt"""
+
+
+class JobQueue:
+    """
+    Interface of a queue backend.
+
+    Delivery is at-least-once: a claimed job carries a lease, and a job whose
+    worker dies is handed out again after the lease expires. Completing a job
+    twice is harmless because the first result wins.
+    """
+
+    def __init__(self, lease_seconds: float = 300.0, max_attempts: int = 3, poll_interval: float = 0.2):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+
+    async def enqueue(self, job: Job) -> str:
+        raise NotImplementedError
+
+    async def claim(self, worker_id: str) -> Optional[Job]:
+        """Lease the oldest runnable job, None when the queue is empty"""
+        raise NotImplementedError
+
+    async def complete(self, job_id: str, result: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def fail(self, job_id: str, error: str):
+        """Record a failed attempt, the job is retried until max_attempts"""
+        raise NotImplementedError
+
+    async def progress(self, job_id: str, partial: Dict[str, Any]):
+        """
+        Record the latest partial result of a running job. `partial` has a
+        'stage' key; it replaces the previous partial result and is dropped
+        when the job completes.
+        """
+        raise NotImplementedError
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """{'status': ..., 'result': ..., 'error': ..., 'partial': ...} or None for unknown jobs"""
+        raise NotImplementedError
+
+    async def depth(self) -> int:
+        """Number of jobs waiting to be claimed"""
+        raise NotImplementedError
+
+    async def wait_result(self, job_id: str, timeout: Optional[float] = None,
+                          on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """
+        Wait until the job is done and return its result. `on_progress` is
+        awaited with every new partial result seen meanwhile.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        seen = None
+        while True:
+            state = await self.status(job_id)
+            if state is not None:
+                if state['status'] == 'done':
+                    return state['result']
+                if state['status'] == 'failed':
+                    raise JobFailed(state['error'])
+                partial = state.get('partial')
+                if on_progress is not None and partial is not None and partial['stage'] != seen:
+                    seen = partial['stage']
+                    await on_progress(partial)
+            if deadline is not None and time.monotonic() > deadline:
+                raise asyncio.TimeoutError(f'job {job_id[:12]} did not finish in {timeout}s')
+            await asyncio.sleep(self.poll_interval)
+
+    async def wait_for_work(self):
+        """Block a worker until new jobs may be available"""
+        await asyncio.sleep(self.poll_interval)
+
+    async def submit(self, job: Job, timeout: Optional[float] = None,
+                     on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        return await self.wait_result(await self.enqueue(job), timeout, on_progress)
+
+    async def close(self):
+        pass
+
+
+class InProcessQueue(JobQueue):
+    """Queue living in the bot process, for single-box deployments and tests"""
+
+    def __init__(self, max_finished: int = 1000, **kwargs):
+        super().__init__(**kwargs)
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._order = []
+        # Finished jobs are kept for deduplication, oldest dropped first
+        self._finished = deque()
+        self.max_finished = max_finished
+        self._changed = asyncio.Condition()
+        # Idle workers wait on this instead of the condition: cancelling a
+        # wait_for() around Condition.wait() can hang on Python 3.11
+        self._work = asyncio.Event()
+
+    async def enqueue(self, job: Job) -> str:
+        async with self._changed:
+            existing = self.jobs.get(job.id)
+            # Failed jobs can be submitted again, everything else is deduplicated
+            if existing is None or existing['status'] == 'failed':
+                self.jobs[job.id] = {
+                    'job': job, 'status': 'queued', 'lease_until': 0.0,
+                    'result': None, 'error': None, 'partial': None,
+                }
+                self._order.append(job.id)
+                self._changed.notify_all()
+                self._wake_workers()
+        return job.id
+
+    async def claim(self, worker_id: str) -> Optional[Job]:
+        now = time.monotonic()
+        async with self._changed:
+            for job_id in self._order:
+                entry = self.jobs[job_id]
+                if entry['status'] == 'queued' or (entry['status'] == 'running' and entry['lease_until'] < now):
+                    entry['status'] = 'running'
+                    entry['lease_until'] = now + self.lease_seconds
+                    entry['job'].attempts += 1
+                    self._order.remove(job_id)
+                    self._order.append(job_id)
+                    return entry['job']
+        return None
+
+    async def complete(self, job_id: str, result: Dict[str, Any]):
+        async with self._changed:
+            entry = self.jobs.get(job_id)
+            if entry is not None and entry['status'] != 'done':
+                entry['status'] = 'done'
+                entry['result'] = result
+                entry['partial'] = None
+                self._order.remove(job_id)
+                self._retire(job_id)
+                self._changed.notify_all()
+
+    async def fail(self, job_id: str, error: str):
+        async with self._changed:
+            entry = self.jobs.get(job_id)
+            if entry is None or entry['status'] == 'done':
+                return
+            entry['error'] = error
+            if entry['job'].attempts >= self.max_attempts:
+                entry['status'] = 'failed'
+                self._order.remove(job_id)
+                self._retire(job_id)
+            else:
+                entry['status'] = 'queued'
+                self._wake_workers()
+            self._changed.notify_all()
+
+    async def progress(self, job_id: str, partial: Dict[str, Any]):
+        async with self._changed:
+            entry = self.jobs.get(job_id)
+            if entry is not None and entry['status'] == 'running':
+                entry['partial'] = partial
+                self._changed.notify_all()
+
+    def _wake_workers(self):
+        self._work.set()
+        self._work = asyncio.Event()
+
+    def _retire(self, job_id: str):
+        self._finished.append(job_id)
+        while len(self._finished) > self.max_finished:
+            old = self._finished.popleft()
+            if self.jobs.get(old, {}).get('status') in ('done', 'failed'):
+                del self.jobs[old]
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        entry = self.jobs.get(job_id)
+        if entry is None:
+            return None
+        return {
+            'status': entry['status'], 'result': entry['result'], 'error': entry['error'],
+            'partial': entry['partial'],
+        }
+
+    async def depth(self) -> int:
+        return sum(1 for job_id in self._order if self.jobs[job_id]['status'] == 'queued')
+
+    async def wait_for_work(self):
+        try:
+            # Leases can expire without a notification, so wake up now and then
+            await asyncio.wait_for(self._work.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait_result(self, job_id: str, timeout: Optional[float] = None,
+                          on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        seen = None
+
+        def finished():
+            entry = self.jobs.get(job_id)
+            return entry is None or entry['status'] in ('done', 'failed')
+
+        def changed():
+            partial = self.jobs[job_id]['partial']
+            return on_progress is not None and partial is not None and partial is not seen
+
+        async def done_or_progress():
+            async with self._changed:
+                await self._changed.wait_for(lambda: finished() or changed())
+
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            await asyncio.wait_for(done_or_progress(), remaining)
+            if finished():
+                break
+            # Reported outside the lock, the callback may be slow
+            seen = self.jobs[job_id]['partial']
+            await on_progress(seen)
+        entry = self.jobs.get(job_id)
+        if entry is None:
+            raise JobFailed(f'job {job_id[:12]} is no longer tracked')
+        if entry['status'] == 'failed':
+            raise JobFailed(entry['error'])
+        return entry['result']
+
+
+class SQLiteQueue(JobQueue):
+    """
+    Queue in a SQLite database file shared by the gateway and worker processes.
+
+    Good for several processes on one node. Workers on other nodes need a
+    backend with network access behind the same JobQueue interface.
+    """
+
+    def __init__(self, path: str, retention_seconds: float = 86400.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        # Finished jobs double as a result cache for duplicate uploads
+        self.retention_seconds = retention_seconds
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    shard_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    partial TEXT
+                )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (status, created)')
+            columns = {row[1] for row in db.execute('PRAGMA table_info(jobs)')}
+            if 'partial' not in columns:
+                # Databases created before partial results existed
+                db.execute('ALTER TABLE jobs ADD COLUMN partial TEXT')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _enqueue(self, job: Job) -> str:
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT status FROM jobs WHERE id = ?', (job.id,)).fetchone()
+            if row is None:
+                db.execute(
+                    'INSERT INTO jobs (id, kind, payload, shard_id, status, created) VALUES (?, ?, ?, ?, ?, ?)',
+                    (job.id, job.kind, json.dumps(job.payload), job.shard_id, 'queued', time.time())
+                )
+            elif row[0] == 'failed':
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, shard_id = ? WHERE id = ?",
+                    (job.shard_id, job.id)
+                )
+            db.execute('COMMIT')
+        return job.id
+
+    def _claim(self, worker_id: str) -> Optional[Job]:
+        now = time.time()
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute(
+                "SELECT id, kind, payload, shard_id, attempts FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker_id, now + self.lease_seconds, row[0])
+            )
+            db.execute('COMMIT')
+        return Job(row[1], json.loads(row[2]), shard_id=row[3], job_id=row[0], attempts=row[4] + 1)
+
+    def _complete(self, job_id: str, result: Dict[str, Any]):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'done', result = ?, payload = '{}', partial = NULL WHERE id = ? AND status != 'done'",
+                (json.dumps(result), job_id)
+            )
+            db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND created < ?",
+                (time.time() - self.retention_seconds,)
+            )
+
+    def _fail(self, job_id: str, error: str):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET error = ?, status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END "
+                "WHERE id = ? AND status != 'done'",
+                (error, self.max_attempts, job_id)
+            )
+
+    def _progress(self, job_id: str, partial: Dict[str, Any]):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET partial = ? WHERE id = ? AND status = 'running'",
+                (json.dumps(partial), job_id)
+            )
+
+    def _status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as db:
+            row = db.execute('SELECT status, result, error, partial FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'status': row[0], 'result': json.loads(row[1]) if row[1] else None, 'error': row[2],
+            'partial': json.loads(row[3]) if row[3] else None,
+        }
+
+    def _depth(self) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    async def enqueue(self, job: Job) -> str:
+        return await asyncio.to_thread(self._enqueue, job)
+
+    async def claim(self, worker_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self._claim, worker_id)
+
+    async def complete(self, job_id: str, result: Dict[str, Any]):
+        await asyncio.to_thread(self._complete, job_id, result)
+
+    async def fail(self, job_id: str, error: str):
+        await asyncio.to_thread(self._fail, job_id, error)
+
+    async def progress(self, job_id: str, partial: Dict[str, Any]):
+        await asyncio.to_thread(self._progress, job_id, partial)
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._status, job_id)
+
+    async def depth(self) -> int:
+        return await asyncio.to_thread(self._depth)
+
+
+def open_queue(url: Optional[str]) -> JobQueue:
+    """
+    Open a queue backend from a URL.
+
+    - None, '' or 'memory://' -> InProcessQueue
+    - 'sqlite:///path/to/jobs.db' -> SQLiteQueue
+    """
+    if not url or url == 'memory://':
+        return InProcessQueue()
+    if url.startswith('sqlite:///'):
+        return SQLiteQueue(url[len('sqlite:///'):])
+    raise ValueError(f'Unsupported job queue URL: {url}')
+
+
+def new_worker_id() -> str:
+    return f'{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
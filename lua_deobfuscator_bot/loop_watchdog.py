@@ -0,0 +1,173 @@
+"""
+Event Loop Watchdog
+Measures loop lag, dumps the stack of whatever holds the loop past a threshold,
+and keeps the slowest recent handler executions for the /slow admin command
+"""
+
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+
+logger = logging.getLogger('lua_deobfuscator.watchdog')
+
+
+@dataclass
+class HandlerRun:
+    """One finished handler execution"""
+    name: str
+    started: float
+    duration: float
+    input_bytes: int
+    max_lag: float
+    error: Optional[str] = None
+
+
+@dataclass
+class Stall:
+    """The loop was held for at least `duration` seconds by the code in `stack`"""
+    started: float
+    duration: float
+    handlers: List[str]
+    stack: str = field(repr=False)
+
+
+class LoopWatchdog:
+    """
+    Watches one event loop from a helper thread.
+
+    A task on the loop records a heartbeat every `interval` seconds. When the
+    thread sees no heartbeat for `threshold` seconds, the loop is blocked by a
+    synchronous call, so it captures the loop thread's current stack (which
+    includes the coroutine that made the call) once per stall and logs it.
+
+    Handlers wrapped with `traced` are timed. The last `history` runs slower
+    than `slow_threshold` are kept in a ring buffer along with input size and
+    the worst loop lag seen while they ran.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.25,
+        interval: float = 0.05,
+        slow_threshold: float = 1.0,
+        history: int = 50,
+        on_lag: Optional[Callable[[float], None]] = None,
+    ):
+        self.threshold = threshold
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.on_lag = on_lag
+
+        self.slow_runs: deque = deque(maxlen=history)
+        self.stalls: deque = deque(maxlen=10)
+        self.max_lag = 0.0
+
+        self._active: Dict[int, tuple] = {}
+        self._next_token = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def start(self):
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    async def _beat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self._heartbeat = time.monotonic()
+            for entry in self._active.values():
+                entry[2] = max(entry[2], lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if self.on_lag is not None:
+                self.on_lag(lag)
+
+    def _watch(self):
+        dumped_for = None
+        while not self._stopped.wait(self.interval):
+            beat = self._heartbeat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold or dumped_for == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            # One dump per stall, the next one needs a fresh heartbeat first
+            dumped_for = beat
+            stall = Stall(
+                started=time.time() - blocked,
+                duration=blocked,
+                handlers=[name for name, _, _, _ in self._active.values()],
+                stack=''.join(traceback.format_stack(frame)),
+            )
+            self.stalls.append(stall)
+            logger.warning(
+                'Event loop blocked for %.3fs (handlers running: %s)\n%s',
+                blocked, ', '.join(stall.handlers) or 'none', stall.stack
+            )
+
+    def traced(self, name: Optional[str] = None, size: Optional[Callable[..., int]] = None):
+        """
+        Decorate an async handler so its runs are timed.
+
+        `size` receives the handler's arguments and returns the input size in
+        bytes, e.g. `lambda interaction, file, **_: file.size`.
+        """
+        def decorator(func):
+            label = name or func.__name__
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                try:
+                    input_bytes = size(*args, **kwargs) if size is not None else 0
+                except Exception:
+                    input_bytes = 0
+                token = self._next_token
+                self._next_token += 1
+                entry = self._active[token] = [label, time.time(), 0.0, input_bytes]
+                start = time.perf_counter()
+                error = None
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    del self._active[token]
+                    self._record(HandlerRun(label, entry[1], time.perf_counter() - start, input_bytes, entry[2], error))
+            return wrapper
+        return decorator
+
+    def _record(self, run: HandlerRun):
+        if run.duration >= self.slow_threshold or run.max_lag >= self.threshold:
+            self.slow_runs.append(run)
+
+    def slowest(self, limit: int = 10) -> List[HandlerRun]:
+        """The slowest runs still in the ring buffer, slowest first"""
+        return sorted(self.slow_runs, key=lambda run: run.duration, reverse=True)[:limit]
@@ -0,0 +1,476 @@
+"""
+Lua / Luau Lexer
+Tokenizer with a Lua 5.1 and a Roblox Luau dialect, plus the block structure
+scan the structural passes (renaming, folding, beautifying) work from
+"""
+
+import re
+import bisect
+from array import array
+from itertools import repeat
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+
+LUA = 'lua'
+LUAU = 'luau'
+
+LUA_KEYWORDS = {
+    'and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for', 'function', 'goto',
+    'if', 'in', 'local', 'nil', 'not', 'or', 'repeat', 'return', 'then', 'true',
+    'until', 'while',
+}
+
+# Luau compound assignments, return type arrows and optional types
+LUAU_OPERATORS = {'+=', '-=', '*=', '/=', '//=', '%=', '^=', '..=', '->', '?'}
+
+# One match per token: leading whitespace is consumed inside the match and the
+# token is the group that matched. Keywords get their own group so names never
+# need a Python-side lookup
+_KEYWORD_GROUP = r'(?P<keyword>(?:%s)(?![A-Za-z0-9_]))' % '|'.join(sorted(LUA_KEYWORDS, key=len, reverse=True))
+
+_COMMON = r'''
+    \s*(?:
+    (?P<comment>--\[(?P<c_eq>=*)\[.*?\](?P=c_eq)\]|--[^\n]*)
+  | (?P<long_string>\[(?P<s_eq>=*)\[.*?\](?P=s_eq)\])
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+'''
+
+_LUA_TOKEN = re.compile(_COMMON + r'''
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | ''' + _KEYWORD_GROUP + r'''
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>\.\.\.|\.\.|==|~=|<=|>=|::|//|<<|>>|[-+*/%^#&~|<>=(){}\[\];:,.])
+  | (?P<bad>.)
+    )
+''', re.VERBOSE | re.DOTALL)
+
+# Luau adds digit separators, binary literals, the operators above and `strings`.
+# Braces are matched on their own to track the expressions inside interpolations
+_LUAU_TOKEN = re.compile(_COMMON + r'''
+  | (?P<number>0[xX][0-9a-fA-F_]+|0[bB][01_]+|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?)
+  | ''' + _KEYWORD_GROUP + r'''
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<lbrace>\{)
+  | (?P<rbrace>\})
+  | (?P<op>\.\.\.|\.\.=|\.\.|//=|==|~=|<=|>=|::|->|//|[-+*/%^]=|[-+*/%^#<>=()\[\];:,.?])
+  | (?P<backtick>`)
+  | (?P<bad>.)
+    )
+''', re.VERBOSE | re.DOTALL)
+
+# Literal part of an interpolated string up to the next unescaped ` or {
+_INTERP_SEGMENT = re.compile(r'(?:[^`{\\]|\\.)*([`{])', re.DOTALL)
+
+# Strings and comments only, the parts of a script that are not code. Found
+# with one regex search instead of a full tokenization; interpolated strings
+# are taken as a whole
+_OPAQUE = r'''
+    --\[(?P<c_eq>=*)\[.*?\](?P=c_eq)\]|--[^\n]*
+  | \[(?P<s_eq>=*)\[.*?\](?P=s_eq)\]
+  | "(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'
+'''
+_LUA_OPAQUE = re.compile(_OPAQUE, re.VERBOSE | re.DOTALL)
+_LUAU_OPAQUE = re.compile(_OPAQUE + r'| `(?:[^`\\]|\\.)*`', re.VERBOSE | re.DOTALL)
+
+# Text that may be Luau-only syntax, confirmed on the tokens before it counts.
+# Plain substring tests and literal-prefixed patterns keep this cheap on big inputs
+_LUAU_HINTS = ('`', '+=', '-=', '*=', '/=', '%=', '^=', '->', '?', 'continue')
+_LUAU_HINT_PATTERNS = (
+    re.compile(r'type\s+[A-Za-z_]\w*\s*[=<]'),
+    re.compile(r'local\s+[A-Za-z_]\w*\s*:(?!:)'),
+)
+
+# Roblox API use is a good sign of Luau even when no Luau-only syntax appears
+_ROBLOX_MARKERS = (
+    'game:GetService', 'Instance.new', 'task.wait', 'task.spawn', 'task.delay', 'task.defer',
+    'script.Parent', 'workspace', 'Enum.',
+)
+
+
+# Token kinds, stored as their index in the kinds column of a TokenStore
+KINDS = ('keyword', 'name', 'number', 'string', 'long_string', 'interp', 'comment', 'op', 'bad')
+KEYWORD, NAME, NUMBER, STRING, LONG_STRING, INTERP, COMMENT, OP, BAD = range(len(KINDS))
+
+# Groups that need more than appending a token
+_LBRACE, _RBRACE, _BACKTICK = 253, 254, 255
+
+
+def _group_kinds(pattern: re.Pattern) -> List[int]:
+    """Kind of every group index of a token pattern, for Match.lastindex lookups"""
+    table = [BAD] * (pattern.groups + 1)
+    special = {'lbrace': _LBRACE, 'rbrace': _RBRACE, 'backtick': _BACKTICK}
+    for name, index in pattern.groupindex.items():
+        if name in special:
+            table[index] = special[name]
+        elif name in KINDS:
+            table[index] = KINDS.index(name)
+    return table
+
+
+_LUA_KINDS = _group_kinds(_LUA_TOKEN)
+_LUAU_KINDS = _group_kinds(_LUAU_TOKEN)
+
+
+class Token(NamedTuple):
+    kind: str       # one of KINDS
+    text: str
+    start: int
+    end: int
+
+
+class TokenStore:
+    """
+    Tokens of one source as parallel array columns over the source text.
+
+    `kinds` holds indexes into KINDS, `starts`/`ends` the offsets of each
+    token; `lines` (1-based) is computed on first use. A token costs 9 bytes
+    plus 4 for its line instead of a tuple, two ints and a str, so a
+    megabyte script does not leave millions of objects for the GC to walk.
+    Token objects are only built on indexing or iteration.
+    """
+
+    __slots__ = ('source', 'dialect', 'kinds', 'starts', 'ends', '_lines')
+
+    def __init__(self, source: str, dialect: str = LUA):
+        self.source = source
+        self.dialect = dialect
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self._lines: Optional[array] = None
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, i: int) -> Token:
+        start, end = self.starts[i], self.ends[i]
+        return Token(KINDS[self.kinds[i]], self.source[start:end], start, end)
+
+    def __iter__(self) -> Iterator[Token]:
+        source = self.source
+        for kind, start, end in zip(self.kinds, self.starts, self.ends):
+            yield Token(KINDS[kind], source[start:end], start, end)
+
+    def text(self, i: int) -> str:
+        return self.source[self.starts[i]:self.ends[i]]
+
+    @property
+    def lines(self) -> array:
+        if self._lines is None:
+            newlines = [m.start() for m in re.finditer('\n', self.source)]
+            self._lines = array('I', (bisect.bisect_left(newlines, start) + 1 for start in self.starts))
+        return self._lines
+
+    def index_at(self, offset: int) -> Optional[int]:
+        """Index of the token covering `offset`, None in whitespace"""
+        i = bisect.bisect_right(self.starts, offset) - 1
+        if i >= 0 and offset < self.ends[i]:
+            return i
+        return None
+
+    def _append(self, kind: int, start: int, end: int):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+
+def scan(source: str, dialect: str = LUA) -> TokenStore:
+    """
+    Split `source` into a TokenStore, whitespace excluded.
+
+    Every token is one regex match whose kind comes from the index of the
+    group that matched, so the Python side only appends three numbers per
+    token. The scan never fails: characters that start no token, including
+    the quote of an unterminated string, come out as 'bad' tokens. In the
+    Luau dialect an interpolated string is split like Luau does it, into
+    'interp' tokens for its literal parts ("`a {", "} b {", "}`") with the
+    tokens of the embedded expressions in between.
+    """
+    if dialect == LUAU:
+        pattern, group_kinds = _LUAU_TOKEN, _LUAU_KINDS
+    else:
+        pattern, group_kinds = _LUA_TOKEN, _LUA_KINDS
+    store = TokenStore(source, dialect)
+    append_kind, append_start, append_end = store.kinds.append, store.starts.append, store.ends.append
+
+    # Trailing whitespace would be retried at every offset by the \s* prefix
+    limit = len(source)
+    while limit and source[limit - 1].isspace():
+        limit -= 1
+
+    # Open braces inside each interpolation expression we are in
+    braces = []
+    pos = 0
+    while pos < limit:
+        resume = None
+        for match in pattern.finditer(source, pos, limit):
+            group = match.lastindex
+            kind = group_kinds[group]
+            start, end = match.span(group)
+            if kind >= _LBRACE:
+                if kind == _BACKTICK or (kind == _RBRACE and braces and braces[-1] == 0):
+                    resume = start
+                    break
+                if braces:
+                    braces[-1] += 1 if kind == _LBRACE else -1
+                kind = OP
+            append_kind(kind)
+            append_start(start)
+            append_end(end)
+        if resume is None:
+            break
+
+        # An interpolated string starts or continues after an expression
+        opening = source[resume] == '`'
+        segment = _INTERP_SEGMENT.match(source, resume + 1)
+        if segment is None:
+            store._append(BAD, resume, resume + 1)
+            if not opening:
+                braces.pop()
+            pos = resume + 1
+            continue
+        store._append(INTERP, resume, segment.end())
+        if opening and segment.group(1) == '{':
+            braces.append(0)
+        elif not opening and segment.group(1) == '`':
+            braces.pop()
+        pos = segment.end()
+    return store
+
+
+def tokenize(source: str, dialect: str = LUA) -> List[Token]:
+    """The tokens of `source` as Token objects, see scan()"""
+    return list(scan(source, dialect))
+
+
+def detect_dialect(source: str) -> str:
+    """
+    Luau when the script uses Luau-only syntax (compound assignment,
+    interpolated strings, type annotations, `continue`) or the Roblox API.
+    Luau syntax is a superset of Lua 5.1, so a wrong guess towards Luau
+    costs little.
+    """
+    if any(marker in source for marker in _ROBLOX_MARKERS):
+        return LUAU
+    if not any(hint in source for hint in _LUAU_HINTS) and \
+            not any(pattern.search(source) for pattern in _LUAU_HINT_PATTERNS):
+        return LUA
+    store = lexed_for(source, LUAU).store
+    kinds, text = store.kinds, store.text
+    # Indexes of the code tokens, comments left out
+    code = [i for i, kind in enumerate(kinds) if kind != COMMENT]
+    for n, i in enumerate(code):
+        kind = kinds[i]
+        if kind == INTERP or (kind == OP and text(i) in LUAU_OPERATORS):
+            return LUAU
+        if kind != NAME or n + 1 >= len(code):
+            continue
+        name = text(i)
+        following = code[n + 1]
+        previous = text(code[n - 1]) if n else None
+        # local x: number
+        if text(following) == ':' and previous in ('local', ','):
+            return LUAU
+        # type Name = ... / export type Name<T> = ...
+        if name == 'type' and kinds[following] == NAME and n + 2 < len(code) \
+                and text(code[n + 2]) in ('=', '<'):
+            return LUAU
+        # continue as a statement of its own
+        if name == 'continue' and (kinds[following] == KEYWORD or text(following) == ';'):
+            return LUAU
+    return LUA
+
+
+class LexedSource:
+    """
+    Tokens of one source plus lookups the passes need.
+
+    Scanning is done on first use of `store`; `in_code()` only needs the
+    string and comment spans, which are much cheaper to find.
+    """
+
+    def __init__(self, source: str, dialect: str = LUA):
+        self.source = source
+        self.dialect = dialect
+        self._store: Optional[TokenStore] = None
+        self._opaque: Optional[Tuple[List[int], List[int]]] = None
+
+    @property
+    def store(self) -> TokenStore:
+        if self._store is None:
+            self._store = scan(self.source, self.dialect)
+        return self._store
+
+    def in_code(self, offset: int) -> bool:
+        """Whether `offset` is outside of string literals and comments"""
+        if self._opaque is None:
+            pattern = _LUAU_OPAQUE if self.dialect == LUAU else _LUA_OPAQUE
+            starts, ends = [], []
+            for match in pattern.finditer(self.source):
+                starts.append(match.start())
+                ends.append(match.end())
+            self._opaque = (starts, ends)
+        starts, ends = self._opaque
+        i = bisect.bisect_right(starts, offset) - 1
+        return i < 0 or offset >= ends[i]
+
+
+_last: Optional[LexedSource] = None
+
+
+def lexed_for(source: str, dialect: str = LUA) -> LexedSource:
+    """Shared LexedSource of `source`, so passes on the same layer lex it once"""
+    global _last
+    if _last is None or _last.source is not source or _last.dialect != dialect:
+        _last = LexedSource(source, dialect)
+    return _last
+
+
+def forget_lexed():
+    """Drop the shared LexedSource, so the last source and its tokens do not outlive a job"""
+    global _last
+    _last = None
+
+
+# Tokens after which `if` starts a Luau if-expression rather than a statement
+_EXPRESSION_KEYWORDS = {'return', 'and', 'or', 'not', 'in'}
+_STATEMENT_END_OPS = {')', ']', '}', ';'}
+
+_KEYWORD_KIND = re.compile(bytes([KEYWORD]))
+
+
+class Block:
+    """
+    One block of a script, a node of the BlockStructure tree.
+
+    `kind` is the keyword that opened it ('function', 'do', 'repeat',
+    'then', 'else') or 'chunk' for the whole script. `open` and `close` are
+    token indexes of the opening keyword and of the keyword that ended the
+    block (`end`, `until`, `else`, `elseif`); the chunk opens at -1 and an
+    unclosed block closes at the token count.
+    """
+
+    __slots__ = ('kind', 'open', 'close', 'parent', 'children')
+
+    def __init__(self, kind: str, open: int, parent: Optional['Block'] = None):
+        self.kind = kind
+        self.open = open
+        self.close = -1
+        self.parent = parent
+        self.children: List['Block'] = []
+        if parent is not None:
+            parent.children.append(self)
+
+    def __repr__(self) -> str:
+        return f'Block({self.kind}, {self.open}..{self.close})'
+
+
+class BlockStructure:
+    """
+    Block nesting of a TokenStore.
+
+    `depths` holds the depth of every token, the indentation a line starting
+    with it gets; block closers (`end`, `until`, `else`, `elseif`) already
+    count as dedented. `unclosed` is the number of blocks still open at the
+    end and `stray` the number of closers without a block. `root` is the
+    tree of Block nodes.
+
+    Blocks open with `function`, `do`, `repeat` and `then`, so `while`/`for`
+    headers and `if` conditions stay at the outer depth. `else` closes the
+    `then` block and opens its own at the same depth. In Luau, `if` in
+    expression position (`local x = if a then b else c`) opens no block and
+    its `then`/`else` are skipped.
+    """
+
+    def __init__(self, store: TokenStore):
+        kinds, starts, ends, source = store.kinds, store.starts, store.ends, store.source
+        luau = store.dialect == LUAU
+        self.depths = depths = array('I')
+        self.stray = 0
+        self.root = Block('chunk', -1)
+        depth = 0
+        block = self.root
+        # Open blocks as Block nodes, and for an if-expression 'if' (before
+        # then) / 'then' (before else)
+        stack = []
+        # Last keyword that continued an if-expression
+        expression_keyword = -1
+
+        # Only keywords change the depth: they are found in the kinds column
+        # at C speed and every token in between gets the current depth
+        for match in _KEYWORD_KIND.finditer(kinds.tobytes()):
+            i = match.start()
+            depths.extend(repeat(depth, i - len(depths)))
+            token_depth = depth
+            text = source[starts[i]:ends[i]]
+            if text in ('function', 'do', 'repeat'):
+                block = Block(text, i, block)
+                stack.append(block)
+                depth += 1
+            elif text == 'if':
+                if luau and _starts_expression(store, i, expression_keyword):
+                    stack.append('if')
+            elif text == 'then':
+                if stack and stack[-1] == 'if':
+                    stack[-1] = 'then'
+                    expression_keyword = i
+                else:
+                    block = Block(text, i, block)
+                    stack.append(block)
+                    depth += 1
+            elif text in ('else', 'elseif'):
+                if stack and stack[-1] == 'then':
+                    if text == 'else':
+                        stack.pop()
+                    else:
+                        stack[-1] = 'if'
+                    expression_keyword = i
+                else:
+                    token_depth = max(depth - 1, 0)
+                    if stack and not isinstance(stack[-1], str):
+                        block.close = i
+                        block = block.parent
+                        stack.pop()
+                        if text == 'else':
+                            block = Block(text, i, block)
+                            stack.append(block)
+                        else:
+                            depth -= 1
+            elif text in ('end', 'until'):
+                # Drop if-expressions left open by malformed input
+                while stack and isinstance(stack[-1], str):
+                    stack.pop()
+                if stack:
+                    block.close = i
+                    block = block.parent
+                    stack.pop()
+                    depth -= 1
+                else:
+                    self.stray += 1
+                token_depth = depth
+            depths.append(token_depth)
+        depths.extend(repeat(depth, len(kinds) - len(depths)))
+        self.unclosed = depth
+
+        # Blocks left open end with the script
+        while block is not None:
+            block.close = len(kinds)
+            block = block.parent
+
+
+def _starts_expression(store: TokenStore, i: int, expression_keyword: int) -> bool:
+    """Whether the `if` at token `i` is in expression position"""
+    previous = i - 1
+    while previous >= 0 and store.kinds[previous] == COMMENT:
+        previous -= 1
+    if previous < 0:
+        return False
+    if previous == expression_keyword:
+        return True
+    kind = store.kinds[previous]
+    if kind == OP:
+        return store.text(previous) not in _STATEMENT_END_OPS
+    if kind == INTERP:
+        # `{` of an interpolation
+        return store.text(previous).endswith('{')
+    return kind == KEYWORD and store.text(previous) in _EXPRESSION_KEYWORDS
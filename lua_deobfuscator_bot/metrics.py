@@ -0,0 +1,274 @@
+"""
+Metrics and Job Telemetry
+Prometheus text-format metrics served over aiohttp, plus structured JSON job logs
+"""
+
+import json
+import bisect
+import asyncio
+import logging
+import threading
+from typing import Dict, Tuple, List, Optional, Callable, Awaitable, Sequence
+
+from aiohttp import web
+
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """Base class of a metric family with an optional fixed set of label names"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} expects labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _format_labels(self, values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labels, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = (
+            k + '="' + v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for k, v in pairs
+        )
+        return '{' + ','.join(escaped) + '}'
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f'# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n'
+        return header + ''.join(line + '\n' for line in self.samples())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels):
+        """Mirror a running total that is counted elsewhere, e.g. AIClient.stats"""
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = float(value)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self.values.items())
+        return [f'{self.name}{self._format_labels(k)} {v}' for k, v in items]
+
+
+class Gauge(Metric):
+    """Gauge that is either set directly or read from a callback at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            try:
+                return [f'{self.name} {float(self.callback())}']
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self.values.items())
+        return [f'{self.name}{self._format_labels(k)} {v}' for k, v in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets)
+        # label values -> (bucket counts, sum, count)
+        self.values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self.values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{self._format_labels(key, ("le", repr(float(bound))))} {cumulative}')
+            lines.append(f'{self.name}_bucket{self._format_labels(key, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return ''.join(metric.render() for metric in self.metrics.values())
+
+
+REGISTRY = Registry()
+
+_SIZE_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864]
+_LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+JOBS = REGISTRY.register(Counter(
+    'deobf_jobs_total', 'Finished jobs by kind, detected obfuscator and outcome',
+    labels=('kind', 'obfuscator', 'status')
+))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    'deobf_job_duration_seconds', 'Time from submitting a job to receiving its result',
+    _LATENCY_BUCKETS, labels=('kind',)
+))
+PASS_SECONDS = REGISTRY.register(Histogram(
+    'deobf_pass_duration_seconds', 'Time spent in each deobfuscation pass',
+    _LATENCY_BUCKETS, labels=('pass',)
+))
+INPUT_BYTES = REGISTRY.register(Histogram(
+    'deobf_input_bytes', 'Size of scripts submitted for processing',
+    _SIZE_BUCKETS, labels=('kind',)
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'deobf_cache_requests_total', 'Cache lookups by cache and result',
+    labels=('cache', 'result')
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'deobf_queue_depth', 'Jobs waiting to be claimed by a worker'
+))
+LOOP_LAG = REGISTRY.register(Gauge(
+    'deobf_event_loop_lag_seconds', 'Most recent delay of a scheduled event loop wakeup'
+))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    'deobf_event_loop_lag_distribution_seconds', 'Distribution of event loop wakeup delays',
+    [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5]
+))
+WORKER_UTILIZATION = REGISTRY.register(Gauge(
+    'deobf_worker_utilization', 'Fraction of local worker slots running a job'
+))
+
+
+def observe_pass_timings(timings: Dict[str, float]):
+    for name, seconds in timings.items():
+        PASS_SECONDS.observe(seconds, **{'pass': name})
+
+
+def record_loop_lag(lag: float):
+    LOOP_LAG.set(lag)
+    LOOP_LAG_SECONDS.observe(lag)
+
+
+async def sample_loop_lag(interval: float = 0.5):
+    """Measure how late the event loop wakes up from a fixed sleep, forever"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        record_loop_lag(max(0.0, loop.time() - start - interval))
+
+
+async def start_metrics_server(
+    host: str,
+    port: int,
+    refresh: Optional[Callable[[], Awaitable[None]]] = None,
+    registry: Registry = REGISTRY,
+) -> web.AppRunner:
+    """
+    Serve GET /metrics in Prometheus text format on the running loop.
+
+    `refresh` runs before every scrape to update gauges that need an await,
+    such as the queue depth.
+    """
+    async def handle_metrics(request: web.Request) -> web.Response:
+        if refresh is not None:
+            await refresh()
+        return web.Response(
+            text=registry.render(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with the record's `fields` merged in"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+job_logger = logging.getLogger('lua_deobfuscator.jobs')
+
+
+def setup_job_logging(stream=None):
+    """Write job logs as JSON lines to `stream` (stderr by default), once per process"""
+    if job_logger.handlers:
+        return
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JSONFormatter())
+    job_logger.addHandler(handler)
+    job_logger.setLevel(logging.INFO)
+    job_logger.propagate = False
+
+
+def log_job(event: str, level: int = logging.INFO, exc_info=None, **fields):
+    """Write a structured job log line carrying the same fields as the metrics"""
+    job_logger.log(level, event, extra={'fields': fields}, exc_info=exc_info)
+
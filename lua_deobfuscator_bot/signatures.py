@@ -0,0 +1,648 @@
+"""
+Runtime Signature Database
+Recognizes the VM interpreters and runtime prologues that obfuscators prepend to scripts
+"""
+
+import json
+from array import array
+from collections import deque
+from typing import List, Dict, Tuple, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from source_edits import SourceDocument
+from lua_syntax import (
+    TokenStore, scan, lexed_for, detect_dialect, KEYWORD, NAME, NUMBER, STRING, LONG_STRING, INTERP,
+    COMMENT, OP, BAD,
+)
+
+
+# Tokens are normalized so renamed identifiers, different literals and
+# reformatting do not change the fingerprints
+KGRAM = 10
+WINDOW = 6
+
+# Keywords and library names survive normalization, every other identifier becomes 'v'
+_KEPT_NAMES = {
+    'and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for', 'function', 'goto', 'if',
+    'in', 'local', 'nil', 'not', 'or', 'repeat', 'return', 'then', 'true', 'until', 'while',
+    'string', 'table', 'math', 'bit', 'bit32', 'coroutine', 'debug', 'os',
+    'byte', 'char', 'sub', 'gsub', 'rep', 'len', 'concat', 'insert', 'unpack', 'floor',
+    'ldexp', 'select', 'setmetatable', 'getmetatable', 'getfenv', 'setfenv', 'tonumber',
+    'tostring', 'type', 'pcall', 'error', 'rawget', 'rawset', 'next', 'pairs', 'ipairs',
+    'loadstring', 'load', 'bxor', 'band', 'bor', 'bnot', 'lshift', 'rshift', '_ENV', '_G',
+}
+
+# Token ids are a polynomial hash of the normalized token text. The kept names
+# are the longest texts that keep their identity (keywords and operators are
+# shorter), so only their first _MAX_TEXT characters ever need hashing
+_TEXT_BASE = 0x100000001B3
+_KGRAM_BASE = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+_MAX_TEXT = max(map(len, _KEPT_NAMES))
+
+
+def _text_id(text: str) -> int:
+    value = 0
+    for i, char in enumerate(text):
+        value = (value + ord(char) * pow(_TEXT_BASE, i, 1 << 64)) & _MASK64
+    return value
+
+
+_NAME_ID = _text_id('v')
+# Literals only count by kind
+_KIND_IDS = {
+    NUMBER: _text_id('n'), STRING: _text_id('s'), LONG_STRING: _text_id('s'), INTERP: _text_id('s'),
+}
+_KEPT_IDS = None if np is None else np.array(sorted(map(_text_id, _KEPT_NAMES)), dtype=np.uint64)
+
+
+def normalize_tokens(store: TokenStore):
+    """
+    Normalized token ids of a TokenStore, comments left out, with the
+    (start, end) offsets of each token as two parallel columns.
+
+    Identifiers outside _KEPT_NAMES all get the id of 'v', numbers 'n' and
+    strings 's', every other token the id of its text.
+    """
+    if np is not None:
+        return _normalize_columns(store)
+    source = store.source
+    ids, starts, ends = array('Q'), array('I'), array('I')
+    cache = {}
+    for kind, start, end in zip(store.kinds, store.starts, store.ends):
+        if kind == COMMENT:
+            continue
+        token_id = _KIND_IDS.get(kind)
+        if token_id is None:
+            text = source[start:end]
+            token_id = cache.get(text)
+            if token_id is None:
+                kept = kind != NAME or text in _KEPT_NAMES
+                token_id = cache[text] = _text_id(text) if kept else _NAME_ID
+        ids.append(token_id)
+        starts.append(start)
+        ends.append(end)
+    return ids, starts, ends
+
+
+def _normalize_columns(store: TokenStore):
+    """normalize_tokens() with numpy, the text hash is built one character column at a time"""
+    kinds = np.frombuffer(store.kinds, dtype=np.uint8)
+    code = kinds != COMMENT
+    kinds = kinds[code]
+    starts = np.frombuffer(store.starts, dtype=np.uint32)[code]
+    ends = np.frombuffer(store.ends, dtype=np.uint32)[code]
+    ids = np.full(len(kinds), _NAME_ID, dtype=np.uint64)
+    for kind, token_id in _KIND_IDS.items():
+        ids[kinds == kind] = token_id
+    if not len(kinds):
+        return ids, starts, ends
+
+    source = store.source
+    if source.isascii():
+        chars = np.frombuffer(source.encode('ascii'), dtype=np.uint8)
+    else:
+        chars = np.frombuffer(source.encode('utf-32-le'), dtype=np.uint32)
+    lengths = ends - starts
+    texts = np.isin(kinds, (NAME, KEYWORD, OP, BAD)) & (lengths <= _MAX_TEXT)
+    index = np.flatnonzero(texts)
+    hashed = np.zeros(len(index), dtype=np.uint64)
+    # Columns shrink to the tokens that still have a character at offset i
+    rows = np.arange(len(index))
+    for i in range(_MAX_TEXT):
+        if i:
+            rows = rows[lengths[index[rows]] > i]
+        if not len(rows):
+            break
+        column = chars[starts[index[rows]] + i].astype(np.uint64)
+        hashed[rows] += column * np.uint64(pow(_TEXT_BASE, i, 1 << 64))
+
+    names = kinds[index] == NAME
+    hashed[names & ~np.isin(hashed, _KEPT_IDS)] = _NAME_ID
+    ids[index] = hashed
+    return ids, starts, ends
+
+
+def fingerprints(ids) -> List[Tuple[int, int]]:
+    """
+    Winnow the k-gram hashes of a normalized token stream.
+
+    Returns (hash, token_index) pairs; every run of WINDOW consecutive k-grams
+    contributes its minimum hash, so any shared run of KGRAM + WINDOW - 1
+    tokens is guaranteed to produce a shared fingerprint. A k-gram hash is
+    the top 32 bits of a polynomial hash of its token ids, rolled over the
+    stream instead of hashing every k-gram from scratch.
+    """
+    if len(ids) < KGRAM:
+        return []
+    if np is not None:
+        return _fingerprint_columns(np.asarray(ids, dtype=np.uint64))
+
+    top = pow(_KGRAM_BASE, KGRAM - 1, 1 << 64)
+    value = 0
+    for token_id in ids[:KGRAM]:
+        value = (value * _KGRAM_BASE + token_id) & _MASK64
+    hashes = [value >> 32]
+    for old, new in zip(ids, ids[KGRAM:]):
+        value = ((value - old * top) * _KGRAM_BASE + new) & _MASK64
+        hashes.append(value >> 32)
+
+    # Sliding window minimum: the deque holds the positions whose hash is
+    # smaller than every later one in the window, so its head is the rightmost
+    # minimum, as in the original winnowing paper
+    selected = []
+    window = deque()
+    for pos, value in enumerate(hashes):
+        while window and hashes[window[-1]] >= value:
+            window.pop()
+        window.append(pos)
+        first = pos - WINDOW + 1
+        if window[0] < first:
+            window.popleft()
+        if first >= 0 or pos == len(hashes) - 1:
+            if not selected or selected[-1][1] != window[0]:
+                selected.append((hashes[window[0]], window[0]))
+    return selected
+
+
+def _fingerprint_columns(ids) -> List[Tuple[int, int]]:
+    """fingerprints() with numpy"""
+    count = len(ids) - KGRAM + 1
+    value = np.zeros(count, dtype=np.uint64)
+    for i in range(KGRAM):
+        value = value * np.uint64(_KGRAM_BASE) + ids[i:i + count]
+    hashes = value >> np.uint64(32)
+
+    if count <= WINDOW:
+        positions = np.array([count - 1 - int(hashes[::-1].argmin())])
+    else:
+        windows = np.lib.stride_tricks.sliding_window_view(hashes, WINDOW)
+        # Rightmost minimum of every window
+        positions = np.arange(len(windows)) + (WINDOW - 1 - windows[:, ::-1].argmin(axis=1))
+        positions = positions[np.concatenate(([True], positions[1:] != positions[:-1]))]
+    return list(zip(hashes[positions].tolist(), positions.tolist()))
+
+
+class RuntimeSignature:
+    """Fingerprint set of one known runtime fragment"""
+
+    __slots__ = ('name', 'obfuscator', 'hashes')
+
+    def __init__(self, name: str, obfuscator: str, hashes):
+        self.name = name
+        self.obfuscator = obfuscator
+        self.hashes = frozenset(hashes)
+
+    @classmethod
+    def from_code(cls, name: str, obfuscator: str, code: str) -> 'RuntimeSignature':
+        # Scanned on its own, the shared lexed source belongs to the input
+        ids, _, _ = normalize_tokens(scan(code))
+        return cls(name, obfuscator, (h for h, _ in fingerprints(ids)))
+
+
+class RuntimeMatch:
+    """A region of the input recognized as runtime boilerplate, best matching signature first"""
+
+    __slots__ = ('signatures', 'start', 'end', 'score')
+
+    def __init__(self, signature: RuntimeSignature, start: int, end: int, score: float):
+        self.signatures = [signature]
+        self.start = start
+        self.end = end
+        self.score = score
+
+    @property
+    def signature(self) -> RuntimeSignature:
+        return self.signatures[0]
+
+    def stub(self) -> str:
+        names = ', '.join(s.name for s in self.signatures)
+        return (
+            f'--[[ {self.signature.obfuscator} runtime: {names} '
+            f'({self.end - self.start:,} bytes skipped) ]]'
+        )
+
+
+class SignatureDatabase:
+    """
+    Inverted index from fingerprint hash to the signatures that contain it.
+
+    match() fingerprints the input once, looks every fingerprint up in the index
+    and reports clusters of hits that cover enough of a signature.
+    """
+
+    _default: Optional['SignatureDatabase'] = None
+
+    def __init__(self, min_containment: float = 0.6, max_gap: int = 400):
+        self.min_containment = min_containment
+        # Tokens allowed between two hits of the same cluster
+        self.max_gap = max_gap
+        self.signatures: List[RuntimeSignature] = []
+        self.index: Dict[int, List[int]] = {}
+
+    @classmethod
+    def default(cls) -> 'SignatureDatabase':
+        """Database of the built-in signatures, built on first use"""
+        if cls._default is None:
+            db = cls()
+            for name, obfuscator, code in RUNTIME_FRAGMENTS:
+                db.add(RuntimeSignature.from_code(name, obfuscator, code))
+            cls._default = db
+        return cls._default
+
+    def add(self, signature: RuntimeSignature):
+        if not signature.hashes:
+            return
+        sig_id = len(self.signatures)
+        self.signatures.append(signature)
+        for h in signature.hashes:
+            self.index.setdefault(h, []).append(sig_id)
+
+    def add_code(self, name: str, obfuscator: str, code: str):
+        """Learn a new runtime fragment from a sample"""
+        self.add(RuntimeSignature.from_code(name, obfuscator, code))
+
+    def save(self, path: str):
+        data = [
+            {'name': s.name, 'obfuscator': s.obfuscator, 'hashes': sorted(s.hashes)}
+            for s in self.signatures
+        ]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+    def load(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            for entry in json.load(f):
+                self.add(RuntimeSignature(entry['name'], entry['obfuscator'], entry['hashes']))
+
+    def match(self, code: str, dialect: Optional[str] = None) -> List[RuntimeMatch]:
+        """
+        Find runtime regions in `code`, sorted by offset and never overlapping.
+        The tokens come from the shared lexed source, so the passes that run
+        next on the same layer do not scan it again.
+        """
+        ids, starts, ends = normalize_tokens(lexed_for(code, dialect or detect_dialect(code)).store)
+        hits: Dict[int, List[Tuple[int, int]]] = {}
+        for h, pos in fingerprints(ids):
+            for sig_id in self.index.get(h, ()):
+                hits.setdefault(sig_id, []).append((pos, h))
+
+        candidates = []
+        for sig_id, sig_hits in hits.items():
+            signature = self.signatures[sig_id]
+            for cluster in self._clusters(sig_hits):
+                matched = {h for _, h in cluster}
+                score = len(matched) / len(signature.hashes)
+                if score < self.min_containment:
+                    continue
+                first = cluster[0][0]
+                last = min(cluster[-1][0] + KGRAM - 1, len(ids) - 1)
+                start, end = _expand_to_lines(code, int(starts[first]), int(ends[last]))
+                candidates.append(RuntimeMatch(signature, start, end, score))
+
+        # Runtime fragments usually sit next to each other, overlapping regions are merged
+        candidates.sort(key=lambda m: m.start)
+        merged: List[RuntimeMatch] = []
+        for m in candidates:
+            if merged and m.start < merged[-1].end:
+                last = merged[-1]
+                last.end = max(last.end, m.end)
+                if m.score > last.score:
+                    last.signatures.insert(0, m.signature)
+                    last.score = m.score
+                else:
+                    last.signatures.append(m.signature)
+            else:
+                merged.append(m)
+
+        return merged
+
+    def _clusters(self, hits: List[Tuple[int, int]]):
+        hits.sort()
+        cluster = [hits[0]]
+        for hit in hits[1:]:
+            if hit[0] - cluster[-1][0] > self.max_gap:
+                yield cluster
+                cluster = []
+            cluster.append(hit)
+        yield cluster
+
+
+def skip_runtime(doc: SourceDocument, db: Optional[SignatureDatabase] = None,
+                 dialect: Optional[str] = None) -> List[RuntimeMatch]:
+    """Replace every recognized runtime region of `doc` with a stub comment"""
+    db = db or SignatureDatabase.default()
+    matches = db.match(doc.source, dialect)
+    doc.add_edits((m.start, m.end, m.stub()) for m in matches)
+    return matches
+
+
+def _expand_to_lines(code: str, start: int, end: int, slack: int = 120) -> Tuple[int, int]:
+    """
+    Grow a region to whole lines.
+
+    The first and last fingerprint rarely sit on the exact edges of a runtime
+    fragment, so short leftovers on the edge lines are taken in as well. Long
+    leftovers (minified code on one line) are kept out.
+    """
+    line_start = code.rfind('\n', 0, start) + 1
+    if start - line_start > slack:
+        line_start = start
+    line_end = code.find('\n', end)
+    line_end = len(code) if line_end == -1 else line_end
+    if line_end - end > slack:
+        line_end = end
+    return line_start, line_end
+
+
+# Reference fragments of obfuscator runtimes. They follow the structure of the
+# public runtimes (identifier names, literals and layout do not matter after
+# normalization); add fingerprints of real samples with add_code() or load().
+RUNTIME_FRAGMENTS = [
+    ('bytecode deserializer', 'IronBrew/IB2', '''
+local function gBit(Bit, Start, End)
+    if End then
+        local Res = (Bit / 2 ^ (Start - 1)) % 2 ^ ((End - 1) - (Start - 1) + 1);
+        return Res - Res % 1;
+    else
+        local Plc = 2 ^ (Start - 1);
+        return (Bit % (Plc + Plc) >= Plc) and 1 or 0;
+    end;
+end;
+local function gBits8()
+    local a = Byte(ByteString, Pos, Pos);
+    Pos = Pos + 1;
+    return a;
+end;
+local function gBits16()
+    local a, b = Byte(ByteString, Pos, Pos + 2);
+    Pos = Pos + 2;
+    return (b * 256) + a;
+end;
+local function gBits32()
+    local a, b, c, d = Byte(ByteString, Pos, Pos + 3);
+    Pos = Pos + 4;
+    return (d * 16777216) + (c * 65536) + (b * 256) + a;
+end;
+local function gFloat()
+    local Left = gBits32();
+    local Right = gBits32();
+    local IsNormal = 1;
+    local Mantissa = (gBit(Right, 1, 20) * (2 ^ 32)) + Left;
+    local Exponent = gBit(Right, 21, 31);
+    local Sign = ((-1) ^ gBit(Right, 32));
+    if (Exponent == 0) then
+        if (Mantissa == 0) then
+            return Sign * 0;
+        else
+            Exponent = 1;
+            IsNormal = 0;
+        end;
+    elseif (Exponent == 2047) then
+        return (Mantissa == 0) and (Sign * (1 / 0)) or (Sign * (0 / 0));
+    end;
+    return LDExp(Sign, Exponent - 1023) * (IsNormal + (Mantissa / (2 ^ 52)));
+end;
+local function gString(Len)
+    local Str;
+    if (not Len) then
+        Len = gBits32();
+        if (Len == 0) then
+            return '';
+        end;
+    end;
+    Str = Sub(ByteString, Pos, Pos + Len - 1);
+    Pos = Pos + Len;
+    local FStr = {}
+    for Idx = 1, #Str do
+        FStr[Idx] = Char(Byte(Sub(Str, Idx, Idx)))
+    end
+    return Concat(FStr);
+end;
+'''),
+    ('chunk decoder', 'IronBrew/IB2', '''
+local function Deserialize()
+    local Instrs = {};
+    local Functions = {};
+    local Lines = {};
+    local Chunk = {Instrs, Functions, nil, Lines};
+    local ConstCount = gBits32()
+    local Consts = {}
+    for Idx = 1, ConstCount do
+        local Type = gBits8();
+        local Cons;
+        if (Type == 1) then
+            Cons = (gBits8() ~= 0);
+        elseif (Type == 2) then
+            Cons = gFloat();
+        elseif (Type == 3) then
+            Cons = gString();
+        end;
+        Consts[Idx] = Cons;
+    end;
+    Chunk[3] = gBits8();
+    for Idx = 1, gBits32() do
+        local Descriptor = gBits8();
+        if (gBit(Descriptor, 1, 1) == 0) then
+            local Type = gBit(Descriptor, 2, 3);
+            local Mask = gBit(Descriptor, 4, 6);
+            local Inst = {gBits16(), gBits16(), nil, nil};
+            if (Type == 0) then
+                Inst[3] = gBits16();
+                Inst[4] = gBits16();
+            elseif (Type == 1) then
+                Inst[3] = gBits32();
+            elseif (Type == 2) then
+                Inst[3] = gBits32() - (2 ^ 16)
+            elseif (Type == 3) then
+                Inst[3] = gBits32() - (2 ^ 16)
+                Inst[4] = gBits16();
+            end;
+            if (gBit(Mask, 1, 1) == 1) then Inst[2] = Consts[Inst[2]] end
+            if (gBit(Mask, 2, 2) == 1) then Inst[3] = Consts[Inst[3]] end
+            if (gBit(Mask, 3, 3) == 1) then Inst[4] = Consts[Inst[4]] end
+            Instrs[Idx] = Inst;
+        end
+    end;
+    for Idx = 1, gBits32() do Functions[Idx - 1] = Deserialize(); end;
+    return Chunk;
+end;
+'''),
+    ('string decryption prologue', 'WeAreDevs/Prometheus', '''
+local StrToNumber = tonumber;
+local Byte = string.byte;
+local Char = string.char;
+local Sub = string.sub;
+local Subg = string.gsub;
+local Rep = string.rep;
+local Concat = table.concat;
+local Insert = table.insert;
+local LDExp = math.ldexp;
+local GetFEnv = getfenv or function()
+    return _ENV;
+end;
+local Setmetatable = setmetatable;
+local PCall = pcall;
+local Select = select;
+local Unpack = unpack or table.unpack;
+local ToNumber = tonumber;
+local function VMCall(ByteString, vmenv, ...)
+    local DIP = 1;
+    local repeatNext;
+    ByteString = Subg(Sub(ByteString, 5), "..", function(byte)
+        if (Byte(byte, 2) == 81) then
+            repeatNext = StrToNumber(Sub(byte, 1, 1));
+            return "";
+        else
+            local a = Char(StrToNumber(byte, 16));
+            if repeatNext then
+                local b = Rep(a, repeatNext);
+                repeatNext = nil;
+                return b;
+            else
+                return a;
+            end
+        end
+    end);
+'''),
+    ('string table decoder', 'WeAreDevs/Prometheus', '''
+do
+    local v = string.char;
+    local v = string.byte;
+    local v = string.sub;
+    local v = table.concat;
+    local v = {};
+    local v = {};
+    for v = 0, 255 do
+        local v = v(v);
+        v[v] = v;
+        v[v] = v;
+    end
+    local function v(v)
+        local v = {};
+        for v = 1, #v, 4 do
+            local v, v, v, v = v(v, v, v + 3);
+            v[#v + 1] = v(v(v[v] * 262144 + v[v] * 4096 + v[v] * 64 + v[v], 16) % 256);
+        end
+        return v(v);
+    end
+    for v = 1, #v do
+        v[v] = v(v[v]);
+    end
+end
+'''),
+    ('vararg VM wrapper', 'PSU', '''
+local function Wrap(Chunk, Upvalues, Env)
+    local Instr = Chunk[1];
+    local Proto = Chunk[2];
+    local Params = Chunk[3];
+    return function(...)
+        local Instr = Instr;
+        local Proto = Proto;
+        local Params = Params;
+        local _R = _R;
+        local VIP = 1;
+        local Top = -1;
+        local Vararg = {};
+        local Args = {...};
+        local PCount = select('#', ...) - 1;
+        local Lupvals = {};
+        local Stk = {};
+        for Idx = 0, PCount do
+            if (Idx >= Params) then
+                Vararg[Idx - Params] = Args[Idx + 1];
+            else
+                Stk[Idx] = Args[Idx + 1];
+            end;
+        end;
+        local Varargsz = PCount - Params + 1
+        local Inst;
+        local Enum;
+        while true do
+            Inst = Instr[VIP];
+            Enum = Inst[1];
+'''),
+    ('bytecode reader', 'Moonsec v3', '''
+local v = string.byte;
+local v = string.char;
+local v = string.sub;
+local v = table.concat;
+local v = math.ldexp;
+local v = getfenv or function() return _ENV end;
+local v = setmetatable;
+local v = select;
+local v = unpack or table.unpack;
+local v = tonumber;
+local function v(v)
+    local v, v, v = "", "", {}
+    local v = 256;
+    local v = {}
+    for v = 0, v - 1 do
+        v[v] = v(v)
+    end
+    local v = 1;
+    local function v()
+        local v = v(v, v, v, 36)
+        v = v + 1
+        local v = v(v(v, v, v + v - 1), 36)
+        v = v + v
+        return v
+    end
+    v = v(v())
+    v[1] = v
+    while v < #v do
+        local v = v()
+        if v[v] then
+            v = v[v]
+        else
+            v = v .. v(v, 1, 1)
+        end
+        v[v] = v .. v(v, 1, 1)
+        v[#v + 1], v, v = v, v, v + 1
+    end
+    return table.concat(v)
+end
+'''),
+    ('VM dispatcher', 'Luraph', '''
+return (function(v, v, v, v, v, v, v, v, v, v, v, v, v, v, v, v, v)
+    local v = 1;
+    local v = {};
+    local v = v;
+    local v = bit32 or bit;
+    local v = v.bxor;
+    local v = v.band;
+    local v = v.rshift;
+    local v = v.lshift;
+    local function v(v, v)
+        local v = "";
+        for v = 1, #v do
+            v = v .. string.char(v(string.byte(v, v), string.byte(v, (v - 1) % #v + 1)));
+        end
+        return v;
+    end
+    local function v()
+        local v, v, v, v = string.byte(v, v, v + 3);
+        v = v + 4;
+        return v(v(v, 24), v(v, 16), v(v, 8), v);
+    end
+    local function v()
+        local v = string.byte(v, v);
+        v = v + 1;
+        return v;
+    end
+    while true do
+        local v = v();
+        if v == 0 then
+            break
+        elseif v == 1 then
+            v[#v + 1] = v();
+        elseif v == 2 then
+            v[#v + 1] = v(v());
+        end
+    end
+'''),
+]
@@ -0,0 +1,186 @@
+"""
+Span-based Source Editing
+Piece-table document that deobfuscation passes record their edits against
+"""
+
+import re
+import bisect
+from typing import List, Tuple, Optional, Callable, Iterable
+
+
+class SourceDocument:
+    """
+    Immutable source plus a sorted log of non-overlapping (start, end, replacement) edits.
+
+    Passes record edits against offsets in `source` instead of rebuilding the whole
+    string, and the edits are only materialized once by text() or write_to().
+    When a later pass has to see the result of earlier ones, commit() starts a new
+    layer on top of the rendered text. Every layer keeps its piece table, so any
+    output offset can be traced back to the original input with original_offset().
+
+    The source may be str, bytes or any sliceable buffer such as an mmap.
+    """
+
+    def __init__(self, source, parent: Optional['SourceDocument'] = None):
+        self.source = source
+        self.parent = parent
+        self.edits: List[Tuple[int, int, object]] = []
+        self._text = None
+        self._segments = None
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.edits)
+
+    def add_edits(self, new_edits: Iterable[Tuple[int, int, object]]) -> int:
+        """
+        Merge the edits of one pass into the log.
+
+        Edits already in the log win over new ones that overlap them, and inside
+        one pass the edit that starts first wins. Edits that would not change the
+        text are dropped. Returns the number of edits accepted.
+        """
+        incoming = sorted(
+            (e for e in new_edits if self.source[e[0]:e[1]] != e[2]),
+            key=lambda e: e[0]
+        )
+        if not incoming:
+            return 0
+
+        existing = self.edits
+        merged = []
+        accepted = 0
+        last_end = 0
+        i = 0
+        for start, end, repl in incoming:
+            # Keep existing edits that lie entirely before this one
+            while i < len(existing) and existing[i][1] <= start and existing[i][0] < start:
+                merged.append(existing[i])
+                last_end = existing[i][1]
+                i += 1
+
+            if start < last_end:
+                continue
+            if i < len(existing) and (existing[i][0] < end or existing[i][0] == start):
+                continue
+
+            merged.append((start, end, repl))
+            last_end = end
+            accepted += 1
+
+        merged.extend(existing[i:])
+        self.edits = merged
+        if accepted:
+            self._text = None
+            self._segments = None
+        return accepted
+
+    def checkpoint(self) -> List[Tuple[int, int, object]]:
+        """The edit log as it is now, for rollback(). add_edits() never changes a log in place"""
+        return self.edits
+
+    def rollback(self, checkpoint: List[Tuple[int, int, object]]):
+        """Drop every edit added since checkpoint() returned `checkpoint`"""
+        if checkpoint is not self.edits:
+            self.edits = checkpoint
+            self._text = None
+            self._segments = None
+
+    def output_length(self) -> int:
+        """Length of text() without rendering it"""
+        if self._text is not None:
+            return len(self._text)
+        return len(self.source) + sum(len(repl) - (end - start) for start, end, repl in self.edits)
+
+    def sub(self, pattern, repl: Callable, flags: int = 0) -> int:
+        """
+        Like re.sub, but records an edit per match instead of building a new string.
+
+        `repl` receives the match object and returns the replacement; returning the
+        matched text (or None) leaves the match untouched.
+        """
+        edits = []
+        for match in re.finditer(pattern, self.source, flags):
+            replacement = repl(match)
+            if replacement is not None:
+                edits.append((match.start(), match.end(), replacement))
+        return self.add_edits(edits)
+
+    def _pieces(self):
+        """Yield the output as (src_start, src_end, replacement) pieces, replacement is None for copies"""
+        pos = 0
+        for start, end, repl in self.edits:
+            if start > pos:
+                yield pos, start, None
+            yield start, end, repl
+            pos = end
+        if pos < len(self.source):
+            yield pos, len(self.source), None
+
+    def text(self):
+        """Render the source with all edits applied"""
+        if self._text is None:
+            if not self.edits:
+                self._text = self.source[:]
+            else:
+                self._text = self.source[:0].join(
+                    self.source[start:end] if repl is None else repl
+                    for start, end, repl in self._pieces()
+                )
+        return self._text
+
+    def write_to(self, out) -> int:
+        """Stream the rendered output to a binary file object without building it in memory"""
+        view = memoryview(self.source)
+        written = 0
+        try:
+            for start, end, repl in self._pieces():
+                written += out.write(view[start:end] if repl is None else repl)
+        finally:
+            view.release()
+        return written
+
+    def commit(self) -> 'SourceDocument':
+        """Start a new layer whose source is the current output"""
+        return SourceDocument(self.text(), parent=self)
+
+    def segments(self) -> List[Tuple[int, int, int, bool]]:
+        """
+        Piece table of this layer as (out_start, src_start, src_end, edited) tuples.
+
+        Copied pieces map offset for offset, edited pieces map as a whole to the
+        span they replaced.
+        """
+        if self._segments is None:
+            segments = []
+            out = 0
+            for start, end, repl in self._pieces():
+                segments.append((out, start, end, repl is not None))
+                out += (end - start) if repl is None else len(repl)
+            self._segments = segments
+        return self._segments
+
+    def layer_offset(self, offset: int) -> int:
+        """Map an output offset of this layer to an offset in its own source"""
+        segments = self.segments()
+        if not segments:
+            return offset
+        i = bisect.bisect_right(segments, (offset, float('inf'))) - 1
+        out_start, src_start, src_end, edited = segments[max(i, 0)]
+        if edited:
+            return src_start
+        return min(src_start + (offset - out_start), src_end)
+
+    def original_offset(self, offset: int) -> int:
+        """Map an output offset back to the offset in the very first source it came from"""
+        doc = self
+        while doc is not None:
+            offset = doc.layer_offset(offset)
+            doc = doc.parent
+        return offset
+
+    def root(self) -> 'SourceDocument':
+        doc = self
+        while doc.parent is not None:
+            doc = doc.parent
+        return doc
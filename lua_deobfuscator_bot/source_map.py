@@ -0,0 +1,235 @@
+"""
+Source Maps and Diffs for Deobfuscation Results
+Maps every output region back to the input region that produced it
+"""
+
+import json
+import bisect
+import difflib
+from typing import List, Tuple, Dict
+
+from source_edits import SourceDocument
+
+
+# Source maps are attached by default for inputs up to this size
+SOURCE_MAP_LIMIT = 4 * 1024 * 1024
+
+_BASE64_DIGITS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+# (out_start, out_end, orig_start, orig_end, edited)
+Segment = Tuple[int, int, int, int, bool]
+
+
+def encode_vlq(value: int) -> str:
+    """Base64 VLQ encoding used by the source map `mappings` field"""
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    encoded = ''
+    while True:
+        digit = value & 0x1F
+        value >>= 5
+        if value:
+            digit |= 0x20
+        encoded += _BASE64_DIGITS[digit]
+        if not value:
+            return encoded
+
+
+def _layer_segments(doc: SourceDocument) -> List[Segment]:
+    segments = []
+    table = doc.segments()
+    for i, (out_start, src_start, src_end, edited) in enumerate(table):
+        out_end = table[i + 1][0] if i + 1 < len(table) else len(doc.text())
+        segments.append((out_start, out_end, src_start, src_end, edited))
+    return segments
+
+
+def flatten_segments(doc: SourceDocument) -> List[Segment]:
+    """
+    Compose the piece tables of every layer into one table from final output to original input.
+
+    Each layer is merged with the composed table below it in a single forward
+    sweep, so the cost is linear in the total number of pieces.
+    """
+    layers = []
+    while doc is not None:
+        layers.append(doc)
+        doc = doc.parent
+
+    composed = _layer_segments(layers.pop())
+    while layers:
+        layer = layers.pop()
+        result = []
+        i = 0
+        for out_start, out_end, src_start, src_end, edited in _layer_segments(layer):
+            # Skip pieces of the layer below that end before this one starts
+            while i < len(composed) - 1 and composed[i][1] <= src_start:
+                i += 1
+
+            if edited:
+                below = composed[i] if composed else (0, 0, src_start, src_end, False)
+                j = i
+                while j < len(composed) - 1 and composed[j][1] < src_end:
+                    j += 1
+                last = composed[j] if composed else below
+                orig_start = _map_into(below, src_start, end=False)
+                orig_end = _map_into(last, src_end, end=True)
+                result.append((out_start, out_end, orig_start, max(orig_start, orig_end), True))
+                continue
+
+            # Copied piece: split it wherever the layer below changes pieces
+            pos = src_start
+            j = i
+            while pos < src_end and j < len(composed):
+                b_out_start, b_out_end, b_orig_start, b_orig_end, b_edited = composed[j]
+                piece_end = min(src_end, b_out_end)
+                if piece_end > pos:
+                    new_start = out_start + (pos - src_start)
+                    new_end = out_start + (piece_end - src_start)
+                    if b_edited:
+                        result.append((new_start, new_end, b_orig_start, b_orig_end, True))
+                    else:
+                        offset = b_orig_start + (pos - b_out_start)
+                        result.append((new_start, new_end, offset, offset + (piece_end - pos), False))
+                    pos = piece_end
+                if b_out_end <= pos:
+                    j += 1
+
+        composed = result
+
+    return composed
+
+
+def _map_into(segment: Segment, offset: int, end: bool) -> int:
+    out_start, out_end, orig_start, orig_end, edited = segment
+    if edited:
+        return orig_end if end else orig_start
+    return orig_start + (min(max(offset, out_start), out_end) - out_start)
+
+
+def _line_starts(text: str) -> List[int]:
+    starts = [0]
+    pos = text.find('\n')
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = text.find('\n', pos + 1)
+    return starts
+
+
+def build_source_map(doc: SourceDocument, source_name: str, output_name: str) -> Dict:
+    """
+    Build a version 3 source map for the final output of `doc`.
+
+    There is one mapping at the start of every piece and at the start of every
+    output line inside a piece, all in a single pass over the composed table.
+    """
+    output = doc.text()
+    original = doc.root().source
+    out_lines = _line_starts(output)
+    orig_lines = _line_starts(original)
+
+    lines = [[] for _ in out_lines]
+    line = 0
+    for out_start, out_end, orig_start, orig_end, edited in flatten_segments(doc):
+        if out_end == out_start:
+            continue
+        pos = out_start
+        while True:
+            while line + 1 < len(out_lines) and out_lines[line + 1] <= pos:
+                line += 1
+            orig = orig_start if edited else min(orig_start + (pos - out_start), orig_end)
+            lines[line].append((pos - out_lines[line], orig))
+            # Continue at the next output line inside this piece
+            if line + 1 >= len(out_lines) or out_lines[line + 1] >= out_end:
+                break
+            pos = out_lines[line + 1]
+
+    mappings = []
+    prev_orig_line = 0
+    prev_orig_col = 0
+    for segments in lines:
+        prev_col = 0
+        encoded = []
+        for col, orig in segments:
+            orig_line = bisect.bisect_right(orig_lines, orig) - 1
+            orig_col = orig - orig_lines[orig_line]
+            encoded.append(
+                encode_vlq(col - prev_col) + encode_vlq(0)
+                + encode_vlq(orig_line - prev_orig_line) + encode_vlq(orig_col - prev_orig_col)
+            )
+            prev_col = col
+            prev_orig_line = orig_line
+            prev_orig_col = orig_col
+        mappings.append(','.join(encoded))
+
+    return {
+        'version': 3,
+        'file': output_name,
+        'sources': [source_name],
+        'names': [],
+        'mappings': ';'.join(mappings),
+    }
+
+
+def dump_source_map(doc: SourceDocument, source_name: str, output_name: str) -> str:
+    return json.dumps(build_source_map(doc, source_name, output_name), separators=(',', ':'))
+
+
+def decoded_regions(doc: SourceDocument) -> List[Tuple[int, int, str, str]]:
+    """
+    List every edited region as (line, column, original_text, output_text).
+
+    Lines and columns are 1-based positions in the original input. Edits that
+    only changed whitespace (indentation) are left out.
+    """
+    output = doc.text()
+    original = doc.root().source
+    orig_lines = _line_starts(original)
+
+    regions = []
+    for out_start, out_end, orig_start, orig_end, edited in flatten_segments(doc):
+        if not edited:
+            continue
+        before = original[orig_start:orig_end]
+        after = output[out_start:out_end]
+        if before.strip() == after.strip():
+            continue
+        line = bisect.bisect_right(orig_lines, orig_start) - 1
+        regions.append((line + 1, orig_start - orig_lines[line] + 1, before, after))
+
+    return regions
+
+
+def render_unified_diff(doc: SourceDocument, source_name: str, output_name: str) -> str:
+    """Unified diff of input and output, followed by an index of decoded regions"""
+    original = doc.root().source
+    diff = difflib.unified_diff(
+        original.splitlines(keepends=True),
+        doc.text().splitlines(keepends=True),
+        fromfile=source_name,
+        tofile=output_name,
+    )
+    report = ''.join(line if line.endswith('\n') else line + '\n' for line in diff)
+
+    regions = decoded_regions(doc)
+    if regions:
+        report += f"\n# Decoded regions ({len(regions)})\n"
+        for line, column, before, after in regions:
+            report += f"# {source_name}:{line}:{column}  {_snippet(before)} -> {_snippet(after)}\n"
+
+    return report
+
+
+def render_html_diff(doc: SourceDocument, source_name: str, output_name: str) -> str:
+    """Side-by-side HTML diff of input and output"""
+    return difflib.HtmlDiff(wrapcolumn=100).make_file(
+        doc.root().source.splitlines(),
+        doc.text().splitlines(),
+        fromdesc=source_name,
+        todesc=output_name,
+        context=True,
+    )
+
+
+def _snippet(text: str, limit: int = 80) -> str:
+    text = repr(text)
+    return text if len(text) <= limit else text[:limit - 3] + '...'
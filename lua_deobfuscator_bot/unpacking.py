@@ -0,0 +1,347 @@
+"""
+Bounded Unpacking
+Streaming zlib/gzip/raw deflate and Lua LZW decompression under a per-job output
+budget, so a small literal cannot expand into gigabytes inside a worker
+"""
+
+import re
+import zlib
+import binascii
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from source_edits import SourceDocument
+from base64_literals import literals_for
+
+
+DEFAULT_MAX_OUTPUT = 32 * 1024 * 1024   # all layers of one job together
+DEFAULT_LAYER_OUTPUT = 8 * 1024 * 1024  # a single decompressed layer
+DEFAULT_MAX_DEPTH = 4                   # compressed layers inside compressed layers
+DEFAULT_MAX_LAYERS = 256                # layers removed per job
+
+_CHUNK = 64 * 1024
+
+_BASE64_BLOB = re.compile(rb'[A-Za-z0-9+/\r\n]{16,}={0,2}')
+_BASE36 = re.compile(r'[0-9A-Za-z]+')
+_LZW_LITERAL = re.compile(r'["\']([0-9A-Za-z]{64,})["\']')
+
+# Everything except C0 controls other than tab/LF/CR, and DEL
+_TEXT_BYTES = bytes(b for b in range(256) if not ((b < 0x20 and b not in (9, 10, 13)) or b == 0x7f))
+
+
+def _is_text(data: bytes) -> bool:
+    return not data.translate(None, _TEXT_BYTES)
+
+
+class UnpackBudget:
+    """Output and work limits shared by every unpack of one job"""
+
+    def __init__(
+        self,
+        max_output: int = DEFAULT_MAX_OUTPUT,
+        max_layer_output: int = DEFAULT_LAYER_OUTPUT,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        max_layers: int = DEFAULT_MAX_LAYERS,
+    ):
+        self.remaining = max_output
+        self.max_layer_output = max_layer_output
+        self.max_depth = max_depth
+        self.layers_left = max_layers
+        self.stats = {'layers': 0, 'bytes': 0, 'rejected': 0}
+
+    @property
+    def exhausted(self) -> bool:
+        return self.remaining <= 0 or self.layers_left <= 0
+
+    def limit(self) -> int:
+        """Most bytes the next layer may produce"""
+        return max(0, min(self.remaining, self.max_layer_output))
+
+    def charge(self, size: int, accepted: bool):
+        """
+        Account for `size` bytes of produced output. Output of rejected
+        attempts counts too, so garbage that inflates a long way before
+        failing still uses up the job's budget.
+        """
+        self.remaining -= size
+        if accepted:
+            self.layers_left -= 1
+            self.stats['layers'] += 1
+            self.stats['bytes'] += size
+        else:
+            self.stats['rejected'] += 1
+
+
+_current_budget: contextvars.ContextVar = contextvars.ContextVar('unpack_budget', default=None)
+
+
+@contextmanager
+def job_budget(**limits):
+    """Make one UnpackBudget apply to every unpack inside the block"""
+    budget = UnpackBudget(**limits)
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def current_budget() -> UnpackBudget:
+    """The budget of the running job, or a fresh default one outside of a job"""
+    return _current_budget.get() or UnpackBudget()
+
+
+def inflate(data: bytes, wbits: int, budget: UnpackBudget) -> Optional[bytes]:
+    """
+    Decompress one complete deflate stream without ever holding more than
+    `budget.limit()` bytes of output.
+
+    `wbits` selects the container as in zlib: 15 zlib, 31 gzip, -15 raw deflate.
+    Streams that are truncated, have trailing data or exceed the limit are
+    rejected.
+    """
+    if budget.exhausted:
+        return None
+    limit = budget.limit()
+    decompressor = zlib.decompressobj(wbits)
+    parts = []
+    size = 0
+    pending = data
+    try:
+        while True:
+            chunk = decompressor.decompress(pending, _CHUNK)
+            size += len(chunk)
+            if size > limit:
+                budget.charge(size, accepted=False)
+                return None
+            parts.append(chunk)
+            pending = decompressor.unconsumed_tail
+            if decompressor.eof or (not pending and len(chunk) < _CHUNK):
+                break
+    except zlib.error:
+        budget.charge(size, accepted=False)
+        return None
+
+    if not decompressor.eof or decompressor.unused_data:
+        budget.charge(size, accepted=False)
+        return None
+    budget.charge(size, accepted=True)
+    return b''.join(parts)
+
+
+def lzw_decode_base36(encoded: str, budget: UnpackBudget) -> Optional[bytes]:
+    """
+    Decode the LZW format of IronBrew-style loaders: every code is one base36
+    digit giving the length, followed by that many base36 digits.
+    """
+    if len(encoded) < 2 or not _BASE36.fullmatch(encoded) or budget.exhausted:
+        return None
+    limit = budget.limit()
+    table = {i: bytes([i]) for i in range(256)}
+    next_code = 256
+    pos = 0
+    parts = []
+    size = 0
+
+    def read_code() -> int:
+        nonlocal pos
+        width = int(encoded[pos], 36)
+        code = int(encoded[pos + 1:pos + 1 + width], 36)
+        pos += 1 + width
+        return code
+
+    try:
+        first = read_code()
+        if first > 255:
+            return None
+        previous = table[first]
+        parts.append(previous)
+        size = 1
+        while pos < len(encoded) - 1:
+            code = read_code()
+            if code in table:
+                entry = table[code]
+            elif code == next_code:
+                entry = previous + previous[:1]
+            else:
+                break
+            size += len(entry)
+            if size > limit:
+                break
+            parts.append(entry)
+            table[next_code] = previous + entry[:1]
+            next_code += 1
+            previous = entry
+    except (ValueError, IndexError):
+        pos = -1
+
+    if pos != len(encoded):
+        budget.charge(size, accepted=False)
+        return None
+    budget.charge(size, accepted=True)
+    return b''.join(parts)
+
+
+def lzw_decode_pairs(data: bytes, budget: UnpackBudget) -> Optional[bytes]:
+    """
+    Decode the 'c'-prefixed format of the pure-Lua lualzw library: two bytes
+    per code, (x, 0) is the literal byte x, dictionary codes start at (0, 1)
+    and the dictionary restarts when the codes run out.
+    """
+    if data[:1] != b'c' or len(data) < 3 or len(data) % 2 == 0 or budget.exhausted:
+        return None
+    limit = budget.limit()
+    codes = data[1:]
+    table = {}
+    a, b = 0, 1
+
+    if codes[1] != 0:
+        return None
+    previous = codes[:1]
+    parts = [previous]
+    size = 1
+    for i in range(2, len(codes), 2):
+        # The key the next dictionary entry will get
+        if a >= 256:
+            a, b = 0, b + 1
+            if b >= 256:
+                table = {}
+                b = 1
+        x, y = codes[i], codes[i + 1]
+        if y == 0:
+            entry = codes[i:i + 1]
+        elif (x, y) in table:
+            entry = table[(x, y)]
+        elif (x, y) == (a, b):
+            entry = previous + previous[:1]
+        else:
+            budget.charge(size, accepted=False)
+            return None
+        size += len(entry)
+        if size > limit:
+            budget.charge(size, accepted=False)
+            return None
+        parts.append(entry)
+        table[(a, b)] = previous + entry[:1]
+        a += 1
+        previous = entry
+
+    budget.charge(size, accepted=True)
+    return b''.join(parts)
+
+
+def looks_like_zlib(data: bytes) -> bool:
+    """Whether `data` starts with a valid zlib header (deflate, checksummed CMF/FLG)"""
+    return len(data) >= 2 and data[0] & 0x0f == 8 and (data[0] << 8 | data[1]) % 31 == 0
+
+
+def unpack_once(data: bytes, budget: UnpackBudget) -> Optional[Tuple[str, bytes]]:
+    """Remove one compression layer, returning (format, output)"""
+    if data[:3] == b'\x1f\x8b\x08':
+        result = inflate(data, 31, budget)
+        return ('gzip', result) if result is not None else None
+    if looks_like_zlib(data):
+        result = inflate(data, 15, budget)
+        if result is not None:
+            return 'zlib', result
+    if data[:1] == b'c':
+        result = lzw_decode_pairs(data, budget)
+        if result is not None:
+            return 'lzw', result
+    result = inflate(data, -15, budget)
+    return ('deflate', result) if result is not None else None
+
+
+def unpack_layers(data: bytes, budget: Optional[UnpackBudget] = None) -> Optional[Tuple[list, bytes]]:
+    """
+    Peel compression layers (optionally base64 wrapped) off `data` until none
+    is left or `budget.max_depth` is reached.
+
+    Returns (formats, output), or None if not even one layer could be removed.
+    """
+    budget = budget or current_budget()
+    formats = []
+    while len(formats) < budget.max_depth:
+        # Text only hides another layer when it is base64, binary is tried directly
+        if not _is_text(data):
+            result = unpack_once(data, budget)
+        elif _BASE64_BLOB.fullmatch(data.strip()):
+            try:
+                result = unpack_once(binascii.a2b_base64(data.strip()), budget)
+            except binascii.Error:
+                result = None
+            if result is not None:
+                result = ('base64+' + result[0], result[1])
+        else:
+            result = None
+        if result is None:
+            break
+        formats.append(result[0])
+        data = result[1]
+    return (formats, data) if formats else None
+
+
+def looks_like_lua(text: str) -> bool:
+    return 'function' in text or 'local' in text
+
+
+def lua_long_string(text: str) -> str:
+    """Quote `text` as a Lua long string with a bracket level it does not contain"""
+    level = 0
+    while f']{"=" * level}]' in text:
+        level += 1
+    equals = '=' * level
+    # A leading newline directly after the opening bracket would be dropped by Lua
+    prefix = '\n' if text.startswith('\n') else ''
+    return f'[{equals}[{prefix}{text}]{equals}]'
+
+
+def unpack_compressed_literals(doc: SourceDocument, min_length: int = 32, depth: int = 0) -> SourceDocument:
+    """
+    Replace compressed string literals with the Lua code they unpack to.
+
+    Base64 literals may hold zlib, gzip, raw deflate or lualzw data, possibly
+    several layers deep, and quoted base36 literals may hold IronBrew-style LZW.
+    Unpacked code is searched for further compressed literals until the job's
+    budget depth is reached.
+    """
+    budget = current_budget()
+    literals = literals_for(doc.source)
+    edits = []
+    used = set()
+
+    def add(start: int, end: int, data: bytes):
+        text = data.decode('utf-8', errors='ignore')
+        if not looks_like_lua(text):
+            return
+        if depth + 1 < budget.max_depth and not budget.exhausted:
+            text = unpack_compressed_literals(SourceDocument(text), min_length, depth + 1).text()
+        edits.append((start, end, lua_long_string(text)))
+        used.add(start)
+
+    # Repeated literals are unpacked once
+    unpacked_by_literal = {}
+    for start, end, encoded in literals.literals(min_length=min_length):
+        if encoded not in unpacked_by_literal:
+            if budget.exhausted:
+                break
+            raw = literals.raw(encoded)
+            unpacked_by_literal[encoded] = unpack_layers(raw, budget) if raw is not None else None
+        unpacked = unpacked_by_literal[encoded]
+        if unpacked is not None:
+            add(start, end, unpacked[1])
+
+    for match in _LZW_LITERAL.finditer(doc.source):
+        if budget.exhausted:
+            break
+        if match.start() in used or len(match.group(1)) < min_length:
+            continue
+        data = lzw_decode_base36(match.group(1), budget)
+        if data is None:
+            continue
+        unpacked = unpack_layers(data, budget)
+        add(match.start(), match.end(), unpacked[1] if unpacked is not None else data)
+
+    doc.add_edits(edits)
+    return doc
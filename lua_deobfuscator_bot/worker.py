@@ -0,0 +1,431 @@
+"""
+Deobfuscation Worker
+Stateless process that claims jobs from the queue and runs the engine
+
+Usage:
+    python worker.py --queue sqlite:///jobs.db --concurrency 4
+"""
+
+import os
+import sys
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Sequence
+
+from job_queue import Job, JobQueue, open_queue, new_worker_id
+
+logger = logging.getLogger('lua_deobfuscator.worker')
+
+# Engine modules the worker template imports once. Pool processes are forked
+# from the template, so a new process starts with the engine already loaded
+# while the process that owns the pool (e.g. the bot) never imports it.
+ENGINE_MODULES = [
+    'deobfuscator', 'bytes_engine', 'evaluator', 'unpacking', 'governor', 'source_map', 'signatures',
+    'corpus_index',
+]
+
+
+# Set in pool processes by warm_up(): partial results of running jobs go here
+_progress = None
+
+
+def warm_up(progress=None):
+    """Pool process initializer: build the lazily created engine state before the first job"""
+    global _progress
+    _progress = progress
+    if progress is not None:
+        # Progress is best effort: a process must be able to exit while its
+        # last report is still waiting for a reader
+        progress.cancel_join_thread()
+    from signatures import SignatureDatabase
+    SignatureDatabase.default()
+
+
+def _pool_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context()
+
+
+def progress_queue():
+    """Queue the processes of a warm_executor() report partial results on"""
+    return _pool_context().Queue()
+
+
+def warm_executor(max_workers: int, progress=None) -> ProcessPoolExecutor:
+    """
+    Process pool whose processes are forked from a forkserver template that
+    has the main script and ENGINE_MODULES imported.
+
+    Unlike the default fork start method, the template does not inherit the
+    threads, sockets and heap of the running bot, and unlike spawn, a new
+    process does not import anything again. As with spawn, the main script
+    must keep its startup code under `if __name__ == '__main__'`.
+
+    `progress` is a progress_queue() the processes put the partial results
+    of deobfuscate jobs on.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=warm_up, initargs=(progress,))
+    preload = list(ENGINE_MODULES)
+    # Every process runs the main script again (as __mp_main__, so its
+    # __main__ block is skipped). With the script imported in the template
+    # that only re-executes its top level, its imports are already loaded.
+    main_file = getattr(sys.modules['__main__'], '__file__', None)
+    if main_file:
+        preload.insert(0, os.path.splitext(os.path.basename(main_file))[0])
+    context = _pool_context()
+    context.set_forkserver_preload(preload)
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=warm_up,
+                               initargs=(progress,))
+
+
+def execute_job(kind: str, payload: Dict[str, Any], pass_order: str = 'default',
+                job_id: Optional[str] = None, limits: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run one job and return a JSON-serializable result (runs in a pool process).
+
+    In a warm_executor() process with a progress queue, a deobfuscate job
+    also reports the output of every stage before the last as a partial
+    result of `job_id`. The engine runs under a ResourceGovernor built from
+    `limits`; scoring and indexing the output happen after it.
+
+    A deobfuscate_large job runs the memory-mapped BytesDeobfuscator, string
+    decoding only, from the file at the payload's input_path to its
+    output_path; the script is never loaded into memory.
+    """
+    try:
+        return _execute_job(kind, payload, pass_order, job_id, limits)
+    finally:
+        # Lookups shared between the passes of a job hold its source, the
+        # pool process keeps running after it
+        from lua_syntax import forget_lexed
+        from base64_literals import forget_literals
+        forget_lexed()
+        forget_literals()
+
+
+def _execute_job(kind: str, payload: Dict[str, Any], pass_order: str, job_id: Optional[str],
+                 limits: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    from deobfuscator import STAGES, LuaDeobfuscator
+    from evaluator import score_output
+    from unpacking import job_budget
+    from governor import governed_job, LIMIT_ERRORS, limit_reason
+    from source_map import SOURCE_MAP_LIMIT, dump_source_map, render_unified_diff, render_html_diff
+    from corpus_index import extract_artifacts, script_minhash
+
+    if kind == 'deobfuscate_large':
+        # Both files are on storage shared with the bot, which removes them
+        from bytes_engine import BytesDeobfuscator
+        output_path = payload['output_path']
+        with governed_job(**(limits or {})) as governor:
+            try:
+                detected, edits = BytesDeobfuscator().deobfuscate_file(payload['input_path'], output_path)
+            except LIMIT_ERRORS as e:
+                # Outside the passes: detection or writing the output, the input is the result
+                governor.abort('bytes_engine', limit_reason(e))
+                return {
+                    'output_path': None, 'output_bytes': payload['size'], 'detected': 'Unknown/Custom',
+                    'limits': governor.stats,
+                }
+        return {
+            'output_path': output_path, 'output_bytes': os.path.getsize(output_path), 'detected': detected,
+            'edits': edits, 'limits': governor.stats,
+        }
+
+    deobfuscator = LuaDeobfuscator(pass_order)
+    code = payload['code']
+
+    if kind == 'detect':
+        with governed_job(**(limits or {})) as governor:
+            try:
+                detected = deobfuscator.detect_obfuscator(code)
+            except LIMIT_ERRORS as e:
+                governor.abort('detect', limit_reason(e))
+                detected = 'Unknown/Custom'
+        return {
+            'detected': detected, 'limits': governor.stats,
+            'corpus': {'minhash': script_minhash(code), 'artifacts': extract_artifacts(code, detected)},
+        }
+
+    if kind == 'deobfuscate':
+        timings = {}
+        # Fingerprinted first: the runtime signature pass lexes the same
+        # source and reuses the tokens
+        minhash = script_minhash(code)
+        # Every compressed layer unpacked for this job counts against one budget
+        with job_budget() as budget, governed_job(**(limits or {})) as governor:
+            stages = deobfuscator.deobfuscate_stages(code, timings)
+            for stage, doc, detected in stages:
+                if stage != STAGES[-1] and _progress is not None and job_id is not None:
+                    try:
+                        _progress.put((job_id, {
+                            'stage': stage, 'step': STAGES.index(stage), 'result': doc.text(),
+                            'detected': detected, 'dialect': deobfuscator.current_dialect,
+                            'pass_order': pass_order,
+                        }))
+                    except LIMIT_ERRORS as e:
+                        # The stage just reported is the result
+                        governor.abort('progress', limit_reason(e))
+                        stages.close()
+        text = doc.text()
+        result = {
+            'result': text, 'detected': detected, 'timings': timings, 'unpack': budget.stats,
+            'limits': governor.stats,
+            'pass_order': pass_order, 'dialect': deobfuscator.current_dialect,
+            'score': score_output(text, deobfuscator.current_dialect).as_dict(),
+            # Index entry: the upload is fingerprinted, the strings are read from the decoded output
+            'corpus': {'minhash': minhash, 'artifacts': extract_artifacts(text, detected)},
+        }
+
+        filename = payload.get('filename', 'input.lua')
+        output_name = f'deobfuscated_{filename}'
+        if payload.get('source_map') and len(code) <= SOURCE_MAP_LIMIT:
+            result['source_map'] = dump_source_map(doc, filename, output_name)
+        if payload.get('diff') == 'html':
+            result['diff'] = render_html_diff(doc, filename, output_name)
+        elif payload.get('diff'):
+            result['diff'] = render_unified_diff(doc, filename, output_name)
+        return result
+
+    raise ValueError(f'Unknown job kind: {kind}')
+
+
+class WorkerPool:
+    """
+    Claims jobs from a queue and runs them on a process pool.
+
+    Used both by worker.py on its own and inside the bot process when no
+    external workers are configured.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        concurrency: int = 2,
+        executor: Optional[Executor] = None,
+        pass_orders: Optional[Sequence[str]] = None,
+        variant_budget: float = 20.0,
+        limits: Optional[Dict[str, Any]] = None,
+    ):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.executor = executor
+        # Deobfuscate jobs run every pass order at once, the first one is the baseline
+        if pass_orders is None:
+            from deobfuscator import PASS_ORDERS
+            pass_orders = PASS_ORDERS
+        self.pass_orders = list(pass_orders)
+        self.variant_budget = variant_budget
+        # ResourceGovernor arguments every job runs under
+        self.limits = limits
+        self.worker_id = new_worker_id()
+        self.busy = 0
+        self._tasks = []
+        self._ready: Optional[asyncio.Task] = None
+        self._progress = None
+        # Most advanced stage reported per running job, partial results only replace earlier stages
+        self._partials: Dict[str, int] = {}
+
+    async def start(self):
+        prefork = self.executor is None
+        if prefork:
+            self._progress = progress_queue()
+            self.executor = warm_executor(self.concurrency, self._progress)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        if prefork:
+            # Processes start in the background, jobs claimed meanwhile wait for them
+            self._ready = asyncio.create_task(self._prefork())
+            self._tasks.append(self._ready)
+            self._tasks.append(asyncio.create_task(self._relay_progress()))
+
+    async def ready(self):
+        """Wait until every pool process has started"""
+        if self._ready is not None:
+            await self._ready
+
+    async def _prefork(self):
+        """
+        Start every pool process now instead of on the first jobs. Each
+        submission that finds no idle process starts a new one, so one
+        submission per process starts them all.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self.executor, os.getpid) for _ in range(self.concurrency)
+        ))
+
+    async def _relay_progress(self):
+        """Hand partial results from the pool processes to the queue"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self._progress.get)
+            if item is None:
+                return
+            job_id, partial = item
+            # Variants of one job report the same stages, and a report can
+            # arrive after its job finished
+            step = self._partials.get(job_id)
+            if step is None or partial['step'] <= step:
+                continue
+            self._partials[job_id] = partial['step']
+            try:
+                await self.queue.progress(job_id, partial)
+            except Exception as e:
+                logger.warning('Could not record progress of job %s: %s', job_id[:12], e)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._progress is not None:
+            # Releases the thread blocked in _relay_progress
+            self._progress.put(None)
+            self._progress = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run_forever(self):
+        await self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.claim(self.worker_id)
+            if job is None:
+                await self.queue.wait_for_work()
+                continue
+
+            self.busy += 1
+            self._partials[job.id] = -1
+            try:
+                if job.kind == 'deobfuscate' and len(self.pass_orders) > 1:
+                    result = await self._best_variant(job)
+                else:
+                    result = await loop.run_in_executor(
+                        self.executor, execute_job, job.kind, job.payload, self.pass_orders[0], job.id,
+                        self.limits
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self.queue.fail(job.id, f'{type(e).__name__}: {e}')
+            else:
+                await self.queue.complete(job.id, result)
+            finally:
+                self.busy -= 1
+                self._partials.pop(job.id, None)
+
+
+    async def _best_variant(self, job: Job) -> Dict[str, Any]:
+        """
+        Run the job once per pass order in parallel and keep the best scoring
+        output among those finished within `variant_budget` seconds. The
+        baseline order is always waited for, so there is a result even when
+        the budget runs out first.
+        """
+        loop = asyncio.get_running_loop()
+        futures: List[asyncio.Future] = [
+            loop.run_in_executor(self.executor, execute_job, job.kind, job.payload, order, job.id, self.limits)
+            for order in self.pass_orders
+        ]
+        baseline = futures[0]
+        try:
+            await asyncio.wait(futures, timeout=self.variant_budget)
+            if not baseline.done():
+                await asyncio.wait([baseline])
+        finally:
+            # Variants that have not started are dropped, running ones finish unobserved
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+
+        results = [
+            future.result() for future in futures
+            if future.done() and not future.cancelled() and future.exception() is None
+        ]
+        if not results:
+            # Re-raises the baseline's error
+            return baseline.result()
+        best = max(results, key=lambda r: r['score']['total'])
+        best['variants'] = {r['pass_order']: r['score']['total'] for r in results}
+        return best
+
+
+def main():
+    from deobfuscator import PASS_ORDERS
+    from governor import DEFAULT_CPU_SECONDS, DEFAULT_MEMORY, DEFAULT_MAX_OUTPUT
+
+    parser = argparse.ArgumentParser(description='Run deobfuscation jobs from a shared queue')
+    parser.add_argument('--queue', required=True, help='Queue URL, e.g. sqlite:///jobs.db')
+    parser.add_argument('--concurrency', type=int, default=2, help='Jobs to run in parallel')
+    parser.add_argument('--metrics-port', type=int, default=0, help='Serve /metrics on this port (0 = off)')
+    parser.add_argument('--pass-orders', default=','.join(PASS_ORDERS),
+                        help='Comma separated pass orders to compare, the first is the baseline')
+    parser.add_argument('--variant-budget', type=float, default=20.0,
+                        help='Seconds to wait for alternative pass orders')
+    parser.add_argument('--cpu-limit', type=float, default=DEFAULT_CPU_SECONDS,
+                        help='CPU seconds per job (0 = unlimited)')
+    parser.add_argument('--memory-limit', type=int, default=DEFAULT_MEMORY // 2**20,
+                        help='MiB of address space per job (0 = unlimited)')
+    parser.add_argument('--max-output', type=int, default=DEFAULT_MAX_OUTPUT // 2**20,
+                        help='MiB of output per job, passes that go past it are undone')
+    args = parser.parse_args()
+
+    # SIGTERM shuts down like Ctrl+C so the process pool is torn down too
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+
+    pool = WorkerPool(
+        open_queue(args.queue),
+        concurrency=args.concurrency,
+        pass_orders=args.pass_orders.split(','),
+        variant_budget=args.variant_budget,
+        limits={
+            'cpu_seconds': args.cpu_limit or None,
+            'memory': args.memory_limit * 2**20 or None,
+            'max_output': args.max_output * 2**20,
+        },
+    )
+    print(f'⚙️ Worker {pool.worker_id} consuming {args.queue} with {args.concurrency} process(es)')
+
+    async def run():
+        metrics_runner = None
+        lag_sampler = None
+        if args.metrics_port:
+            import metrics
+
+            async def refresh():
+                metrics.QUEUE_DEPTH.set(await pool.queue.depth())
+                metrics.WORKER_UTILIZATION.set(pool.busy / pool.concurrency)
+
+            metrics_runner = await metrics.start_metrics_server('0.0.0.0', args.metrics_port, refresh)
+            lag_sampler = asyncio.create_task(metrics.sample_loop_lag())
+        try:
+            await pool.run_forever()
+        finally:
+            # The pool is stopped, the sampler and the server go with it
+            if lag_sampler is not None:
+                lag_sampler.cancel()
+                await asyncio.gather(lag_sampler, return_exceptions=True)
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()